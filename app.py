@@ -1,10 +1,14 @@
 import os, sys, time, threading, secrets, webbrowser, socket, inspect, shutil
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from dataclasses import asdict
 from pathlib import Path
+import numpy as np
 import gradio as gr
 
 APP_NAME = "BGMer"
 
-# ===== Idle shutdown (無操作で自動終了) =====
+# ===== Idle unload (無操作でモデルをメモリから外す) =====
 _LAST_ACTIVITY = time.time()
 
 def _touch_activity():
@@ -14,12 +18,24 @@ def _touch_activity():
     return None
 
 def _idle_watchdog(timeout_sec=600, check_every=15):
-    """timeout_sec 秒間 UI 操作や実行が無ければプロセス終了"""
+    """
+    timeout_sec 秒間使われなかったモデルをメモリから外す（プロセスは残るので次の実行はロードだけで済む）。
+    BGMER_IDLE_PARK_CPU=1 なら GPU から CPU に退避するだけにする。BGMER_IDLE_EXIT=1 で従来どおりプロセス終了。
+    """
+    park_cpu = os.environ.get("BGMER_IDLE_PARK_CPU") == "1"
+    exit_on_idle = os.environ.get("BGMER_IDLE_EXIT") == "1"
     while True:
         time.sleep(check_every)
-        if time.time() - _LAST_ACTIVITY > timeout_sec:
+        if exit_on_idle and time.time() - _LAST_ACTIVITY > timeout_sec:
             print(f"[BGMer] Idle > {timeout_sec}s. Shutting down.", flush=True)
             os._exit(0)
+        if MODELS is None:
+            continue
+        evicted = MODELS.evict_idle(timeout_sec, park_cpu=park_cpu)
+        if evicted:
+            rss = MODELS.resident()["rss_bytes"] / 2**20
+            print(f"[BGMer] Idle > {timeout_sec}s. {'Parked' if park_cpu else 'Unloaded'} "
+                  f"{', '.join(evicted)} (rss={rss:.0f}MiB)", flush=True)
 
 # ===== 共通の環境変数 =====
 os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
@@ -125,34 +141,543 @@ def _user_data_dir() -> Path:
 DATA_DIR = _user_data_dir()
 OUTPUT_DIR = DATA_DIR / "outputs"
 OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+# MUSICGEN_DECODE=compile のコンパイル結果を再起動後も使い回す（既定の /tmp だと消える）
+os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", str(DATA_DIR / "compile_cache"))
 
 # ===== 遅延 import（起動を軽くする） =====
 def _lazy_imports():
-    global sample_scene_change_frames, Captioner, build_prompt_from_captions, get_video_duration
-    global MusicGenerator, GenerateConfig, fit_audio_exact_seconds, save_wav, mux_mix_audio_to_video
+    global iter_scene_change_frames, iter_distinct_frames, FRAME_DEDUP, FrameQueue, Captioner
+    global build_prompt_from_captions, probe, SceneEmbedder
+    global MusicGenerator, GenerateConfig, fit_audio, normalize, save_wav, mux_mix_audio_to_video
+    global CaptionCache, BatchScheduler, QUALITY_PRESETS, SCENE_THRESH, mux_mix_pcm_to_video, ModelRegistry
+    global StageMemo, stage_key, file_fingerprint
+    global detect_scene_cuts, sample_segment_frames, plan_segments, render_segments, SegmentPool, MIN_SEGMENT_SEC
+    global TELEMETRY, span, serve_metrics
+    global HostProfile, budget_preset, calibrate, load_profile, save_profile, profile_key, rank_takes
+    from src.media import probe
     from src.video2text import (
-        sample_scene_change_frames, Captioner, build_prompt_from_captions, get_video_duration
+        iter_scene_change_frames, iter_distinct_frames, FRAME_DEDUP, FrameQueue, Captioner,
+        build_prompt_from_captions, detect_scene_cuts, sample_segment_frames
     )
     from src.text2music import (
-        MusicGenerator, GenerateConfig, fit_audio_exact_seconds, save_wav, mux_mix_audio_to_video
+        MusicGenerator, GenerateConfig, save_wav, mux_mix_audio_to_video
     )
-
-# ===== グローバルモデル（初回アクセスで初期化） =====
-CAP = None
-GEN = None
+    from src.audio_fit import fit_audio, normalize
+    from src.mixer import mux_mix_pcm_to_video
+    from src.caption_cache import CaptionCache, file_fingerprint
+    from src.stages import StageMemo, stage_key
+    from src.telemetry import TELEMETRY, span, serve_metrics
+    from src.calibration import HostProfile, budget_preset, calibrate, load_profile, save_profile, profile_key
+    from src.ranking import rank_takes
+    from src.segments import plan_segments, render_segments, SegmentPool, MIN_SEGMENT_SEC
+    from src.scene_embed import SceneEmbedder
+    from src.scheduler import BatchScheduler
+    from src.registry import ModelRegistry
+    from src.presets import QUALITY_PRESETS, SCENE_THRESH
+
+# ===== グローバルモデル（初回アクセスで初期化。モデル毎のロックで二重ロードしない） =====
+MODELS = None
+CAPTION_CACHE = None
+_MODELS_LOCK = threading.Lock()
+
+def _models():
+    global MODELS
+    with _MODELS_LOCK:
+        if MODELS is None:
+            _lazy_imports()
+            MODELS = ModelRegistry()
+            MODELS.register("caption", lambda: Captioner())
+            MODELS.register("music", lambda: MusicGenerator())
+            MODELS.register("embed", lambda: SceneEmbedder(cache_dir=str(DATA_DIR / "embed_cache")))
+    return MODELS
+
+_CAPTION_CACHE_LOCK = threading.Lock()
+
+def _caption_cache():
+    """同じ動画の再実行でシーン検出とキャプションを丸ごと省くためのディスクキャッシュ"""
+    global CAPTION_CACHE
+    with _CAPTION_CACHE_LOCK:
+        if CAPTION_CACHE is None:
+            max_mb = int(os.environ.get("BGMER_CAPTION_CACHE_MB", "64"))
+            CAPTION_CACHE = CaptionCache(str(DATA_DIR / "caption_cache.sqlite3"), max_bytes=max_mb << 20)
+    return CAPTION_CACHE
+
+# ===== 段毎の結果のメモ（パラメータを少し変えた再実行で、入力が変わっていない段を飛ばす） =====
+STAGES = None
+_STAGES_LOCK = threading.Lock()
+
+def _stages():
+    global STAGES
+    with _STAGES_LOCK:
+        if STAGES is None:
+            _lazy_imports()
+            STAGES = StageMemo()
+    return STAGES
+
+# ===== 同時実行：BGMER_BATCH_WINDOW_MS > 0 なら複数ユーザーの生成を 1 回の generate にまとめる =====
+BATCH_WINDOW_MS = float(os.environ.get("BGMER_BATCH_WINDOW_MS", "0"))
+CONCURRENCY = max(1, int(os.environ.get("BGMER_CONCURRENCY", "4"))) if BATCH_WINDOW_MS > 0 else 1
+SCHED = None
+_SCHED_LOCK = threading.Lock()
+
+def _scheduler():
+    global SCHED
+    with _SCHED_LOCK:
+        if SCHED is None:
+            SCHED = BatchScheduler(lambda: _models().get("music"), window_ms=BATCH_WINDOW_MS,
+                                   max_batch=CONCURRENCY)
+    return SCHED
+
+# ===== 候補：BGMER_CANDIDATES > 1 なら 1 回のバッチ生成で複数の候補を作り、指標で良い順に並べる =====
+CANDIDATES = max(1, int(os.environ.get("BGMER_CANDIDATES", "1")))
+
+# ===== シーン区間毎の BGM：BGMER_SEGMENTS=1 で、シーン変化で区切った区間毎にプロンプトを作って並列生成 =====
+SEGMENTS = os.environ.get("BGMER_SEGMENTS", "0") != "0"
+SEGMENT_WORKERS = int(os.environ.get("BGMER_SEGMENT_WORKERS", "0"))  # > 0 ならプロセス並列（多コア CPU 向け）
+SEGMENT_POOL = None
+_SEGMENT_POOL_LOCK = threading.Lock()
+
+def _segment_pool():
+    global SEGMENT_POOL
+    with _SEGMENT_POOL_LOCK:
+        if SEGMENT_POOL is None:
+            _lazy_imports()
+            SEGMENT_POOL = SegmentPool(SEGMENT_WORKERS)
+    return SEGMENT_POOL
 
 def _warmup_models():
-    """UI表示後にバックグラウンドでモデルを温める（失敗しても本処理で再トライ）"""
-    global CAP, GEN
+    """
+    UI表示後にバックグラウンドで解析モデル（プリセットで使うもの）と MusicGen を並列に温める
+    （失敗しても本処理で再トライ）
+    """
     try:
-        _lazy_imports()
-        if CAP is None:
-            CAP = Captioner()
-        if GEN is None:
-            GEN = MusicGenerator()
+        models = _models()
+        engines = sorted({p.get("analysis", "caption") for p in QUALITY_PRESETS.values()})
+        models.load(*engines, "music")
+        if SEGMENTS and SEGMENT_WORKERS > 0:
+            _segment_pool().warmup()
+        if CALIBRATE in ("1", "force"):
+            _host_profile(force=CALIBRATE == "force")
+        print(f"[warmup] rss={models.resident()['rss_bytes'] / 2**20:.0f}MiB", flush=True)
     except Exception as e:
         print("[warmup] failed:", e)
 
+# ===== 予算指定：このマシンで測った各段の速さ（DATA_DIR/calibration.json）から、動画の長さに対して
+#       予測時間が予算に収まるプリセットを選ぶ。BGMER_CALIBRATE=1 なら起動時に（未計測なら）測る =====
+CALIBRATE = os.environ.get("BGMER_CALIBRATE", "0").strip().lower()  # 0 = 予算指定の初回に測る / force = 起動毎に測り直す
+CALIBRATION_PATH = DATA_DIR / "calibration.json"
+HOST_PROFILE = None
+_CALIB_LOCK = threading.Lock()
+
+def _host_profile(force: bool = False) -> "HostProfile":
+    """保存済みの計測結果（同じモデル設定・同じマシンのもの）を読み、無ければその場で測って保存する"""
+    global HOST_PROFILE
+    with _CALIB_LOCK:
+        if HOST_PROFILE is not None and not force:
+            return HOST_PROFILE
+        models = _models()
+        with models.use("caption") as cap, models.use("music") as gen:
+            key = profile_key(cap, gen)
+            prof = None if force else load_profile(str(CALIBRATION_PATH), key)
+            if prof is None:
+                print("[calibrate] measuring caption / decode / ffmpeg speed ...", flush=True)
+                prof = calibrate(cap, gen, str(DATA_DIR / "calibration"), key=key)
+                save_profile(str(CALIBRATION_PATH), prof)
+            print(f"[calibrate] caption {prof.caption_sec_per_frame:.2f}s/frame, "
+                  f"decode {prof.decode_steps_per_sec:.1f} tokens/s", flush=True)
+        HOST_PROFILE = prof
+    return prof
+
+def _budget_preset(budget_sec: float, duration: float, seconds: int) -> dict:
+    p = budget_preset(_host_profile(), duration, budget_sec, seconds=seconds)
+    print(f"[Budget] {budget_sec:g}s → level {p['level']} (frames={p['max_frames']}, "
+          f"tokens/s={p['tokens_per_sec']}, guidance={p['guidance']}), predicted {p['predicted_sec']:g}s"
+          + (" [over budget]" if p.get("over_budget") else ""), flush=True)
+    return p
+
+# ===== 仕上げのミックス：numpy = プロセス内で合成して ffmpeg 1 回 / ffmpeg = WAV を書いて amix =====
+MIX_MODE = os.environ.get("BGMER_MIX", "numpy").strip().lower()
+DUCK_DB = float(os.environ.get("BGMER_DUCK_DB", "0"))  # 例: -8 で元音声の声の下で BGM を 8dB 下げる
+
+def _frames_key(video_key: str, p: dict) -> str:
+    """frames: 動画 + シーン閾値 + 枚数 + 重複除去の有無"""
+    return stage_key(video_key, SCENE_THRESH, p["max_frames"], FRAME_DEDUP)
+
+def _analyze_frames(video, video_key: str, info, p: dict, engine: str):
+    """
+    frames → captions。frames を覚えていなければ ffmpeg の抽出を別スレッドで始め、
+    その間に解析モデルを読み込み、届いたフレームから順にキャプション（または埋め込み）する。
+    戻りは (フレーム毎のキャプション／場面ラベル, 自動プロンプト)。
+    """
+    memo = _stages()
+    fkey = _frames_key(video_key, p)
+    frames = memo.get("frames", fkey)
+    fq = None
+    if frames is None:
+        frame_iter = iter_distinct_frames if FRAME_DEDUP else iter_scene_change_frames
+        fq = FrameQueue(frame_iter(video, scene_thresh=SCENE_THRESH, max_frames=p["max_frames"], info=info))
+    with _models().use(engine) as model:
+        batches = fq.batches(model.batch_size) if fq is not None else [frames]
+        if engine == "embed":
+            result = model.analyze_batches(batches)
+        else:
+            captions = model.caption_batches(batches)
+            result = (captions, build_prompt_from_captions(captions))
+    if fq is not None:
+        memo.put("frames", fkey, fq.frames)
+    return result
+
+def _engine_settings(engine: str) -> dict:
+    """解析エンジン毎の、結果に効く設定（キャッシュキー用）"""
+    if engine == "embed":
+        return {"engine": "embed", "model_id": SceneEmbedder.model_id, "precision": SceneEmbedder.precision}
+    return {"model_id": Captioner.model_id, "decoding": Captioner.decoding, "precision": Captioner.precision}
+
+def _stage_captions(video, video_key: str, info, p: dict):
+    """
+    captions: frames の入力 + 解析エンジンの設定（プリセットの analysis で BLIP / 埋め込みを選ぶ）。
+    プロセス内 → ディスクキャッシュ → 実行の順に探す
+    """
+    memo = _stages()
+    engine = p.get("analysis", "caption")
+    settings = _engine_settings(engine)
+    key = stage_key(_frames_key(video_key, p), settings)
+    with span("captions", engine=engine) as s:
+        hit = memo.get("captions", key)
+        if hit is not None:
+            s.set(source="memo")
+            return hit
+        cache = _caption_cache()
+        cache_key = cache.key_for(video_key, settings.pop("model_id"), SCENE_THRESH, p["max_frames"],
+                                  dedup=FRAME_DEDUP, **settings)
+        result = cache.get(cache_key)
+        if result is not None:
+            s.set(source="disk")
+            print("[BGMer] caption cache hit", flush=True)
+        else:
+            s.set(source="run")
+            result = _analyze_frames(video, video_key, info, p, engine)
+            cache.put(cache_key, *result)
+        memo.put("captions", key, result)
+    return result
+
+def _stage_prompt(video, video_key: str, info, p: dict, edit_prompt) -> str:
+    """prompt: 上書きプロンプトがあればそれだけで決まる（フレーム抽出・キャプションは丸ごと不要）"""
+    override = (edit_prompt or "").strip()
+    if override:
+        return override
+    _, auto_prompt = _stage_captions(video, video_key, info, p)
+    return auto_prompt
+
+def _stage_segments(video, video_key: str, info, p: dict, seconds: int, edit_prompt) -> list:
+    """
+    segments: 動画 + 長さ + 解析エンジンの設定 + 上書きプロンプト → [[開始秒, 終了秒, プロンプト], ...]。
+    シーン変化の検出（動画全体）を別スレッドで回しながら解析モデルを読み、区間毎に数枚だけシークで取って
+    キャプション（または埋め込み）する。上書きプロンプトがあれば全区間それを使う（区間分けは並列化のため残す）。
+    """
+    memo = _stages()
+    engine = p.get("analysis", "caption")
+    override = (edit_prompt or "").strip()
+    key = stage_key(video_key, SCENE_THRESH, seconds, MIN_SEGMENT_SEC, p["max_frames"],
+                    _engine_settings(engine), override)
+    hit = memo.get("segments", key)
+    if hit is not None:
+        return hit
+    with span("segments", engine=engine) as sp, \
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix="bgmer-cuts") as ex:
+        cuts_f = ex.submit(TELEMETRY.wrap(detect_scene_cuts), video, SCENE_THRESH, info)
+        if override:
+            bounds = plan_segments(cuts_f.result(), seconds)
+            prompts = [override] * len(bounds)
+        else:
+            with _models().use(engine) as model:
+                bounds = plan_segments(cuts_f.result(), seconds)
+                per = max(1, min(4, p["max_frames"] // max(1, len(bounds))))
+                groups = sample_segment_frames(video, bounds, per)
+                if engine == "embed":
+                    prompts = [prompt for _, prompt in model.analyze_groups(groups)]
+                else:
+                    flat = model.caption_images([f for g in groups for f in g])
+                    prompts, i = [], 0
+                    for g in groups:
+                        prompts.append(build_prompt_from_captions(flat[i:i + len(g)]))
+                        i += len(g)
+        sp.set(segments=len(bounds))
+    plan = [[s, e, prompt] for (s, e), prompt in zip(bounds, prompts)]
+    for s, e, prompt in plan:
+        print(f"[Segments] {s:6.1f}-{e:6.1f}s {prompt[:60]}", flush=True)
+    memo.put("segments", key, plan)
+    return plan
+
+def _audio_key(prompt, seconds: int, temperature, p: dict) -> str:
+    """prompt は文字列、区間モードなら _stage_segments の区間リスト"""
+    return stage_key(prompt, seconds, float(temperature), float(p["guidance"]), int(p["top_k"]),
+                     int(p["tokens_per_sec"]), os.environ.get("MODEL_ID"), os.environ.get("CPU_PRECISION"),
+                     CANDIDATES)
+
+def _generate_config(seconds: int, temperature, p: dict) -> "GenerateConfig":
+    return GenerateConfig(
+        seconds=seconds,
+        temperature=float(temperature),
+        guidance_scale=float(p["guidance"]),
+        top_k=int(p["top_k"]),
+        tokens_per_sec=int(p["tokens_per_sec"]),
+        seed=secrets.randbits(31),
+    )
+
+# BGM の音量：空ならピークを 1 に、数値（例: -16）ならその LUFS に揃える（ピークは 1 を超えない）
+BGM_LUFS = float(os.environ["BGMER_BGM_LUFS"]) if os.environ.get("BGMER_BGM_LUFS") else None
+
+def _fit(audio, sr: int, seconds: int):
+    """動画の長さちょうど（短ければ拍に合わせたループ）にして音量を揃える（src/audio_fit.py）"""
+    return normalize(fit_audio(audio, sr, seconds), sr, lufs=BGM_LUFS)
+
+def _rank_takes(takes: list) -> list:
+    """候補を指標（src/ranking.py）で良い順に並べる"""
+    sr = takes[0][0]
+    with span("rank", takes=len(takes)):
+        order, metrics = rank_takes([a for _, a in takes], sr)
+    for r, i in enumerate(order, 1):
+        m = metrics[i]
+        print(f"[Takes] {r}: score {m['score']:.3f} (silence {m['silence_ratio']:.2f}, "
+              f"flatness {m['flatness']:.2f}, loudness {m['loudness_db']:.1f}dB, clip {m['clip_ratio']:.4f})",
+              flush=True)
+    return [takes[i][1] for i in order]
+
+def _stage_audio(prompt: str, seconds: int, temperature, p: dict, stream: bool):
+    """
+    audio: プロンプト + 長さ + 生成パラメータ。生成中はチャンクを (sr, chunk), None で yield し、
+    最後に長さを合わせた (sr, [audio, ...]) を return する（yield from で受け取る）。
+    BGMER_CANDIDATES > 1 なら 1 回のバッチ生成で候補を作り、良い順に並べて返す（ストリーミングはしない）。
+    """
+    cfg = _generate_config(seconds, temperature, p)
+    with _models().use("music") as gen:
+        if CANDIDATES > 1:
+            takes = gen.generate_candidates(prompt, cfg, CANDIDATES)
+            sr, ranked = takes[0][0], _rank_takes(takes)
+            yield (sr, ranked[0]), None
+            with span("postprocess", takes=len(ranked)):
+                ranked = [_fit(a, sr, seconds) for a in ranked]
+            return sr, ranked
+        if BATCH_WINDOW_MS > 0:
+            # 他のリクエストとまとめてバッチ生成（ストリーミングはしない）
+            sr, audio = _scheduler().generate(prompt, cfg)
+            yield (sr, audio), None
+        elif not stream:
+            sr, audio = gen.generate(prompt, cfg)
+        else:
+            # 生成しながらチャンクを UI へストリーミング
+            sr, chunks = 32000, []
+            for sr, chunk in gen.generate_stream(prompt, cfg):
+                chunks.append(chunk)
+                yield (sr, chunk), None
+            audio = np.concatenate(chunks) if chunks else np.zeros(sr, dtype=np.float32)
+
+    with span("postprocess"):
+        audio = _fit(audio, sr, seconds)
+    return sr, [audio]
+
+def _stage_segment_audio(plan: list, temperature, p: dict):
+    """
+    audio（区間版）: 区間毎のプロンプトと長さで生成し、等パワーのクロスフェードでつないだ (sr, [audio]) を return する。
+    BGMER_SEGMENT_WORKERS > 0 ならワーカープロセスへ振り分け、0 なら同じモデルで長さの近い区間をバッチ生成する。
+    区間の長さの合計がそのまま動画の長さなので、長さ合わせは要らない。
+    """
+    prompts = [prompt for _, _, prompt in plan]
+    lengths = [e - s for s, e, _ in plan]
+    cfg = _generate_config(int(round(max(lengths))), temperature, p)
+    if SEGMENT_WORKERS > 0:
+        pool = _segment_pool()
+        sr, audio = render_segments(prompts, lengths, cfg, pool.run_jobs, max_batch=pool.max_batch(len(plan)))
+    else:
+        with _models().use("music") as gen:
+            sr, audio = render_segments(prompts, lengths, cfg,
+                                        lambda jobs: [gen.generate_batch(ps, c) for ps, c in jobs])
+    if BGM_LUFS is not None:
+        normalize(audio, sr, lufs=BGM_LUFS)
+    yield (sr, audio), None
+    return sr, [audio]
+
+def _probe(video):
+    with span("probe"):
+        return probe(video)
+
+def _stage_mux(video, info, sr: int, audio, bgm_gain_db, run_dir: Path, keep_wav: bool, others=()) -> str:
+    """mux: 動画 + audio + gain/ducking/ミックス方式。keep_wav なら他の候補も bgm_take<N>.wav に残す"""
+    wav_path = str(run_dir / "bgm.wav")
+    try:
+        with span("mux", mix=MIX_MODE):
+            if keep_wav or MIX_MODE == "ffmpeg":
+                save_wav(wav_path, sr, audio)
+            if keep_wav:
+                for old in run_dir.glob("bgm_take*.wav"):  # 前回の候補（take を変えた再実行など）
+                    old.unlink()
+                for n, other in others:
+                    save_wav(str(run_dir / f"bgm_take{n}.wav"), sr, other)
+            if MIX_MODE == "ffmpeg":
+                return mux_mix_audio_to_video(
+                    video, wav_path, str(run_dir / "video_with_bgm.mp4"),
+                    bgm_gain_db=float(bgm_gain_db), info=info
+                )
+            return mux_mix_pcm_to_video(
+                video, audio, sr, str(run_dir / "video_with_bgm.mp4"),
+                bgm_gain_db=float(bgm_gain_db), duck_db=DUCK_DB, info=info
+            )
+    except FileNotFoundError as e:
+        # ffmpeg 不在など
+        raise gr.Error("ffmpeg が見つかりません。インストールし、PATH を通してください。") from e
+
+def _mux_output(memo, key: str):
+    """覚えている mux 出力がまだ手を付けられずに残っていればそのパス"""
+    hit = memo.get("mux", key)
+    if hit is None:
+        return None
+    path, mtime_ns = hit
+    try:
+        return path if os.stat(path).st_mtime_ns == mtime_ns else None
+    except OSError:
+        return None
+
+# ===== 計測：各段は span（src/telemetry.py）。BGMER_PROFILE_RUNS=N なら最初の N 回を torch.profiler でも記録 =====
+PROFILE_RUNS = int(os.environ.get("BGMER_PROFILE_RUNS", "0"))
+METRICS_PORT = int(os.environ.get("BGMER_METRICS_PORT", "0"))  # UI 起動時に /metrics を出すポート（0 で無し）
+_PROFILE_LOCK = threading.Lock()
+
+def _profile_path(run_id: str):
+    global PROFILE_RUNS
+    with _PROFILE_LOCK:
+        if PROFILE_RUNS <= 0:
+            return None
+        PROFILE_RUNS -= 1
+    return str(DATA_DIR / "profiles" / f"{time.strftime('%Y%m%d-%H%M%S')}-{run_id}.json")
+
+def _traced(steps, run_id: str, level: int, budget_sec: float = 0.0):
+    """1 回の実行を span "run" で包み、結果を bgmer_runs_total に数える"""
+    path = _profile_path(run_id)
+    status = "error"
+    try:
+        with ExitStack() as stack:
+            if path:
+                stack.enter_context(TELEMETRY.profile(path))
+            stack.enter_context(span("run", level=level, budget_sec=budget_sec))
+            yield from steps
+        status = "ok"
+    except GeneratorExit:
+        status = "cancelled"
+        raise
+    finally:
+        TELEMETRY.inc("bgmer_runs_total", status=status)
+
+def _metrics_text(manager=None) -> str:
+    """Prometheus 形式。段毎の時間・ピーク RSS に、その時点のキューの長さを足す"""
+    q = getattr(demo, "_queue", None) if manager is None else None
+    if q is not None:
+        try:
+            TELEMETRY.set_gauge("bgmer_queue_depth", len(q), queue="gradio")
+            TELEMETRY.set_gauge("bgmer_queue_active", q.get_active_worker_count(), queue="gradio")
+        except Exception:  # Gradio のバージョン差
+            pass
+    if SCHED is not None:
+        TELEMETRY.set_gauge("bgmer_queue_depth", SCHED.queue_depth(), queue="batch")
+    if manager is not None:
+        counts = manager.counts()
+        TELEMETRY.set_gauge("bgmer_queue_depth", counts.get("queued", 0), queue="jobs")
+        TELEMETRY.set_gauge("bgmer_queue_active", counts.get("running", 0), queue="jobs")
+    return TELEMETRY.prometheus()
+
+def _run_pipeline(video, level, temperature, edit_prompt, bgm_gain_db, run_dir: Path, stream: bool = True,
+                  keep_wav: bool = False, budget_sec: float = 0.0, take: int = 1):
+    """
+    動画 → キャプション → BGM 生成 → mux の本体（UI とヘッドレス API で共用）。
+    (音声チャンク, None) を順に yield し、最後に (None, 出力 mp4 のパス) を yield する。
+    keep_wav=True なら BGM 単体も run_dir/bgm.wav に残す。
+
+    frames / captions / prompt / audio / mux の各段は自分の入力から作ったキーで覚えておき、
+    入力が変わった段から下流だけをやり直す（gain だけ変えたら mux だけ）。
+    全段の入力が前回と同じ＝もう一度押しただけなら（出力先の run_dir は問わない）、従来どおり別の seed で
+    BGM を作り直す。
+    BGMER_SEGMENTS=1 なら captions / prompt の代わりに segments 段で区間毎のプロンプトを作る。
+    各段の時間は同じ run ID の span として記録する（BGMER_LOG_JSON / /metrics）。
+    budget_sec > 0 なら level の代わりに、予測時間がその秒数に収まるプリセットを使う。
+    BGMER_CANDIDATES > 1 なら audio 段は良い順の候補を覚え、take 番目（1 = 一番良いもの）を使う
+    （take だけ変えた再実行は mux だけ）。
+    """
+    _lazy_imports()
+    run_id = secrets.token_hex(6)
+    budget_sec = float(budget_sec or 0)
+    steps = _pipeline_steps(video, level, temperature, edit_prompt, bgm_gain_db, run_dir, stream, keep_wav,
+                            budget_sec, max(1, int(take or 1)))
+    return (yield from TELEMETRY.bind(_traced(steps, run_id, int(level), budget_sec), run_id))
+
+def _pipeline_steps(video, level, temperature, edit_prompt, bgm_gain_db, run_dir: Path, stream: bool,
+                    keep_wav: bool, budget_sec: float, take: int):
+    _touch_activity()  # 実行開始＝活動
+    _ensure_ffmpeg()
+
+    # 1) MusicGen は裏で読み込み開始（ウォームアップ中・読み込み済みなら何もしない）。
+    #    キャプションモデルはキャッシュミス時だけ必要なので、その場で並行して読む
+    models = _models()
+    if models.peek("music") is None:
+        threading.Thread(target=models.get, args=("music",), daemon=True).start()
+
+    # 2) 動画パス正規化（gr.Video は dict になることがある）
+    if isinstance(video, dict):
+        video = video.get("name") or video.get("path") or video.get("video") or video
+    if not (isinstance(video, str) and os.path.exists(video)):
+        raise gr.Error("動画ファイルを読み込めませんでした。もう一度アップロードしてください。")
+
+    # 3) 推論。長さ・解像度・音声トラック有無は ffprobe 1 回で取って使い回す（内容ハッシュと並行）
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="bgmer-probe") as ex:
+        info_f = ex.submit(TELEMETRY.wrap(_probe), video)
+        with span("fingerprint"):
+            video_key = file_fingerprint(video)  # 再アップロードでパスが変わっても同じ動画なら同じキー
+        info = info_f.result()
+    seconds = max(4, min(120, int(round(info.duration))))
+    if budget_sec > 0:
+        p = _budget_preset(budget_sec, info.duration, seconds)
+    else:
+        p = QUALITY_PRESETS[int(level)]
+    memo = _stages()
+
+    plan = None
+    if SEGMENTS and seconds >= 2 * MIN_SEGMENT_SEC:
+        plan = _stage_segments(video, video_key, info, p, seconds, edit_prompt)
+        if len(plan) < 2:
+            plan = None  # 区切れなかった → 通常の 1 本生成（ストリーミングあり）
+    final_prompt = plan if plan is not None else _stage_prompt(video, video_key, info, p, edit_prompt)
+
+    take = min(take, CANDIDATES) if plan is None else 1  # 区間モードは候補を作らない
+    audio_key = _audio_key(final_prompt, seconds, temperature, p)
+    # 作り直しの判定は出力先を含めない（同時実行・ジョブでは実行毎に run_dir が変わる）
+    inputs_key = stage_key(video_key, audio_key, take, float(bgm_gain_db), DUCK_DB, MIX_MODE, keep_wav)
+    mux_key = stage_key(inputs_key, str(run_dir))
+    cached = memo.get("audio", audio_key)
+    last_mux = memo.get("last", inputs_key)
+    if cached is not None and last_mux is not None and _mux_output(memo, last_mux) is not None:
+        cached = None  # 直前と何も変えずにもう一度 → 作り直し
+    if cached is None:
+        with span("generate", seconds=seconds, segments=len(plan) if plan else 1):
+            if plan is not None:
+                sr, takes = yield from _stage_segment_audio(plan, temperature, p)
+            else:
+                sr, takes = yield from _stage_audio(final_prompt, seconds, temperature, p, stream)
+        memo.put("audio", audio_key, (sr, takes))
+        audio = takes[take - 1]
+        if take > 1:
+            yield (sr, audio), None
+    else:
+        sr, takes = cached
+        audio = takes[take - 1]
+        print("[BGMer] audio reused (only mixing changed)", flush=True)
+        yield (sr, audio), None
+
+    others = [(n, a) for n, a in enumerate(takes, 1) if n != take]
+    out_mp4 = _stage_mux(video, info, sr, audio, bgm_gain_db, run_dir, keep_wav, others)
+    memo.put("mux", mux_key, (out_mp4, os.stat(out_mp4).st_mtime_ns))
+    memo.put("last", inputs_key, mux_key)
+    # mux は最後に 1 回だけ。None で音声ストリームを閉じる
+    yield None, out_mp4
+
 # ===== UI =====
 with gr.Blocks(css=".big-title{font-size:48px!important;font-weight:800;margin:6px 0;}") as demo:
     gr.Markdown("<div class='big-title'>BGMer</div>")
@@ -160,93 +685,48 @@ with gr.Blocks(css=".big-title{font-size:48px!important;font-weight:800;margin:6
         with gr.Column():
             video = gr.Video(label="Upload a video")
             level = gr.Slider(1, 5, value=2, step=1, label="Quality / Speed (1=Light, 5=Heavy)")
+            budget = gr.Number(value=0, precision=0, minimum=0,
+                               label="Latency budget (sec, 0 = use Quality / Speed)")
             temperature = gr.Slider(0.6, 1.6, value=1.0, step=0.05, label="Temperature")
             bgm_gain = gr.Slider(-24, 6, value=-4, step=1, label="BGM gain (dB)")
             edit_prompt = gr.Textbox(label="(Optional) Override prompt", lines=2)
+            # 候補を作る設定のときだけ。生成後に番号を変えて実行すると mux だけやり直す
+            take = gr.Dropdown(list(range(1, CANDIDATES + 1)), value=1, visible=CANDIDATES > 1,
+                               label="Take (1 = best ranked)")
             btn = gr.Button("Run pipeline")
         with gr.Column():
-            audio_out = gr.Audio(label="Generated music", type="numpy")
+            # 生成しながら再生（最初の数秒が出来た時点で鳴り始める）
+            audio_out = gr.Audio(label="Generated music", type="numpy", streaming=True, autoplay=True)
             video_out = gr.Video(label="Video with original+bgm")
 
-    def pipeline(video, level, temperature, edit_prompt, bgm_gain_db):
-        _touch_activity()  # 実行開始＝活動
-        _ensure_ffmpeg()
-        global CAP, GEN
-
-        # 1) 初回実行で確実に初期化
-        if CAP is None or GEN is None:
-            _lazy_imports()
-            if CAP is None:
-                CAP = Captioner()
-            if GEN is None:
-                GEN = MusicGenerator()
-
-        # 2) 動画パス正規化（gr.Video は dict になることがある）
-        if isinstance(video, dict):
-            video = video.get("name") or video.get("path") or video.get("video") or video
-        if not (isinstance(video, str) and os.path.exists(video)):
-            raise gr.Error("動画ファイルを読み込めませんでした。もう一度アップロードしてください。")
-
-        # 3) 推論
-        seconds = max(4, min(120, int(round(get_video_duration(video)))))
-        presets = {
-            1: {"max_frames": 6,  "tokens_per_sec": 32, "guidance": 1.8, "top_k": 120},
-            2: {"max_frames": 8,  "tokens_per_sec": 36, "guidance": 2.0, "top_k": 160},
-            3: {"max_frames": 10, "tokens_per_sec": 40, "guidance": 2.2, "top_k": 200},
-            4: {"max_frames": 12, "tokens_per_sec": 46, "guidance": 2.6, "top_k": 240},
-            5: {"max_frames": 16, "tokens_per_sec": 50, "guidance": 3.0, "top_k": 280},
-        }
-        p = presets[int(level)]
-
-        frames = sample_scene_change_frames(video, scene_thresh=0.35, max_frames=p["max_frames"])
-        captions = CAP.caption_images(frames)
-        auto_prompt = build_prompt_from_captions(captions)
-        final_prompt = (edit_prompt or "").strip() or auto_prompt
-
-        cfg = GenerateConfig(
-            seconds=seconds,
-            temperature=float(temperature),
-            guidance_scale=float(p["guidance"]),
-            top_k=int(p["top_k"]),
-            tokens_per_sec=int(p["tokens_per_sec"]),
-            seed=secrets.randbits(31),
-        )
-        sr, audio = GEN.generate(final_prompt, cfg)
-
-        audio = fit_audio_exact_seconds(audio, seconds, sr)
-
-        wav_path = str(OUTPUT_DIR / "bgm.wav")
-        save_wav(wav_path, sr, audio)
-        try:
-            out_mp4 = mux_mix_audio_to_video(
-                video, wav_path, str(OUTPUT_DIR / "video_with_bgm.mp4"),
-                bgm_gain_db=float(bgm_gain_db)
-            )
-        except FileNotFoundError as e:
-            # ffmpeg 不在など
-            raise gr.Error("ffmpeg が見つかりません。インストールし、PATH を通してください。") from e
-        return (sr, audio), out_mp4
+    def pipeline(video, level, temperature, edit_prompt, bgm_gain_db, budget_sec=0, take=1):
+        # 同時実行時は出力が上書きし合わないよう実行ごとのフォルダへ
+        run_dir = OUTPUT_DIR if CONCURRENCY == 1 else OUTPUT_DIR / f"run_{secrets.token_hex(4)}"
+        yield from _run_pipeline(video, level, temperature, edit_prompt, bgm_gain_db, run_dir,
+                                 budget_sec=budget_sec, take=take)
 
     # ===== アクティビティフック（UI操作＝活動）=====
     demo.load(_touch_activity, inputs=None, outputs=None)        # ページ読み込み
     video.change(_touch_activity, inputs=None, outputs=None)
     level.change(_touch_activity, inputs=None, outputs=None)
+    budget.change(_touch_activity, inputs=None, outputs=None)
     temperature.change(_touch_activity, inputs=None, outputs=None)
     bgm_gain.change(_touch_activity, inputs=None, outputs=None)
     edit_prompt.change(_touch_activity, inputs=None, outputs=None)
+    take.change(_touch_activity, inputs=None, outputs=None)
 
     # Gradio バージョン差分への耐性（古い環境だと concurrency_limit が無い）
     try:
         btn.click(
             pipeline,
-            [video, level, temperature, edit_prompt, bgm_gain],
+            [video, level, temperature, edit_prompt, bgm_gain, budget, take],
             [audio_out, video_out],
-            concurrency_limit=1,
+            concurrency_limit=CONCURRENCY,
         )
     except TypeError:
         btn.click(
             pipeline,
-            [video, level, temperature, edit_prompt, bgm_gain],
+            [video, level, temperature, edit_prompt, bgm_gain, budget, take],
             [audio_out, video_out],
         )
 
@@ -335,24 +815,98 @@ def _safe_launch(demo: gr.Blocks, host: str, port: int):
                 # 最後はローカルに戻してそのまま例外
         raise
 
+# ===== ヘッドレス（ブラウザ無し）ジョブ API =====
+OUTPUT_TTL_SEC = float(os.environ.get("BGMER_OUTPUT_TTL_SEC", "3600"))
+
+def _run_job(job) -> dict:
+    p = job.params
+    out_mp4 = None
+    for _, out_mp4 in _run_pipeline(str(job.input), p["level"], p["temperature"], p["prompt"],
+                                    p["bgm_gain_db"], job.dir, stream=False, keep_wav=True,
+                                    budget_sec=p.get("budget_sec", 0.0)):
+        pass
+    out = {"video": out_mp4, "audio": str(job.dir / "bgm.wav")}
+    # 他の候補（BGMER_CANDIDATES > 1）は GET /jobs/{id}/take2 … で取れる
+    out.update({f.stem[len("bgm_"):]: str(f) for f in sorted(job.dir.glob("bgm_take*.wav"))})
+    return out
+
+def _health_info() -> dict:
+    info = {"memory": _models().resident()}
+    gen = _models().peek("music")
+    if gen is not None:
+        info["text_cache"] = gen.text_cache_stats()
+    if HOST_PROFILE is not None:
+        info["calibration"] = asdict(HOST_PROFILE)
+    return info
+
+def _serve_headless(host: str, port: int):
+    """
+    POST /jobs（multipart: video, level, temperature, bgm_gain_db, prompt, budget_sec）→ GET /jobs/{id} で状態確認
+    → GET /jobs/{id}/video|audio で取得。モデルは UI と同じものを全ジョブで共有する。
+    """
+    import uvicorn
+    from src.jobs import JobManager, create_api
+    workers = int(os.environ.get("BGMER_WORKERS", str(CONCURRENCY)))
+    manager = JobManager(OUTPUT_DIR / "jobs", _run_job, workers=workers, ttl_sec=OUTPUT_TTL_SEC)
+    threading.Thread(target=_warmup_models, daemon=True).start()
+    idle = int(os.environ.get("BGMER_IDLE_TIMEOUT_SEC", "600"))
+    threading.Thread(target=_idle_watchdog, args=(idle, 15), daemon=True).start()
+    print(f"[BGMer] Headless API at http://{host}:{port}/ (workers={workers})", flush=True)
+    api = create_api(manager, health_info=_health_info, metrics=lambda: _metrics_text(manager))
+    uvicorn.run(api, host=host, port=port)
+
+def _output_janitor():
+    """同時実行時に UI が作る run_* フォルダを TTL で掃除"""
+    from src.jobs import sweep_expired
+    while True:
+        time.sleep(max(5.0, min(60.0, OUTPUT_TTL_SEC / 4)))
+        sweep_expired(OUTPUT_DIR, OUTPUT_TTL_SEC, prefix="run_")
+
 def main():
-    # ===== 無操作タイムアウト開始（既定 600 秒 / 環境変数で変更可）=====
+    import argparse
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--headless", action="store_true", help="UI を出さずにジョブ API サーバとして起動")
+    ap.add_argument("--host", default=None)
+    ap.add_argument("--port", type=int, default=None)
+    ap.add_argument("--calibrate", action="store_true", help="このマシンの速さを測り直して保存し、各レベルの予測時間を表示")
+    args, _ = ap.parse_known_args()
+
+    if args.calibrate:
+        prof = _host_profile(force=True)
+        for duration in (15, 30, 60, 120):
+            row = "  ".join(f"L{lv}={prof.predict(duration, QUALITY_PRESETS[lv])['total']:6.1f}s"
+                            for lv in sorted(QUALITY_PRESETS))
+            print(f"[calibrate] {duration:4d}s video: {row}", flush=True)
+        return
+
+    if args.headless:
+        _serve_headless(args.host or "127.0.0.1", args.port or int(os.environ.get("BGMER_API_PORT", "7870")))
+        return
+
+    # ===== 無操作でのモデル解放（既定 600 秒 / 環境変数で変更可）=====
     idle = int(os.environ.get("BGMER_IDLE_TIMEOUT_SEC", "600"))
     threading.Thread(target=_idle_watchdog, args=(idle, 15), daemon=True).start()
+    if CONCURRENCY > 1:
+        threading.Thread(target=_output_janitor, daemon=True).start()
 
     # UIを出してからモデルを温める（体感を軽く）
     threading.Thread(target=_warmup_models, daemon=True).start()
 
     # ポート固定の希望があれば環境変数で上書き
-    base_port = int(os.environ.get("GRADIO_SERVER_PORT", "7860"))
+    base_port = args.port or int(os.environ.get("GRADIO_SERVER_PORT", "7860"))
     port = find_free_port(start=base_port, tries=30)
 
-    host = "127.0.0.1"
+    host = args.host or "127.0.0.1"
     url = f"http://{host}:{port}/"
     print(f"[BGMer] Launching UI at {url}", flush=True)
 
+    if METRICS_PORT:
+        _lazy_imports()
+        serve_metrics(METRICS_PORT, _metrics_text)
+        print(f"[BGMer] Metrics at http://127.0.0.1:{METRICS_PORT}/metrics", flush=True)
+
     # ブロッキング起動（=プロセスは待機し続ける）
-    demo.queue(default_concurrency_limit=1, max_size=8, status_update_rate=2.5)
+    demo.queue(default_concurrency_limit=CONCURRENCY, max_size=8 * CONCURRENCY, status_update_rate=2.5)
     _safe_launch(demo, host, port)
 
 if __name__ == "__main__":
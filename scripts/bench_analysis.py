@@ -0,0 +1,73 @@
+import argparse
+import json
+import tempfile
+import time
+
+from src.presets import SCENE_THRESH
+from src.scene_embed import SceneEmbedder
+from src.video2text import Captioner, build_prompt_from_captions, sample_scene_change_frames
+
+def _tempo_mood(prompt: str):
+    """compose_prompt の先頭 "tempo, mood modern track ..." から (tempo, mood)"""
+    tempo, rest = prompt.split(",", 1)
+    return tempo.strip(), rest.strip().split(" ", 1)[0]
+
+def _best_of(fn, repeat: int):
+    best, out = float("inf"), None
+    for _ in range(max(1, repeat)):
+        t0 = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, out
+
+def main():
+    ap = argparse.ArgumentParser(description="シーン解析：BLIP キャプション vs 埋め込み（固定語彙）の速度とプロンプト比較")
+    ap.add_argument("videos", nargs="+")
+    ap.add_argument("--frames", type=int, default=12)
+    ap.add_argument("--decoding", default="greedy", choices=["sample", "greedy", "beam"])
+    ap.add_argument("--repeat", type=int, default=2)
+    ap.add_argument("--json", default=None, help="結果を JSON で保存")
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    cap = Captioner(decoding=args.decoding)
+    cap_load = time.perf_counter() - t0
+    with tempfile.TemporaryDirectory() as tmp:
+        t0 = time.perf_counter()
+        emb = SceneEmbedder(cache_dir=tmp)
+        emb_load = time.perf_counter() - t0          # 語彙の埋め込み計算込み
+        t0 = time.perf_counter()
+        SceneEmbedder(cache_dir=tmp)
+        emb_load_cached = time.perf_counter() - t0   # 2 回目は保存した語彙を読むだけ
+    print(f"load: caption {cap_load:.1f}s  embed {emb_load:.1f}s (vocab cached: {emb_load_cached:.1f}s)")
+
+    results = []
+    for video in args.videos:
+        frames = sample_scene_change_frames(video, scene_thresh=SCENE_THRESH, max_frames=args.frames)
+        cap.caption_images(frames[:1])  # warmup
+        emb.analyze(frames[:1])
+        cap_sec, captions = _best_of(lambda frames=frames: cap.caption_images(frames), args.repeat)
+        emb_sec, (labels, emb_prompt) = _best_of(lambda frames=frames: emb.analyze(frames), args.repeat)
+        cap_prompt = build_prompt_from_captions(captions)
+        res = {
+            "video": video, "frames": len(frames),
+            "caption_sec": cap_sec, "embed_sec": emb_sec, "speedup": cap_sec / max(emb_sec, 1e-9),
+            "caption_prompt": cap_prompt, "embed_prompt": emb_prompt,
+            "tempo_match": _tempo_mood(cap_prompt)[0] == _tempo_mood(emb_prompt)[0],
+            "mood_match": _tempo_mood(cap_prompt)[1] == _tempo_mood(emb_prompt)[1],
+            "captions": captions, "labels": labels,
+        }
+        results.append(res)
+        print(f"{video}: {len(frames)} frames  caption {cap_sec:6.2f}s  embed {emb_sec:6.2f}s  "
+              f"x{res['speedup']:.1f}  tempo={'=' if res['tempo_match'] else '≠'} mood={'=' if res['mood_match'] else '≠'}")
+        print(f"  caption: {_tempo_mood(cap_prompt)}  {captions[:3]}")
+        print(f"  embed  : {_tempo_mood(emb_prompt)}  {list(dict.fromkeys(labels))[:3]}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"caption_model": cap.model_id, "embed_model": emb.model_id, "load_sec": {
+                "caption": cap_load, "embed": emb_load, "embed_vocab_cached": emb_load_cached}, "results": results},
+                f, indent=2, ensure_ascii=False)
+
+if __name__ == "__main__":
+    main()
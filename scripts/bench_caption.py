@@ -0,0 +1,43 @@
+import argparse
+import time
+import numpy as np
+from PIL import Image
+from src.video2text import sample_scene_change_frames, Captioner
+
+def _synthetic_frames(n: int, size: int = 640):
+    """動画が無いとき用のランダム画像（キャプション内容ではなく速度だけを見る）"""
+    rng = np.random.default_rng(0)
+    return [Image.fromarray(rng.integers(0, 256, (size * 9 // 16, size, 3), dtype=np.uint8)) for _ in range(n)]
+
+def main():
+    ap = argparse.ArgumentParser(description="フレーム毎 vs バッチ キャプションのスループット比較")
+    ap.add_argument("--video", default=None, help="省略時はランダム画像を使用")
+    ap.add_argument("--frames", type=int, default=16)
+    ap.add_argument("--batch_sizes", default="1,4,8,16")
+    ap.add_argument("--decoding", default="greedy", choices=["sample", "greedy", "beam"])
+    ap.add_argument("--repeat", type=int, default=2)
+    args = ap.parse_args()
+
+    if args.video:
+        frames = sample_scene_change_frames(args.video, max_frames=args.frames, dedup=False)
+    else:
+        frames = _synthetic_frames(args.frames)
+    print(f"frames={len(frames)} decoding={args.decoding}")
+
+    cap = Captioner(decoding=args.decoding)
+    cap.caption_images(frames[:1], batch_size=1)  # warmup
+
+    base = None
+    for bs in [int(b) for b in args.batch_sizes.split(",") if b.strip()]:
+        best = float("inf")
+        for _ in range(max(1, args.repeat)):
+            t0 = time.perf_counter()
+            caps = cap.caption_images(frames, batch_size=bs)
+            best = min(best, time.perf_counter() - t0)
+        fps = len(frames) / best
+        base = base or fps
+        print(f"batch_size={bs:>3}  {best:7.2f}s  {fps:6.2f} frames/s  x{fps / base:.2f}")
+    print("sample captions:", caps[:3])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import argparse
+import json
+import time
+
+import numpy as np
+import torch
+from transformers.generation.streamers import BaseStreamer
+
+from src.text2music import GenerateConfig, MusicGenerator
+
+class _Clock(BaseStreamer):
+    """トークンが出てくる時刻を記録する（eager も static も同じ streamer で測れる）"""
+
+    def __init__(self):
+        self.times = []
+
+    def put(self, value):
+        self.times.append(time.perf_counter())
+
+    def end(self):
+        pass
+
+def _run(gen: MusicGenerator, prompt: str, cfg: GenerateConfig) -> np.ndarray:
+    inputs = gen.processor(text=[prompt], padding=True, return_tensors="pt").to(gen.device)
+    clock = _Clock()
+    gen._run(inputs, cfg, gen._max_new_tokens(cfg), streamer=clock)
+    return np.diff(clock.times[1:])  # 最初の put は BOS 列
+
+def main():
+    ap = argparse.ArgumentParser(description="MusicGen の生成ループ（eager / static / compile）の 1 トークン当たりレイテンシ")
+    ap.add_argument("--modes", default="eager,static,compile")
+    ap.add_argument("--seconds", type=int, default=8)
+    ap.add_argument("--prompt", default="calm lo-fi hip hop, mellow piano, soft drums, 80 bpm")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--threads", type=int, default=None)
+    ap.add_argument("--json", default=None, help="結果を JSON で保存")
+    args = ap.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    cfg = GenerateConfig(seconds=args.seconds, seed=0, long_form=False)
+    results = []
+    for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+        gen = MusicGenerator(decode=mode)
+        t0 = time.perf_counter()
+        _run(gen, args.prompt, cfg)  # compile はここで（キャッシュがあれば読み込むだけ）
+        first = time.perf_counter() - t0
+        steps = np.concatenate([_run(gen, args.prompt, cfg) for _ in range(max(1, args.repeat))])
+        res = {
+            "mode": gen.decode,  # compile に失敗して eager に落ちた場合はそれが分かるように
+            "first_call_sec": first,
+            "ms_per_token_p50": float(np.percentile(steps, 50) * 1000),
+            "ms_per_token_p95": float(np.percentile(steps, 95) * 1000),
+            "tokens_per_sec": float(1.0 / np.mean(steps)),
+        }
+        results.append(res)
+        print(f"{mode:<8} -> {res['mode']:<8} first={first:6.1f}s  p50={res['ms_per_token_p50']:6.2f}ms  "
+              f"p95={res['ms_per_token_p95']:6.2f}ms  {res['tokens_per_sec']:7.1f} tok/s", flush=True)
+        del gen
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"seconds": args.seconds, "threads": torch.get_num_threads(), "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import torch
+import transformers
+
+from src.media import probe
+from src.mixer import mux_mix_pcm_to_video
+from src.presets import QUALITY_PRESETS, SCENE_THRESH
+from src.registry import peak_rss, process_rss
+from src.text2music import (GenerateConfig, MusicGenerator, fit_audio_exact_seconds, mux_mix_audio_to_video,
+                            save_wav)
+from src.video2text import Captioner, build_prompt_from_captions, sample_scene_change_frames
+from tests.synthetic import make_tiny_blip, make_tiny_musicgen, make_video
+
+# 秒数, 幅x高さ, fps, 音声トラックの有無
+DEFAULT_CASES = ("5,640x360,30,audio", "20,1280x720,30,audio", "20,640x360,60,none", "60,854x480,30,audio")
+QUICK_CASES = ("5,640x360,30,audio", "8,320x240,25,none")
+
+# ===== 計測 =====
+class _PeakRss:
+    """with の間、別スレッドで RSS を sample_ms 毎に見て最大値を残す"""
+
+    def __init__(self, sample_ms: float = 5.0):
+        self.sample_ms = sample_ms
+        self.peak = 0
+
+    def _watch(self):
+        while not self._stop.wait(self.sample_ms / 1000):
+            self.peak = max(self.peak, process_rss())
+
+    def __enter__(self):
+        self.peak = process_rss()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._watch, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, process_rss())
+
+class _Stages:
+    """段毎に (秒, 処理量, ピーク RSS) を記録する。同じ段を repeat 回測ったら秒は中央値"""
+
+    def __init__(self):
+        self.samples = {}
+
+    @contextmanager
+    def stage(self, name: str, amount: float, unit: str):
+        """処理量が終わるまで分からない段は、yield した dict の "amount" を書き換える"""
+        m = {"amount": amount}
+        with _PeakRss() as rss:
+            t0 = time.perf_counter()
+            yield m
+            sec = time.perf_counter() - t0
+        rec = self.samples.setdefault(name, {"sec": [], "amount": m["amount"], "unit": unit, "peak_rss_mb": 0.0})
+        rec["sec"].append(sec)
+        rec["peak_rss_mb"] = max(rec["peak_rss_mb"], rss.peak / 2**20)
+
+    def report(self) -> dict:
+        out = {}
+        for name, rec in self.samples.items():
+            sec = statistics.median(rec["sec"])
+            out[name] = {"sec": sec, "sec_min": min(rec["sec"]), "throughput": rec["amount"] / max(sec, 1e-9),
+                         "unit": rec["unit"], "peak_rss_mb": rec["peak_rss_mb"]}
+        return out
+
+def _parse_case(spec: str) -> dict:
+    seconds, size, fps, audio = [s.strip() for s in spec.split(",")]
+    return {"seconds": float(seconds), "size": size, "fps": int(fps), "audio": audio in ("audio", "1", "yes")}
+
+def _case_name(c: dict) -> str:
+    return f"{c['seconds']:g}s_{c['size']}_{c['fps']}fps_{'audio' if c['audio'] else 'noaudio'}"
+
+def run_case(video: str, case: dict, cap: Captioner, gen: MusicGenerator, p: dict, mix: str, work: str,
+             repeat: int) -> dict:
+    """app.py の _run_pipeline と同じ順（probe → frames → captions → generate → fit → wav → mux）で段毎に測る"""
+    st = _Stages()
+    for r in range(max(1, repeat)):
+        if r == 0:  # probe は結果をプロセス内で覚えるので、初回（アップロード直後と同じ）だけ測る
+            with st.stage("probe", 1, "calls/s"):
+                info = probe(video)
+        seconds = max(4, min(120, int(round(info.duration))))
+        with st.stage("frames", 0, "frames/s") as m:
+            frames = sample_scene_change_frames(video, scene_thresh=SCENE_THRESH, max_frames=p["max_frames"],
+                                                info=info)
+            m["amount"] = len(frames)
+        with st.stage("captions", len(frames), "frames/s"):
+            captions = cap.caption_images(frames)
+        prompt = build_prompt_from_captions(captions)
+        cfg = GenerateConfig(seconds=seconds, temperature=1.0, guidance_scale=float(p["guidance"]),
+                             top_k=int(p["top_k"]), tokens_per_sec=int(p["tokens_per_sec"]), seed=r)
+        with st.stage("generate", seconds, "audio-s/s"):
+            sr, audio = gen.generate(prompt, cfg)
+        with st.stage("fit", seconds, "audio-s/s"):
+            audio = fit_audio_exact_seconds(audio, sr, seconds)
+        wav = os.path.join(work, "bgm.wav")
+        with st.stage("save_wav", seconds, "audio-s/s"):
+            save_wav(wav, sr, audio)
+        out = os.path.join(work, "out.mp4")
+        with st.stage("mux", info.duration, "video-s/s"):
+            if mix == "ffmpeg":
+                mux_mix_audio_to_video(video, wav, out, bgm_gain_db=-4, info=info)
+            else:
+                mux_mix_pcm_to_video(video, audio, sr, out, bgm_gain_db=-4, info=info)
+    stages = st.report()
+    total = sum(s["sec"] for s in stages.values())
+    return {"name": _case_name(case), "video": case, "frames": len(frames), "stages": stages,
+            "total_sec": total, "realtime_factor": total / max(info.duration, 1e-9)}
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+def compare(report: dict, base: dict, tolerance: float, min_sec: float) -> list:
+    """base より (1 + tolerance) 倍以上遅くなった段（min_sec 未満の差は無視）を返し、比較表を表示する"""
+    base_cases = {c["name"]: c for c in base.get("cases", [])}
+    slower = []
+    print(f"\ncompare with {base.get('meta', {}).get('commit') or '(base)'}:")
+    for case in report["cases"]:
+        old = base_cases.get(case["name"])
+        if old is None:
+            continue
+        for name, s in case["stages"].items():
+            o = old["stages"].get(name)
+            if o is None:
+                continue
+            ratio = s["sec"] / max(o["sec"], 1e-9)
+            bad = ratio > 1 + tolerance and s["sec"] - o["sec"] > min_sec
+            print(f"  {case['name']:<32} {name:<9} {o['sec']:7.3f}s -> {s['sec']:7.3f}s  x{ratio:5.2f}"
+                  f"  rss {o['peak_rss_mb']:6.0f} -> {s['peak_rss_mb']:6.0f}MiB{'  <-- slower' if bad else ''}")
+            if bad:
+                slower.append((case["name"], name, ratio))
+    return slower
+
+def main():
+    ap = argparse.ArgumentParser(description="合成動画と小さなランダムモデルで、パイプライン全段をオフラインで計測する")
+    ap.add_argument("--case", action="append", default=None,
+                    help="秒数,幅x高さ,fps,audio|none（複数指定可）。既定は 4 ケース")
+    ap.add_argument("--quick", action="store_true", help="短い 2 ケースだけ")
+    ap.add_argument("--level", type=int, default=2, help="品質プリセット（フレーム数・生成パラメータ）")
+    ap.add_argument("--mix", default=os.getenv("BGMER_MIX", "numpy"), choices=["numpy", "ffmpeg"])
+    ap.add_argument("--repeat", type=int, default=2)
+    ap.add_argument("--threads", type=int, default=None)
+    ap.add_argument("--real-models", action="store_true",
+                    help="小さなランダムモデルの代わりに CAPTION_MODEL / MODEL_ID（既定の重み）を使う")
+    ap.add_argument("--json", default=None, help="結果を JSON で保存")
+    ap.add_argument("--compare", default=None, help="以前の --json と比べ、遅くなった段があれば終了コード 1")
+    ap.add_argument("--tolerance", type=float, default=0.25)
+    ap.add_argument("--min-sec", type=float, default=0.05, help="これ未満の差は遅くなったと見なさない")
+    args = ap.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    specs = args.case or (QUICK_CASES if args.quick else DEFAULT_CASES)
+    cases = [_parse_case(s) for s in specs]
+    p = QUALITY_PRESETS[args.level]
+    with tempfile.TemporaryDirectory(prefix="bgmer_bench_") as work:
+        t0 = time.perf_counter()
+        videos = [make_video(os.path.join(work, f"{_case_name(c)}.mp4"), c["seconds"], c["size"], c["fps"],
+                             c["audio"]) for c in cases]
+        print(f"synthesized {len(videos)} videos in {time.perf_counter() - t0:.1f}s", flush=True)
+
+        load = {}
+        with _PeakRss() as rss:
+            t0 = time.perf_counter()
+            cap = Captioner() if args.real_models else Captioner(model_id=make_tiny_blip(os.path.join(work, "blip")))
+            load["caption_sec"] = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            gen = MusicGenerator() if args.real_models else \
+                MusicGenerator(model_id=make_tiny_musicgen(os.path.join(work, "musicgen")))
+            load["music_sec"] = time.perf_counter() - t0
+        load["peak_rss_mb"] = rss.peak / 2**20
+
+        results = []
+        for video, case in zip(videos, cases):
+            res = run_case(video, case, cap, gen, p, args.mix, work, args.repeat)
+            results.append(res)
+            print(f"{res['name']:<32} total {res['total_sec']:6.2f}s (x{res['realtime_factor']:.2f} realtime)  "
+                  + "  ".join(f"{k}={v['sec']:.3f}s" for k, v in res["stages"].items()), flush=True)
+
+    models = "tiny-random"
+    if args.real_models:
+        models = {"caption": cap.model_id, "music": os.getenv("MODEL_ID", "facebook/musicgen-small")}
+    report = {
+        "meta": {
+            "commit": _git_commit(), "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(), "torch": torch.__version__,
+            "transformers": transformers.__version__, "platform": platform.platform(),
+            "cpu_count": os.cpu_count(), "torch_threads": torch.get_num_threads(),
+            "models": models, "level": args.level, "mix": args.mix, "repeat": args.repeat,
+        },
+        "load": load,
+        "cases": results,
+        "peak_rss_mb": peak_rss() / 2**20,
+    }
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            slower = compare(report, json.load(f), args.tolerance, args.min_sec)
+        if slower:
+            print(f"{len(slower)} stage(s) slower than base by more than {args.tolerance:.0%}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import torch
+
+from src.precision import CPU_PRECISIONS
+from src.registry import peak_rss
+from src.text2music import GenerateConfig, MusicGenerator
+from src.video2text import Captioner, sample_scene_change_frames
+
+def _peak_rss_mb() -> float:
+    return peak_rss() / 2**20
+
+def _synthetic_frames(n: int):
+    rng = np.random.default_rng(0)
+    return [rng.integers(0, 256, (360, 640, 3), dtype=np.uint8) for _ in range(n)]
+
+def _delayed(codes: torch.Tensor, bos: int, pad: int) -> torch.Tensor:
+    """(K, T) のコードを delay pattern（codebook k のフレーム f を列 f+k+1、列 0 は BOS）に並べる"""
+    K, T = codes.shape
+    out = torch.full((K, T + K + 1), pad, dtype=torch.long)
+    out[:, 0] = bos
+    for k in range(K):
+        out[k, k + 1:k + 1 + T] = codes[k]
+    return out
+
+def _teacher_forced_logits(gen: MusicGenerator, prompt: str, ref_audio: np.ndarray) -> np.ndarray:
+    """
+    fp32 で作った参照音声を EnCodec（どのモードでも fp32）でコード化し、同じコード列を
+    デコーダに teacher forcing で通したときの logits。モード間で同じ入力に対する出力を比べられる。
+    """
+    m = gen.model
+    with torch.no_grad():
+        x = torch.from_numpy(ref_audio)[None, None].to(gen.device, dtype=gen.dtype)
+        codes = m.audio_encoder.encode(x).audio_codes[0, 0].cpu()
+        dec = m.generation_config
+        ids = _delayed(codes, int(dec.decoder_start_token_id), int(dec.pad_token_id))[:, :-1]
+        text = gen.processor(text=[prompt], padding=True, return_tensors="pt").to(gen.device)
+        out = m(**text, decoder_input_ids=ids.to(gen.device))
+    return out.logits.float().cpu().numpy()
+
+def worker(mode: str, args) -> dict:
+    torch.manual_seed(0)
+    res = {"mode": mode}
+    t0 = time.perf_counter()
+    gen = MusicGenerator(precision=mode)
+    cap = Captioner(precision=mode, decoding="greedy")
+    res["load_sec"] = time.perf_counter() - t0
+    res["rss_after_load_mb"] = _peak_rss_mb()
+
+    # 生成速度（サンプリング、seed 固定）
+    cfg = GenerateConfig(seconds=args.seconds, seed=0, long_form=False)
+    gen.generate(args.prompt, GenerateConfig(seconds=1, seed=0))  # warmup
+    t0 = time.perf_counter()
+    sr, audio = gen.generate(args.prompt, cfg)
+    wall = time.perf_counter() - t0
+    tokens = len(audio) / sr * gen._frame_rate()
+    res.update(gen_sec=wall, tokens_per_sec=tokens / wall, rtf=wall / (len(audio) / sr))
+
+    # 品質：top_k=1 の生成音声（ほぼ決定的）と teacher forcing の logits
+    _, greedy = gen.generate(args.prompt, GenerateConfig(seconds=args.seconds, seed=0, top_k=1, long_form=False))
+    ref = np.load(args.ref)["audio"] if args.ref else greedy
+    logits = _teacher_forced_logits(gen, args.prompt, ref)
+
+    # キャプション（greedy）
+    frames = sample_scene_change_frames(args.video, max_frames=args.frames, dedup=False) if args.video \
+        else _synthetic_frames(args.frames)
+    cap.caption_images(frames[:1])
+    t0 = time.perf_counter()
+    captions = cap.caption_images(frames)
+    res["caption_fps"] = len(frames) / (time.perf_counter() - t0)
+    res["peak_rss_mb"] = _peak_rss_mb()
+
+    np.savez(args.out, greedy=greedy, logits=logits, captions=np.array(captions, dtype=object))
+    return res
+
+def _spectral_similarity(a: np.ndarray, b: np.ndarray, n_fft: int = 2048) -> float:
+    """平均対数パワースペクトルのコサイン類似度（音色・帯域バランスがどれだけ近いか）"""
+    def spec(x):
+        x = x[:len(x) // n_fft * n_fft].reshape(-1, n_fft) * np.hanning(n_fft)
+        return np.log1p(np.mean(np.abs(np.fft.rfft(x, axis=1)) ** 2, axis=0))
+    sa, sb = spec(a), spec(b)
+    return float(sa @ sb / (np.linalg.norm(sa) * np.linalg.norm(sb) + 1e-12))
+
+def _compare(base: dict, other: dict) -> dict:
+    lb, lo = base["logits"], other["logits"]
+    pb = np.exp(lb - lb.max(-1, keepdims=True)); pb /= pb.sum(-1, keepdims=True)
+    log_pb = np.log(pb + 1e-12)
+    lo = lo - lo.max(-1, keepdims=True)
+    log_po = lo - np.log(np.exp(lo).sum(-1, keepdims=True))
+    cb, co = list(base["captions"]), list(other["captions"])
+    jac = [len(set(a.split()) & set(b.split())) / max(1, len(set(a.split()) | set(b.split()))) for a, b in zip(cb, co)]
+    return {
+        "top1_agreement": float(np.mean(lb.argmax(-1) == other["logits"].argmax(-1))),
+        "kl_vs_fp32": float(np.mean(np.sum(pb * (log_pb - log_po), axis=-1))),
+        "audio_spectral_similarity": _spectral_similarity(base["greedy"], other["greedy"]),
+        "caption_exact_match": float(np.mean([a == b for a, b in zip(cb, co)])),
+        "caption_word_jaccard": float(np.mean(jac)),
+    }
+
+def main():
+    ap = argparse.ArgumentParser(description="CPU 推論の精度モード（fp32 / bf16 / int8）の速度・メモリ・品質比較")
+    ap.add_argument("--modes", default=",".join(CPU_PRECISIONS))
+    ap.add_argument("--seconds", type=int, default=8)
+    ap.add_argument("--prompt", default="calm lo-fi hip hop, mellow piano, soft drums, 80 bpm")
+    ap.add_argument("--video", default=None, help="キャプション用。省略時はランダム画像")
+    ap.add_argument("--frames", type=int, default=8)
+    ap.add_argument("--json", default=None, help="結果を JSON で保存")
+    ap.add_argument("--threads", type=int, default=None, help="torch のスレッド数（省略時は既定）")
+    ap.add_argument("--worker", default=None, help=argparse.SUPPRESS)
+    ap.add_argument("--out", default=None, help=argparse.SUPPRESS)
+    ap.add_argument("--ref", default=None, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    if args.worker:
+        print(json.dumps(worker(args.worker, args)))
+        return
+
+    # ピーク RSS を正しく測るため、モード毎に別プロセスで実行する（fp32 が基準で最初）
+    modes = ["fp32"] + [m for m in args.modes.split(",") if m.strip() and m.strip() != "fp32"]
+    results, arrays = [], {}
+    with tempfile.TemporaryDirectory() as tmp:
+        ref = None
+        for mode in modes:
+            out = os.path.join(tmp, f"{mode}.npz")
+            cmd = [sys.executable, __file__, "--worker", mode, "--out", out,
+                   "--seconds", str(args.seconds), "--prompt", args.prompt, "--frames", str(args.frames)]
+            if args.video:
+                cmd += ["--video", args.video]
+            if args.threads:
+                cmd += ["--threads", str(args.threads)]
+            if ref:
+                cmd += ["--ref", ref]
+            proc = subprocess.run(cmd, capture_output=True, text=True)
+            if proc.returncode != 0:
+                print(proc.stderr[-2000:], file=sys.stderr)
+                raise SystemExit(f"{mode} failed")
+            res = json.loads(proc.stdout.strip().splitlines()[-1])
+            with np.load(out, allow_pickle=True) as z:
+                arrays[mode] = {k: z[k] for k in z.files}
+            if mode == "fp32":
+                ref = os.path.join(tmp, "ref.npz")
+                np.savez(ref, audio=arrays[mode]["greedy"])
+            else:
+                res.update(_compare(arrays["fp32"], arrays[mode]))
+            results.append(res)
+
+    base = results[0]
+    print(f"{'mode':<6} {'tok/s':>7} {'x':>5} {'RTF':>5} {'cap f/s':>8} {'peakRSS':>9} "
+          f"{'top1':>6} {'KL':>7} {'spec':>6} {'cap=':>5}")
+    for r in results:
+        q = (f"{r['top1_agreement']:6.3f} {r['kl_vs_fp32']:7.4f} {r['audio_spectral_similarity']:6.3f} "
+             f"{r['caption_exact_match']:5.2f}") if r["mode"] != "fp32" else f"{'-':>6} {'-':>7} {'-':>6} {'-':>5}"
+        print(f"{r['mode']:<6} {r['tokens_per_sec']:7.1f} {r['tokens_per_sec'] / base['tokens_per_sec']:5.2f} "
+              f"{r['rtf']:5.2f} {r['caption_fps']:8.2f} {r['peak_rss_mb']:7.0f}MB {q}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"seconds": args.seconds, "prompt": args.prompt, "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
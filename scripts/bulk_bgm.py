@@ -0,0 +1,166 @@
+import argparse
+import json
+import os
+import secrets
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from src.presets import QUALITY_PRESETS, SCENE_THRESH
+from src.media import probe
+from src.video2text import sample_scene_change_frames, Captioner, build_prompt_from_captions
+from src.mixer import mux_mix_pcm_to_video
+from src.text2music import MusicGenerator, GenerateConfig, fit_audio_exact_seconds, save_wav
+
+VIDEO_EXTS = {".mp4", ".mov", ".m4v", ".mkv", ".avi", ".webm"}
+
+def load_items(src: str, level: int, gain: float):
+    """
+    入力はフォルダ（再帰的に動画を探す）かマニフェスト。
+    マニフェストは 1 行 1 パス、または JSON 行 {"video": ..., "prompt": ..., "level": ..., "bgm_gain_db": ...}
+    """
+    p = Path(src)
+    items = []
+    if p.is_dir():
+        for f in sorted(p.rglob("*")):
+            if f.suffix.lower() in VIDEO_EXTS:
+                items.append({"video": str(f.resolve()), "rel": str(f.relative_to(p))})
+    else:
+        for line in p.read_text(encoding="utf-8").splitlines():
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            item = json.loads(line) if line.startswith("{") else {"video": line}
+            base = p.parent.resolve()
+            v = (base / item["video"]).resolve()  # 相対パスはマニフェストの場所から
+            item["video"] = str(v)
+            item.setdefault("rel", str(v.relative_to(base)) if v.is_relative_to(base) else v.name)
+            items.append(item)
+    for it in items:
+        it.setdefault("level", level)
+        it.setdefault("bgm_gain_db", gain)
+    return items
+
+class Checkpoint:
+    """完了した動画を JSONL に追記。再実行時は done のものを飛ばす"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.done = set()
+        if path.exists():
+            for line in path.read_text(encoding="utf-8").splitlines():
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue  # 中断時の書きかけ行
+                if rec.get("status") == "done":
+                    self.done.add(rec["video"])
+        self._lock = threading.Lock()
+
+    def record(self, **rec):
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+def _out_stem(out_dir: Path, item: dict) -> Path:
+    name = str(Path(item["rel"]).with_suffix("")).replace(os.sep, "__").replace("/", "__")
+    return out_dir / name
+
+def prepare(item: dict):
+    """CPU ステージ①：長さ取得 + シーン変化フレーム抽出（ffmpeg）"""
+    p = QUALITY_PRESETS[int(item["level"])]
+    info = probe(item["video"])
+    seconds = max(4, min(120, int(round(info.duration))))
+    if item.get("prompt"):
+        return seconds, []  # プロンプト指定ありならキャプション不要
+    frames = sample_scene_change_frames(item["video"], scene_thresh=SCENE_THRESH, max_frames=p["max_frames"],
+                                        info=info)
+    return seconds, frames
+
+def finish(item: dict, out_dir: Path, sr: int, audio, ckpt: Checkpoint, t0: float, prompt: str,
+           duck_db: float = 0.0):
+    """CPU ステージ③：WAV 書き出し + ミックス・mux（ffmpeg 1 回）→ チェックポイント"""
+    try:
+        stem = _out_stem(out_dir, item)
+        save_wav(str(stem) + "_bgm.wav", sr, audio)
+        mp4 = mux_mix_pcm_to_video(item["video"], audio, sr, str(stem) + "_bgm.mp4",
+                                   bgm_gain_db=float(item["bgm_gain_db"]), duck_db=duck_db,
+                                   info=probe(item["video"]))
+        ckpt.record(video=item["video"], status="done", output=mp4, prompt=prompt,
+                    seconds=round(time.perf_counter() - t0, 2))
+        print(f"[bulk] done {item['rel']} -> {mp4}", flush=True)
+    except Exception as e:
+        ckpt.record(video=item["video"], status="failed", stage="mux", error=str(e))
+        print(f"[bulk] mux failed {item['rel']}: {e}", flush=True)
+
+def main():
+    ap = argparse.ArgumentParser(description="フォルダ/マニフェスト内の動画に一括で BGM を付ける")
+    ap.add_argument("src", help="動画フォルダ、またはマニフェスト（.txt / .jsonl）")
+    ap.add_argument("--out", required=True, help="出力フォルダ（checkpoint.jsonl もここに置く）")
+    ap.add_argument("--level", type=int, default=2)
+    ap.add_argument("--temperature", type=float, default=1.0)
+    ap.add_argument("--gain", type=float, default=-4.0, help="BGM gain (dB)")
+    ap.add_argument("--duck", type=float, default=0.0,
+                    help="元音声の声の下で BGM を下げる量 (dB, 例: -8)。0 で無効")
+    ap.add_argument("--workers", type=int, default=max(2, (os.cpu_count() or 2) // 2),
+                    help="ffmpeg（抽出・mux）を回す CPU ワーカー数")
+    ap.add_argument("--prefetch", type=int, default=None, help="先読みして抽出しておく動画数（既定: workers）")
+    args = ap.parse_args()
+
+    out_dir = Path(args.out)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    ckpt = Checkpoint(out_dir / "checkpoint.jsonl")
+    items = [it for it in load_items(args.src, args.level, args.gain) if it["video"] not in ckpt.done]
+    print(f"[bulk] {len(items)} to do ({len(ckpt.done)} already done)", flush=True)
+    if not items:
+        return
+
+    # モデルはプロセスで 1 回だけロード
+    cap, gen = Captioner(), MusicGenerator()
+
+    cpu = ThreadPoolExecutor(max_workers=max(1, args.workers), thread_name_prefix="bulk-cpu")
+    prefetch = max(1, args.prefetch or args.workers)
+    pending = iter(items)
+    inflight = deque()
+    muxes = []
+
+    def fill():
+        while len(inflight) < prefetch:
+            item = next(pending, None)
+            if item is None:
+                return
+            inflight.append((item, time.perf_counter(), cpu.submit(prepare, item)))
+
+    # ステージ②（モデル）はメインスレッドで順に回し、その間に次の動画の抽出と前の動画の mux が進む
+    fill()
+    while inflight:
+        item, t0, fut = inflight.popleft()
+        fill()
+        stage = "frames"
+        try:
+            seconds, frames = fut.result()
+            stage = "caption"
+            prompt = item.get("prompt") or build_prompt_from_captions(cap.caption_images(frames))
+            del frames
+            stage = "generate"
+            p = QUALITY_PRESETS[int(item["level"])]
+            cfg = GenerateConfig(seconds=seconds, temperature=float(args.temperature),
+                                 guidance_scale=float(p["guidance"]), top_k=int(p["top_k"]),
+                                 tokens_per_sec=int(p["tokens_per_sec"]), seed=secrets.randbits(31))
+            sr, audio = gen.generate(prompt, cfg)
+            audio = fit_audio_exact_seconds(audio, sr, seconds)
+        except Exception as e:
+            ckpt.record(video=item["video"], status="failed", stage=stage, error=str(e))
+            print(f"[bulk] {stage} failed {item['rel']}: {e}", flush=True)
+            continue
+        muxes.append(cpu.submit(finish, item, out_dir, sr, audio, ckpt, t0, prompt, args.duck))
+
+    for f in muxes:
+        f.result()
+    cpu.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+import math
+from typing import Optional
+
+import numpy as np
+from scipy import signal
+
+# 先頭・末尾のフェード（クリック防止）と、ループのつなぎ目の等パワー クロスフェード
+EDGE_FADE_SEC = 0.03
+LOOP_FADE_SEC = 0.25
+# オンセット包絡のホップ（32kHz で 16ms）とテンポを探す範囲
+HOP = 512
+BPM_RANGE = (60.0, 180.0)
+# 自己相関の山が 0 ラグのこの割合より低ければテンポ無しとみなす
+MIN_PERIODICITY = 0.2
+
+def peak(audio: np.ndarray, axis=None):
+    """max(|x|)。abs のコピーを作らない"""
+    return np.maximum(np.max(audio, axis=axis), -np.min(audio, axis=axis))
+
+# ===== ループ点 =====
+def onset_envelope(audio: np.ndarray, hop: int = HOP) -> np.ndarray:
+    """HOP 毎の対数エネルギーの増加分（負は 0）。打鍵・拍の頭で立つ"""
+    n = len(audio) // hop
+    if n < 2:
+        return np.zeros(max(n, 0), dtype=np.float32)
+    frames = audio[:n * hop].reshape(n, hop)
+    e = np.log1p(1e3 * np.einsum("ij,ij->i", frames, frames) / hop)
+    return np.maximum(0.0, np.diff(e, prepend=e[:1])).astype(np.float32)
+
+def beat_period(env: np.ndarray, frame_rate: float, bpm_range=BPM_RANGE) -> Optional[float]:
+    """オンセット包絡の自己相関（FFT）が一番強い拍の周期（秒）。周期性が弱ければ None"""
+    if len(env) < 8:
+        return None
+    x = env - env.mean()
+    if not np.any(x):
+        return None
+    nfft = 1 << int(math.ceil(math.log2(2 * len(x))))
+    ac = np.fft.irfft(np.square(np.abs(np.fft.rfft(x, nfft))), nfft)[:len(x)]
+    lo = max(1, int(frame_rate * 60.0 / bpm_range[1]))
+    hi = min(len(ac) - 2, int(frame_rate * 60.0 / bpm_range[0]))
+    if hi <= lo or ac[0] <= 0:
+        return None
+    lag = lo + int(np.argmax(ac[lo:hi + 1]))
+    if ac[lag] < MIN_PERIODICITY * ac[0]:
+        return None
+    # 放物線補間でフレーム未満まで詰める
+    a, b, c = ac[lag - 1], ac[lag], ac[lag + 1]
+    den = a - 2 * b + c
+    frac = 0.5 * (a - c) / den if den < 0 else 0.0
+    return (lag + frac) / frame_rate
+
+def find_loop_end(audio: np.ndarray, sr: int, fade: int) -> int:
+    """
+    [0, end) を繰り返すときの end（サンプル）。end からの fade サンプルを頭とクロスフェードするので
+    end + fade <= len(audio)。テンポが取れれば小節（4 拍）の倍数で一番長いところ、取れなければ全体を候補にし、
+    候補の前後（1/4 拍）で、頭の波形と一番よく似た位置（正規化相互相関の最大）に合わせる。
+    """
+    usable = len(audio) - fade
+    if usable <= 2 * fade:
+        return max(1, usable)
+    beat = beat_period(onset_envelope(audio), sr / HOP)
+    end, radius = usable, int(0.05 * sr)
+    if beat:
+        bar = 4 * beat * sr
+        if bar <= usable:
+            end = int(round(int(usable // bar) * bar))
+        radius = int(beat * sr / 4)
+    lo, hi = max(1, 2 * fade, end - radius), min(usable, end + radius)  # end = 0 は周期にならない
+    w = max(1, min(fade, int(0.05 * sr)))
+    if hi <= lo:
+        return end
+    seg = audio[lo:hi + w]
+    corr = signal.correlate(seg, audio[:w], mode="valid", method="fft")
+    energy = np.convolve(np.square(seg), np.ones(w, dtype=np.float32), mode="valid")
+    return lo + int(np.argmax(corr / np.sqrt(energy + 1e-9)))
+
+# ===== 長さ合わせ =====
+def fit_to_length(audio: np.ndarray, n: int, sr: int, out: Optional[np.ndarray] = None,
+                  loop_fade_sec: float = LOOP_FADE_SEC, edge_fade_sec: float = EDGE_FADE_SEC) -> np.ndarray:
+    """
+    audio を n サンプルの float32 にする（out を渡せばそこへ書く）。長ければ切り、短ければ
+    find_loop_end のループを繰り返す。つなぎ目は「ループ後ろの続き × fade_out + 頭 × fade_in」の 1 周期を
+    1 回だけ作り、出力の (周回数, 周期) のビューへまとめて書く（全長の一時配列は作らない）。
+    フェードは等パワー（sin / cos）が基本で、両側がよく似ている（相関 r > 0）ほど等ゲイン（直線）に寄せる
+    （同じ波形を等パワーで重ねると中央で +3dB 膨らむため）。
+    """
+    if out is None:
+        out = np.empty(n, dtype=np.float32)
+    out = out[:n]
+    a = np.asarray(audio, dtype=np.float32).reshape(-1)
+    if a.size == 0:
+        out[:] = 0.0
+        return out
+    if a.size >= n:
+        out[:] = a[:n]
+    else:
+        fade = int(min(loop_fade_sec * sr, a.size // 4))
+        end = find_loop_end(a, sr, fade)
+        out[:end] = a[:end]
+        period = np.empty(end, dtype=np.float32)
+        if fade:
+            tail, head = a[end:end + fade], a[:fade]
+            r = float(np.dot(tail, head)) / (float(np.linalg.norm(tail) * np.linalg.norm(head)) + 1e-9)
+            r = min(max(r, 0.0), 1.0)
+            t = (np.arange(fade, dtype=np.float32) + 0.5) / fade
+            fade_in = (1 - r) * np.sin(0.5 * np.pi * t) + r * t
+            fade_out = (1 - r) * np.cos(0.5 * np.pi * t) + r * (1 - t)
+            np.multiply(tail, fade_out, out=period[:fade])
+            period[:fade] += head * fade_in
+        period[fade:] = a[fade:end]
+        rest = out[end:]
+        k = len(rest) // end
+        rest[:k * end].reshape(k, end)[:] = period
+        rest[k * end:] = period[:len(rest) - k * end]
+    edge = int(edge_fade_sec * sr)
+    if edge > 0 and n > 2 * edge:
+        ramp = np.linspace(0.0, 1.0, edge, dtype=np.float32)
+        out[:edge] *= ramp
+        out[-edge:] *= ramp[::-1]
+    return out
+
+def fit_audio(audio: np.ndarray, sr: int, seconds: float, out: Optional[np.ndarray] = None) -> np.ndarray:
+    return fit_to_length(audio, int(round(seconds * sr)), sr, out=out)
+
+# ===== 正規化 =====
+def _k_weighting(sr: int):
+    """ITU-R BS.1770 の K 特性（高域シェルフ + 高域通過）の biquad 2 段を sr 用に作る"""
+    K = math.tan(math.pi * 1681.974450955533 / sr)
+    Q = 0.7071752369554196
+    vh = 10 ** (3.999843853973347 / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + K / Q + K * K
+    shelf = ([(vh + vb * K / Q + K * K) / a0, 2 * (K * K - vh) / a0, (vh - vb * K / Q + K * K) / a0],
+             [1.0, 2 * (K * K - 1) / a0, (1 - K / Q + K * K) / a0])
+    K = math.tan(math.pi * 38.13547087602444 / sr)
+    Q = 0.5003270373238773
+    a0 = 1 + K / Q + K * K
+    highpass = ([1.0, -2.0, 1.0], [1.0, 2 * (K * K - 1) / a0, (1 - K / Q + K * K) / a0])
+    return signal.tf2sos(*shelf), signal.tf2sos(*highpass)
+
+def loudness_lufs(audio: np.ndarray, sr: int, chunk_sec: float = 10.0) -> float:
+    """
+    BS.1770 の積分ラウドネス（モノラル、LUFS）。K 特性は chunk_sec 毎にフィルタ状態を引き継いで掛け、
+    100ms 毎のエネルギーだけを残す（全長のフィルタ済み配列は作らない）。
+    400ms ブロック（75% 重なり）に -70 LUFS の絶対ゲートと -10 LU の相対ゲート。
+    """
+    sos = np.concatenate(_k_weighting(sr))
+    hop = int(round(0.1 * sr))
+    n = len(audio) // hop
+    if n < 4:
+        return -70.0
+    zi = np.zeros((sos.shape[0], 2))
+    step = max(1, int(chunk_sec / 0.1)) * hop
+    hop_energy = np.empty(n)
+    for s in range(0, n * hop, step):
+        y, zi = signal.sosfilt(sos, audio[s:min(s + step, n * hop)], zi=zi)
+        hop_energy[s // hop:s // hop + len(y) // hop] = np.square(y).reshape(-1, hop).sum(axis=1)
+    blocks = np.convolve(hop_energy, np.ones(4), mode="valid") / (4 * hop)
+    lufs = -0.691 + 10 * np.log10(blocks + 1e-12)
+    gated = blocks[lufs > -70.0]
+    if gated.size == 0:
+        return -70.0
+    rel = -0.691 + 10 * np.log10(gated.mean()) - 10.0
+    gated = gated[-0.691 + 10 * np.log10(gated + 1e-12) > rel]
+    return float(-0.691 + 10 * np.log10(gated.mean() + 1e-12))
+
+def normalize(audio: np.ndarray, sr: int, lufs: Optional[float] = None, ceiling: float = 1.0) -> np.ndarray:
+    """
+    その場で音量を揃える。lufs を渡せばその積分ラウドネスへ（ピークが ceiling を超えない範囲で）、
+    無ければピークを ceiling に。
+    """
+    p = float(peak(audio)) if audio.size else 0.0
+    if p <= 0.0:
+        return audio
+    gain = ceiling / p
+    if lufs is not None:
+        gain = min(gain, 10 ** ((float(lufs) - loudness_lufs(audio, sr)) / 20))
+    audio *= np.float32(gain)
+    return audio
@@ -0,0 +1,226 @@
+import json
+import math
+import os
+import platform
+import subprocess
+import time
+from dataclasses import asdict, dataclass, fields
+from typing import Callable, Dict, Optional
+
+import numpy as np
+
+from src.media import ffmpeg_exe, probe
+from src.presets import QUALITY_PRESETS, SCENE_THRESH
+from src.stages import stage_key
+from src.telemetry import span
+
+# 予算指定で選べる一番軽い設定（レベル 1 より下）。これでも予算に収まらなければこの設定で実行する
+FLOOR_PRESET = {"max_frames": 3, "tokens_per_sec": 20, "guidance": 1.5, "top_k": 80}
+# 計測用の合成動画（720p30、途中で 1 回シーンが変わる）の長さ
+CLIP_SEC = 6.0
+# デコード速度を測る 2 点のトークン数（差から 1 ステップの時間、残りを固定分とする）
+DECODE_TOKENS = (64, 256)
+
+@dataclass
+class HostProfile:
+    """
+    このマシン・このモデル設定で測った各段の速さ。予測は 段毎に「固定分 + 量 × 単価」を足したもの。
+    frames / mux は動画の長さ、captions はフレーム数、generate はデコードのステップ数に比例するとみなす。
+    """
+    key: str
+    frames_sec_per_video_sec: float
+    caption_call_sec: float       # caption_images 1 バッチあたりの固定分
+    caption_sec_per_frame: float
+    caption_batch: int
+    decode_fixed_sec: float       # テキストエンコード・EnCodec など長さに依らない分
+    decode_steps_per_sec: float   # 1 秒あたりのデコードステップ（コードブック毎のトークン数）
+    mux_sec_per_video_sec: float
+    measured_at: float = 0.0
+
+    def predict(self, duration: float, p: dict, seconds: Optional[float] = None) -> Dict[str, float]:
+        """
+        段毎の予測秒数と合計（"total"）。duration は動画の長さ、seconds は生成する BGM の長さ（既定 = duration）。
+        解析は BLIP で見積もる（埋め込み解析のレベルはこれより速い）。モデルの読み込み時間は含まない。
+        """
+        seconds = duration if seconds is None else seconds
+        frames = int(p["max_frames"])
+        batches = math.ceil(frames / max(1, self.caption_batch))
+        out = {
+            "frames": self.frames_sec_per_video_sec * duration,
+            "captions": self.caption_call_sec * batches + self.caption_sec_per_frame * frames,
+            "generate": self.decode_fixed_sec + decode_steps(seconds, p["tokens_per_sec"]) / self.decode_steps_per_sec,
+            "mux": self.mux_sec_per_video_sec * duration,
+        }
+        out["total"] = sum(out.values())
+        return out
+
+def decode_steps(seconds: float, tokens_per_sec: float) -> int:
+    """MusicGenerator が回すデコードのステップ数（1 窓は最低 64 トークン）"""
+    return max(64, int(int(round(seconds)) * int(round(tokens_per_sec))))
+
+# ===== 予算 → プリセット =====
+def _anchors():
+    return [FLOOR_PRESET] + [QUALITY_PRESETS[lv] for lv in sorted(QUALITY_PRESETS)]
+
+def preset_at(q: float) -> dict:
+    """
+    連続したレベル q（0 = FLOOR_PRESET、1〜5 = QUALITY_PRESETS）のパラメータ。
+    隣り合うレベルの間は線形補間し、analysis は一番近いレベルのものを使う。
+    """
+    anchors = _anchors()
+    q = min(max(float(q), 0.0), len(anchors) - 1.0)
+    i = min(int(q), len(anchors) - 2)
+    t = q - i
+    a, b = anchors[i], anchors[i + 1]
+    mix = {k: a[k] + (b[k] - a[k]) * t for k in FLOOR_PRESET}
+    near = QUALITY_PRESETS[min(max(1, int(round(q))), max(QUALITY_PRESETS))]
+    return {
+        "max_frames": int(round(mix["max_frames"])),
+        "tokens_per_sec": int(round(mix["tokens_per_sec"])),
+        "guidance": round(mix["guidance"], 2),
+        "top_k": int(round(mix["top_k"])),
+        "analysis": near.get("analysis", "caption"),
+    }
+
+def budget_preset(profile: HostProfile, duration: float, budget_sec: float,
+                  seconds: Optional[float] = None) -> dict:
+    """
+    予測時間が budget_sec 以内に収まる一番重い設定を選ぶ（予測はレベル q について単調なので二分探索）。
+    戻りはプリセットと同じキーに level（連続値）/ budget_sec / predicted_sec を足した dict。
+    一番軽い設定でも収まらなければその設定に over_budget=True を付けて返す。
+    """
+    hi = len(_anchors()) - 1.0
+
+    def cost(q: float) -> float:
+        return profile.predict(duration, preset_at(q), seconds)["total"]
+
+    if cost(hi) <= budget_sec:
+        q = hi
+    elif cost(0.0) > budget_sec:
+        q = 0.0
+    else:
+        lo, up = 0.0, hi
+        for _ in range(24):
+            mid = (lo + up) / 2
+            if cost(mid) <= budget_sec:
+                lo = mid
+            else:
+                up = mid
+        q = lo
+    p = preset_at(q)
+    predicted = cost(q)
+    p.update(level=round(q, 2), budget_sec=float(budget_sec), predicted_sec=round(predicted, 2))
+    if predicted > budget_sec:
+        p["over_budget"] = True
+    return p
+
+# ===== 保存 =====
+def profile_key(captioner, generator) -> str:
+    """計測結果が使い回せる条件（モデル・精度・デコード方式・デバイス・スレッド数・CPU）"""
+    import torch
+    music_model = getattr(getattr(generator, "model", None), "name_or_path", "")
+    return stage_key(
+        captioner.model_id, captioner.precision, captioner.decoding, captioner.batch_size, captioner.device,
+        music_model, generator.precision, generator.decode, generator.device,
+        torch.get_num_threads(), os.cpu_count(), platform.machine(), platform.processor(),
+    )
+
+def load_profile(path: str, key: str) -> Optional[HostProfile]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f).get(key)
+    except (OSError, ValueError):
+        return None
+    if not data:
+        return None
+    names = {f.name for f in fields(HostProfile)}
+    return HostProfile(**{k: v for k, v in data.items() if k in names})
+
+def save_profile(path: str, profile: HostProfile):
+    """path の JSON（key → 計測結果）に追記する。別の設定で測った結果は残す"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        data = {}
+    data[profile.key] = asdict(profile)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=1)
+    os.replace(tmp, path)
+
+# ===== 計測 =====
+def _timed(fn: Callable[[], object]) -> float:
+    t0 = time.perf_counter()
+    fn()
+    return time.perf_counter() - t0
+
+def _synthetic_clip(path: str, seconds: float = CLIP_SEC):
+    """720p30 の映像（前半 testsrc2 / 後半 smptebars）+ サイン波の音声"""
+    half = seconds / 2
+    cmd = [
+        ffmpeg_exe(), "-y", "-v", "error",
+        "-f", "lavfi", "-i", f"testsrc2=size=1280x720:rate=30:duration={half}",
+        "-f", "lavfi", "-i", f"smptebars=size=1280x720:rate=30:duration={half}",
+        "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}",
+        "-filter_complex", "[0:v][1:v]concat=n=2:v=1:a=0[v]", "-map", "[v]", "-map", "2:a",
+        "-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p", "-c:a", "aac", "-shortest", path,
+    ]
+    subprocess.run(cmd, check=True, stdin=subprocess.DEVNULL, capture_output=True)
+
+def calibrate(captioner, generator, workdir: str, key: Optional[str] = None) -> HostProfile:
+    """
+    読み込み済みの Captioner / MusicGenerator と合成動画で各段の速さを測る。
+    キャプションは 1 枚と 1 バッチ、デコードは DECODE_TOKENS の 2 点を測り、差から単価と固定分を出す
+    （どちらも 1 回空回ししてから。プロンプトは毎回変えてテキストキャッシュに当てない）。
+    """
+    from src.mixer import mux_mix_pcm_to_video
+    from src.text2music import GenerateConfig
+    from src.video2text import FRAME_DEDUP, iter_distinct_frames, iter_scene_change_frames
+
+    os.makedirs(workdir, exist_ok=True)
+    clip = os.path.join(workdir, "clip.mp4")
+    with span("calibrate"):
+        if not os.path.exists(clip):
+            _synthetic_clip(clip)
+        info = probe(clip)
+        duration = float(info.duration or CLIP_SEC)
+
+        frame_iter = iter_distinct_frames if FRAME_DEDUP else iter_scene_change_frames
+        frames = []
+        t_frames = _timed(lambda: frames.extend(frame_iter(clip, scene_thresh=SCENE_THRESH, max_frames=8, info=info)))
+        if not frames:
+            frames = [np.zeros((360, 640, 3), dtype=np.uint8)]
+
+        n = max(2, min(8, int(captioner.batch_size)))
+        batch = [frames[i % len(frames)] for i in range(n)]
+        captioner.caption_images(batch[:1])
+        t_one = _timed(lambda: captioner.caption_images(batch[:1]))
+        t_batch = _timed(lambda: captioner.caption_images(batch, batch_size=n))
+        per_frame = max(1e-4, (t_batch - t_one) / (n - 1))
+
+        def gen(i: int, tokens: int) -> float:
+            cfg = GenerateConfig(seconds=tokens // 32, tokens_per_sec=32, long_form=False, seed=i)
+            return _timed(lambda: generator.generate(f"calibration {i} {time.time()}", cfg))
+
+        lo, hi = DECODE_TOKENS
+        gen(0, lo)
+        t_lo, t_hi = gen(1, lo), gen(2, hi)
+        steps_per_sec = (hi - lo) / max(t_hi - t_lo, 1e-4)
+
+        out = os.path.join(workdir, "mux.mp4")
+        silence = np.zeros(int(duration * 32000), dtype=np.float32)
+        t_mux = _timed(lambda: mux_mix_pcm_to_video(clip, silence, 32000, out, info=info))
+
+    return HostProfile(
+        key=key or profile_key(captioner, generator),
+        frames_sec_per_video_sec=t_frames / duration,
+        caption_call_sec=max(0.0, t_one - per_frame),
+        caption_sec_per_frame=per_frame,
+        caption_batch=int(captioner.batch_size),
+        decode_fixed_sec=max(0.0, t_lo - lo / steps_per_sec),
+        decode_steps_per_sec=steps_per_sec,
+        mux_sec_per_video_sec=t_mux / duration,
+        measured_at=time.time(),
+    )
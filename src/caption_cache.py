@@ -0,0 +1,102 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple
+
+_SAMPLE_BYTES = 1 << 20  # 先頭・中央・末尾からそれぞれ読むバイト数
+
+def file_fingerprint(path: str) -> str:
+    """
+    動画の高速コンテンツハッシュ。サイズ + 先頭/中央/末尾 1MiB の blake2b。
+    全体を読まないので数 GB の動画でも一瞬（パスや mtime には依存しない）。
+    """
+    size = os.path.getsize(path)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str(size).encode())
+    with open(path, "rb") as f:
+        if size <= 3 * _SAMPLE_BYTES:
+            h.update(f.read())
+        else:
+            for off in (0, size // 2 - _SAMPLE_BYTES // 2, size - _SAMPLE_BYTES):
+                f.seek(off)
+                h.update(f.read(_SAMPLE_BYTES))
+    return h.hexdigest()
+
+class CaptionCache:
+    """
+    キャプションと自動プロンプトのディスクキャッシュ（SQLite 1 ファイル）。
+    - キー: 動画のコンテンツハッシュ + キャプションモデル/デコード設定 + シーン閾値 + max_frames
+    - 容量超過時は最終アクセスが古い順に削除（LRU）
+    - 複数スレッド/プロセスから同時に使っても SQLite のトランザクションで安全
+    """
+
+    def __init__(self, path: str, max_bytes: int = 64 << 20):
+        self.path = str(path)
+        self.max_bytes = int(max_bytes)
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS captions ("
+                " key TEXT PRIMARY KEY, payload TEXT NOT NULL,"
+                " nbytes INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS captions_lru ON captions(last_access)")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        db = sqlite3.connect(self.path, timeout=30.0, isolation_level=None)
+        try:
+            yield db
+        finally:
+            db.close()
+
+    @staticmethod
+    def make_key(video_path: str, model_id: str, scene_thresh: float, max_frames: int, **extra) -> str:
+        return CaptionCache.key_for(file_fingerprint(video_path), model_id, scene_thresh, max_frames, **extra)
+
+    @staticmethod
+    def key_for(fingerprint: str, model_id: str, scene_thresh: float, max_frames: int, **extra) -> str:
+        """make_key と同じキーを、計算済みの file_fingerprint から作る（動画を読み直さない）"""
+        parts = {"video": fingerprint, "model": model_id,
+                 "scene_thresh": round(float(scene_thresh), 4), "max_frames": int(max_frames), **extra}
+        return hashlib.blake2b(json.dumps(parts, sort_keys=True).encode(), digest_size=16).hexdigest()
+
+    def get(self, key: str) -> Optional[Tuple[List[str], str]]:
+        with self._lock, self._connect() as db:
+            row = db.execute("SELECT payload FROM captions WHERE key=?", (key,)).fetchone()
+            if row is None:
+                return None
+            db.execute("UPDATE captions SET last_access=? WHERE key=?", (time.time(), key))
+        data = json.loads(row[0])
+        return list(data["captions"]), str(data["prompt"])
+
+    def put(self, key: str, captions: List[str], prompt: str) -> None:
+        payload = json.dumps({"captions": list(captions), "prompt": prompt}, ensure_ascii=False)
+        with self._lock, self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                db.execute(
+                    "INSERT OR REPLACE INTO captions(key, payload, nbytes, last_access) VALUES (?,?,?,?)",
+                    (key, payload, len(payload.encode()), time.time()),
+                )
+                self._evict(db)
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+
+    def _evict(self, db: sqlite3.Connection) -> None:
+        total = db.execute("SELECT COALESCE(SUM(nbytes), 0) FROM captions").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, nbytes in db.execute("SELECT key, nbytes FROM captions ORDER BY last_access ASC").fetchall():
+            if total <= self.max_bytes:
+                break
+            db.execute("DELETE FROM captions WHERE key=?", (key,))
+            total -= nbytes
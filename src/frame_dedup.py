@@ -0,0 +1,110 @@
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+from scipy.fft import dctn
+
+# 1 枚を 32x32 に縮めてから DCT の低周波 8x8（DC 除く 63 係数）で pHash、RGB 各 8 ビンでヒストグラム
+_HASH_SIZE = 32
+_HASH_LOW = 8
+_HIST_BINS = 8
+
+def frame_signatures(frames: Sequence[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (N, 63) bool の pHash と (N, 3*_HIST_BINS) の正規化ヒストグラム。
+    縮小だけは 1 枚ずつ（サイズが揃わないことがある）で、DCT 以降はまとめて計算する。
+    """
+    if len(frames) == 0:
+        return np.zeros((0, _HASH_LOW * _HASH_LOW - 1), bool), np.zeros((0, 3 * _HIST_BINS), np.float32)
+    small = np.stack([np.asarray(Image.fromarray(np.asarray(f)).convert("RGB")
+                                 .resize((_HASH_SIZE, _HASH_SIZE), Image.BILINEAR)) for f in frames])
+    gray = small.astype(np.float32) @ np.array([0.299, 0.587, 0.114], np.float32)
+    low = dctn(gray, axes=(1, 2), norm="ortho")[:, :_HASH_LOW, :_HASH_LOW].reshape(len(frames), -1)[:, 1:]
+    hashes = low > np.median(low, axis=1, keepdims=True)
+
+    n = len(frames)
+    idx = (small.reshape(n, -1, 3) // (256 // _HIST_BINS)).astype(np.int64)
+    idx += np.arange(3) * _HIST_BINS                                   # チャンネル毎にビンをずらす
+    hists = np.zeros((n, 3 * _HIST_BINS), np.float32)
+    np.add.at(hists, (np.repeat(np.arange(n), idx.shape[1] * 3), idx.reshape(-1)), 1.0)
+    hists /= _HASH_SIZE * _HASH_SIZE
+    return hashes, hists
+
+def signature_distances(a: Tuple[np.ndarray, np.ndarray], b: Tuple[np.ndarray, np.ndarray]) -> np.ndarray:
+    """(Na, Nb) の距離 0..1。pHash のハミング距離（構図）とヒストグラムの L1（色）の平均"""
+    ha, xa = a
+    hb, xb = b
+    ham = (ha[:, None, :] != hb[None, :, :]).mean(axis=2)
+    l1 = np.abs(xa[:, None, :] - xb[None, :, :]).sum(axis=2) / 6.0   # チャンネル毎の L1 は最大 2
+    return 0.5 * ham + 0.5 * l1
+
+class FrameDeduper:
+    """
+    届いた順にフレームを見て、既に残したフレームとほぼ同じものを落とす（キャプション前に使う）。
+    閾値は固定にせず、ここまでに見た全フレームの距離の中央値 × ratio を [min_thresh, max_thresh] に収めたもの。
+    固定カメラの映像なら閾値も下がるので、わずかな違いは残しつつ同一フレームだけを落とせる。
+    """
+
+    def __init__(self, ratio: float = 0.4, min_thresh: float = 0.06, max_thresh: float = 0.18):
+        self.ratio, self.min_thresh, self.max_thresh = ratio, min_thresh, max_thresh
+        self._seen: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        self._kept: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        self._seen_dist = np.zeros((0, 0), np.float32)
+        self.dropped = 0
+
+    def threshold(self) -> float:
+        n = self._seen_dist.shape[0]
+        if n < 2:
+            return self.min_thresh
+        typical = float(np.median(self._seen_dist[np.triu_indices(n, 1)]))
+        return float(np.clip(self.ratio * typical, self.min_thresh, self.max_thresh))
+
+    def _observe(self, sig):
+        if self._seen is None:
+            self._seen, self._seen_dist = sig, signature_distances(sig, sig)
+            return
+        cross = signature_distances(sig, self._seen)
+        n, m = self._seen_dist.shape[0], len(sig[0])
+        d = np.zeros((n + m, n + m), np.float32)
+        d[:n, :n] = self._seen_dist
+        d[n:, :n], d[:n, n:] = cross, cross.T
+        d[n:, n:] = signature_distances(sig, sig)
+        self._seen = (np.concatenate([self._seen[0], sig[0]]), np.concatenate([self._seen[1], sig[1]]))
+        self._seen_dist = d
+
+    def filter(self, frames: Sequence[np.ndarray]) -> List[int]:
+        """frames のうち残すものの添字（frames 内の前のフレームとも比べる）"""
+        if len(frames) == 0:
+            return []
+        sig = frame_signatures(frames)
+        self._observe(sig)
+        thresh = self.threshold()
+        keep: List[int] = []
+        for i in range(len(frames)):
+            one = (sig[0][i:i + 1], sig[1][i:i + 1])
+            if self._kept is not None and signature_distances(one, self._kept).min() < thresh:
+                self.dropped += 1
+                continue
+            keep.append(i)
+            self._kept = one if self._kept is None else (np.concatenate([self._kept[0], one[0]]),
+                                                         np.concatenate([self._kept[1], one[1]]))
+        return keep
+
+def backfill_times(kept_times: Sequence[float], duration: float, budget: int) -> List[float]:
+    """
+    残したフレームが少ない時間帯の中央を budget 個まで返す。動画を max(budget + 残した数) 等分し、
+    残したフレームを含まない区間を、最寄りの残したフレームから遠い順に選ぶ。
+    """
+    if budget <= 0 or duration <= 0:
+        return []
+    bins = budget + len(kept_times)
+    centers = (np.arange(bins) + 0.5) * duration / bins
+    kept = np.asarray(sorted(kept_times), dtype=np.float64)
+    if kept.size:
+        occupied = np.zeros(bins, bool)
+        occupied[np.clip((kept / duration * bins).astype(int), 0, bins - 1)] = True
+        gap = np.abs(centers[:, None] - kept[None, :]).min(axis=1)
+        order = [i for i in np.argsort(-gap, kind="stable") if not occupied[i]]
+    else:
+        order = list(range(bins))
+    return sorted(float(centers[i]) for i in order[:budget])
@@ -0,0 +1,197 @@
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, Optional
+
+class JobQueueFull(RuntimeError):
+    pass
+
+@dataclass
+class Job:
+    id: str
+    dir: Path
+    params: dict
+    input: Optional[Path] = None
+    status: str = "queued"  # queued / running / done / failed
+    created: float = field(default_factory=time.time)
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    error: Optional[str] = None
+    outputs: Dict[str, str] = field(default_factory=dict)
+    delete_requested: bool = False
+    future: Optional[Future] = field(default=None, repr=False)
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id, "status": self.status, "params": self.params,
+            "created": self.created, "started": self.started, "finished": self.finished,
+            "error": self.error, "outputs": sorted(self.outputs),
+        }
+
+def sweep_expired(root: Path, ttl_sec: float, keep=(), prefix: str = "") -> int:
+    """root 直下の prefix で始まるフォルダのうち ttl_sec より古いものを削除（再起動前の取り残しも対象）"""
+    if not root.is_dir():
+        return 0
+    limit = time.time() - ttl_sec
+    removed = 0
+    for d in root.iterdir():
+        try:
+            if (d.is_dir() and d.name.startswith(prefix) and d.name not in keep
+                    and d.stat().st_mtime < limit):
+                shutil.rmtree(d, ignore_errors=True)
+                removed += 1
+        except OSError:
+            continue
+    return removed
+
+class JobManager:
+    """
+    ヘッドレス実行用のジョブ管理。ジョブ毎に root/<id>/ を作り、固定サイズのワーカープールで
+    runner(job) -> {名前: 出力パス} を実行する。終了後 ttl_sec 経ったジョブはフォルダごと消す。
+    """
+
+    def __init__(self, root: Path, runner: Callable[[Job], Dict[str, str]], workers: int = 2,
+                 ttl_sec: float = 3600.0, max_pending: int = 64):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.runner = runner
+        self.workers = max(1, int(workers))
+        self.ttl_sec = float(ttl_sec)
+        self.max_pending = int(max_pending)
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bgmer-job")
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        threading.Thread(target=self._janitor, name="bgmer-job-janitor", daemon=True).start()
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            out: Dict[str, int] = {}
+            for j in self._jobs.values():
+                out[j.status] = out.get(j.status, 0) + 1
+        return out
+
+    def submit(self, params: dict, upload: BinaryIO, filename: str) -> Job:
+        if self.counts().get("queued", 0) >= self.max_pending:
+            raise JobQueueFull(f"too many pending jobs (>= {self.max_pending})")
+        job_id = uuid.uuid4().hex[:12]
+        job = Job(id=job_id, dir=self.root / job_id, params=dict(params))
+        job.dir.mkdir(parents=True)
+        job.input = job.dir / ("input" + (Path(filename or "").suffix or ".mp4"))
+        with open(job.input, "wb") as f:
+            shutil.copyfileobj(upload, f, length=1 << 20)
+        with self._lock:
+            self._jobs[job_id] = job
+        job.future = self._pool.submit(self._run, job)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def delete(self, job_id: str) -> bool:
+        """キュー待ちならキャンセル。実行中のものは止められないので終了後に消える"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return False
+            started = job.status == "queued" and job.future is not None and not job.future.cancel()
+            if job.status == "running" or started:
+                job.delete_requested = True
+                return True
+            del self._jobs[job_id]
+        shutil.rmtree(job.dir, ignore_errors=True)
+        return True
+
+    def _run(self, job: Job):
+        job.status, job.started = "running", time.time()
+        try:
+            outputs = self.runner(job)
+            job.outputs = {k: str(v) for k, v in outputs.items() if v}
+            job.status = "done"
+        except Exception as e:
+            job.error, job.status = str(e) or type(e).__name__, "failed"
+        finally:
+            job.finished = time.time()
+            if job.delete_requested:
+                self.delete(job.id)
+
+    def _janitor(self):
+        while True:
+            time.sleep(max(5.0, min(60.0, self.ttl_sec / 4)))
+            limit = time.time() - self.ttl_sec
+            with self._lock:
+                expired = [j for j in self._jobs.values() if j.finished and j.finished < limit]
+                for j in expired:
+                    del self._jobs[j.id]
+                live = set(self._jobs)
+            for j in expired:
+                shutil.rmtree(j.dir, ignore_errors=True)
+            sweep_expired(self.root, self.ttl_sec, keep=live)
+
+def create_api(manager: JobManager, health_info: Optional[Callable[[], dict]] = None,
+               metrics: Optional[Callable[[], str]] = None):
+    """
+    ジョブ投入 / 状態確認 / 結果取得の HTTP API（FastAPI は gradio の依存で入っている）。
+    health_info を渡すと /health にその戻り値（モデルのメモリ使用量など）を足す。
+    metrics を渡すと GET /metrics でその戻り値（Prometheus のテキスト形式）を返す。
+    """
+    from fastapi import FastAPI, File, Form, HTTPException, UploadFile
+    from fastapi.responses import FileResponse, PlainTextResponse
+
+    api = FastAPI(title="BGMer headless")
+
+    @api.get("/health")
+    def health():
+        return {"workers": manager.workers, "jobs": manager.counts(), **(health_info() if health_info else {})}
+
+    if metrics is not None:
+        @api.get("/metrics")
+        def prometheus():
+            return PlainTextResponse(metrics(), media_type="text/plain; version=0.0.4")
+
+    @api.post("/jobs", status_code=202)
+    def submit(video: UploadFile = File(...), level: int = Form(2), temperature: float = Form(1.0),
+               bgm_gain_db: float = Form(-4.0), prompt: str = Form(""), budget_sec: float = Form(0.0)):
+        if not 1 <= level <= 5:
+            raise HTTPException(422, "level must be 1..5")
+        if budget_sec < 0:
+            raise HTTPException(422, "budget_sec must be >= 0")
+        params = {"level": level, "temperature": temperature, "bgm_gain_db": bgm_gain_db, "prompt": prompt,
+                  "budget_sec": budget_sec}
+        try:
+            job = manager.submit(params, video.file, video.filename or "")
+        except JobQueueFull as e:
+            raise HTTPException(429, str(e))
+        return job.to_dict()
+
+    def _job(job_id: str) -> Job:
+        job = manager.get(job_id)
+        if job is None:
+            raise HTTPException(404, "job not found")
+        return job
+
+    @api.get("/jobs/{job_id}")
+    def status(job_id: str):
+        return _job(job_id).to_dict()
+
+    @api.get("/jobs/{job_id}/{name}")
+    def result(job_id: str, name: str):
+        job = _job(job_id)
+        if job.status != "done":
+            raise HTTPException(409, f"job is {job.status}")
+        path = job.outputs.get(name)
+        if not path or not Path(path).exists():
+            raise HTTPException(404, f"no output named {name!r}")
+        return FileResponse(path, filename=Path(path).name)
+
+    @api.delete("/jobs/{job_id}")
+    def delete(job_id: str):
+        if not manager.delete(job_id):
+            raise HTTPException(404, "job not found")
+        return {"id": job_id, "deleted": True}
+
+    return api
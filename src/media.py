@@ -0,0 +1,173 @@
+import json
+import os
+import re
+import shutil
+import subprocess
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+def ffmpeg_exe() -> str:
+    """PATH の ffmpeg を優先し、無ければ imageio-ffmpeg 同梱のバイナリを使う"""
+    exe = shutil.which("ffmpeg")
+    if exe:
+        return exe
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception:
+        return "ffmpeg"
+
+def ffprobe_exe() -> Optional[str]:
+    """
+    PATH の ffprobe、無ければ ffmpeg と同じフォルダの ffprobe(.exe)。
+    imageio-ffmpeg 同梱版は ffprobe を持たないので None（ffmpeg -i の出力を解析する）。
+    """
+    exe = shutil.which("ffprobe")
+    if exe:
+        return exe
+    ff = ffmpeg_exe()
+    d, name = os.path.split(ff)
+    if d and name.lower().startswith("ffmpeg"):
+        cand = os.path.join(d, "ffprobe" + (".exe" if name.lower().endswith(".exe") else ""))
+        if os.path.isfile(cand):
+            return cand
+    return None
+
+@dataclass
+class AudioStream:
+    codec: str = ""
+    sample_rate: int = 0
+    channels: int = 0
+
+@dataclass
+class MediaInfo:
+    path: str
+    duration: float = 0.0
+    fps: float = 0.0
+    width: int = 0          # 回転メタデータ適用後（ffmpeg がデコードして出すフレームのサイズ）
+    height: int = 0
+    rotation: int = 0
+    video_codec: str = ""
+    audio_streams: List[AudioStream] = field(default_factory=list)
+
+    @property
+    def has_audio(self) -> bool:
+        return bool(self.audio_streams)
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        return self.width, self.height
+
+def _rate(s: str) -> float:
+    try:
+        num, _, den = str(s).partition("/")
+        return float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError):
+        return 0.0
+
+def _apply_rotation(info: MediaInfo) -> MediaInfo:
+    info.rotation = int(round(info.rotation)) % 360
+    if info.rotation in (90, 270):
+        info.width, info.height = info.height, info.width
+    return info
+
+def parse_ffprobe_json(path: str, data: dict) -> MediaInfo:
+    info = MediaInfo(path=path)
+    info.duration = float((data.get("format") or {}).get("duration") or 0.0)
+    for st in data.get("streams", []):
+        kind = st.get("codec_type")
+        if kind == "video" and not info.video_codec:
+            if (st.get("disposition") or {}).get("attached_pic"):
+                continue  # カバーアートは無視
+            info.video_codec = st.get("codec_name", "")
+            info.width, info.height = int(st.get("width") or 0), int(st.get("height") or 0)
+            info.fps = _rate(st.get("avg_frame_rate")) or _rate(st.get("r_frame_rate"))
+            rot = (st.get("tags") or {}).get("rotate")
+            for sd in st.get("side_data_list") or []:
+                if "rotation" in sd:
+                    rot = -float(sd["rotation"])  # displaymatrix は反時計回りが正
+            info.rotation = int(float(rot or 0))
+            if not info.duration:
+                info.duration = float(st.get("duration") or 0.0)
+        elif kind == "audio":
+            info.audio_streams.append(AudioStream(codec=st.get("codec_name", ""),
+                                                  sample_rate=int(st.get("sample_rate") or 0),
+                                                  channels=int(st.get("channels") or 0)))
+    return _apply_rotation(info)
+
+_DURATION_RE = re.compile(r"Duration:\s*(\d+):(\d+):(\d+(?:\.\d+)?)")
+_VIDEO_RE = re.compile(r"Stream #.*?: Video: (\w+).*?, (\d{2,5})x(\d{2,5})")
+_FPS_RE = re.compile(r"([\d.]+) (?:fps|tbr)")
+_AUDIO_RE = re.compile(r"Stream #.*?: Audio: (\w+).*?, (\d+) Hz, ([^,]+)")
+_ROT_RE = re.compile(r"(?:rotate\s*:\s*(-?\d+))|(?:rotation of (-?[\d.]+) degrees)")
+
+def _channels(layout: str) -> int:
+    layout = layout.strip()
+    if layout in ("mono", "stereo"):
+        return 1 if layout == "mono" else 2
+    m = re.match(r"(\d+)\.(\d)", layout)        # 5.1 / 7.1(wide) など
+    if m:
+        return int(m.group(1)) + int(m.group(2))
+    m = re.match(r"(\d+) channels", layout)
+    return int(m.group(1)) if m else 2
+
+def parse_ffmpeg_banner(path: str, text: str) -> MediaInfo:
+    """ffprobe が無いとき用：`ffmpeg -i` の stderr から同じ情報を取り出す"""
+    info = MediaInfo(path=path)
+    m = _DURATION_RE.search(text)
+    if m:
+        h, mi, s = m.groups()
+        info.duration = int(h) * 3600 + int(mi) * 60 + float(s)
+    for line in text.splitlines():
+        v = _VIDEO_RE.search(line)
+        if v and not info.video_codec and "attached pic" not in line:
+            info.video_codec, info.width, info.height = v.group(1), int(v.group(2)), int(v.group(3))
+            f = _FPS_RE.search(line)
+            info.fps = float(f.group(1)) if f else 0.0
+            continue
+        a = _AUDIO_RE.search(line)
+        if a:
+            info.audio_streams.append(AudioStream(codec=a.group(1), sample_rate=int(a.group(2)),
+                                                  channels=_channels(a.group(3))))
+    m = _ROT_RE.search(text)
+    if m:
+        info.rotation = int(m.group(1)) if m.group(1) else -int(float(m.group(2)))
+    return _apply_rotation(info)
+
+def _probe_uncached(path: str) -> MediaInfo:
+    probe = ffprobe_exe()
+    if probe:
+        res = subprocess.run(
+            [probe, "-v", "error", "-print_format", "json", "-show_format", "-show_streams", path],
+            capture_output=True, text=True,
+        )
+        if res.returncode == 0 and res.stdout.strip():
+            return parse_ffprobe_json(path, json.loads(res.stdout))
+    res = subprocess.run([ffmpeg_exe(), "-hide_banner", "-nostdin", "-i", path],
+                         capture_output=True, text=True, errors="replace")
+    return parse_ffmpeg_banner(path, res.stderr)
+
+_CACHE: "OrderedDict[tuple, MediaInfo]" = OrderedDict()
+_CACHE_MAX = 128
+_CACHE_LOCK = threading.Lock()
+
+def probe(path: str) -> MediaInfo:
+    """
+    1 ファイルにつき subprocess 1 回でメタデータを取る。
+    （実パス, サイズ, mtime）をキーにプロセス内でキャッシュするので、同じ動画への 2 回目以降はタダ。
+    """
+    st = os.stat(path)
+    key = (os.path.realpath(path), st.st_size, st.st_mtime_ns)
+    with _CACHE_LOCK:
+        info = _CACHE.get(key)
+        if info is not None:
+            _CACHE.move_to_end(key)
+            return info
+    info = _probe_uncached(path)
+    with _CACHE_LOCK:
+        _CACHE[key] = info
+        while len(_CACHE) > _CACHE_MAX:
+            _CACHE.popitem(last=False)
+    return info
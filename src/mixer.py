@@ -0,0 +1,117 @@
+import os
+import subprocess
+from math import gcd
+from typing import Optional
+
+import numpy as np
+from scipy import ndimage, signal
+
+from src.media import MediaInfo, ffmpeg_exe, probe
+
+MIX_RATE = 48000
+MIX_CHANNELS = 2
+
+def decode_audio(video_path: str, sr: int = MIX_RATE, channels: int = MIX_CHANNELS) -> np.ndarray:
+    """元動画の音声トラックを float32 (N, channels) で 1 回だけデコードする"""
+    cmd = [ffmpeg_exe(), "-v", "error", "-nostdin", "-i", video_path, "-map", "0:a:0", "-vn",
+           "-f", "f32le", "-ac", str(channels), "-ar", str(sr), "pipe:1"]
+    res = subprocess.run(cmd, capture_output=True, check=True)
+    return np.frombuffer(res.stdout, dtype=np.float32).reshape(-1, channels)
+
+def resample(audio: np.ndarray, sr_in: int, sr_out: int) -> np.ndarray:
+    """ポリフェーズでのリサンプル（32k → 48k なら 3/2 倍）"""
+    if sr_in == sr_out:
+        return np.asarray(audio, dtype=np.float32)
+    g = gcd(int(sr_in), int(sr_out))
+    out = signal.resample_poly(audio, int(sr_out) // g, int(sr_in) // g, axis=0)
+    return out.astype(np.float32, copy=False)
+
+def duck_gain(orig: np.ndarray, sr: int, n: int, duck_db: float, thresh_db: float = -35.0,
+              block_ms: float = 20.0, hold_ms: float = 300.0, smooth_ms: float = 80.0) -> np.ndarray:
+    """
+    サイドチェイン用のゲイン曲線（長さ n、線形倍率）。
+    元音声の声の帯域 (300–3400 Hz) の短時間レベルが thresh_db を超える区間で BGM を duck_db 下げる。
+    hold_ms の最大値フィルタで細かく揺れないようにしてから平滑化する。
+    """
+    if duck_db >= 0 or len(orig) == 0:
+        return np.ones(n, dtype=np.float32)
+    mono = orig.mean(axis=1) if orig.ndim == 2 else orig
+    sos = signal.butter(2, [300, 3400], btype="bandpass", fs=sr, output="sos")
+    voice = signal.sosfilt(sos, mono)
+
+    block = max(1, int(sr * block_ms / 1000))
+    nb = len(voice) // block
+    if nb == 0:
+        return np.ones(n, dtype=np.float32)
+    rms = np.sqrt(np.mean(voice[:nb * block].reshape(nb, block) ** 2, axis=1) + 1e-12)
+    level = 20 * np.log10(rms)
+    # しきい値から 10 dB 上で最大量まで効かせる
+    amount = np.clip((level - thresh_db) / 10.0, 0.0, 1.0)
+    amount = ndimage.maximum_filter1d(amount, size=max(1, int(hold_ms / block_ms)))
+    a = np.exp(-block_ms / max(smooth_ms, 1e-3))
+    amount = signal.filtfilt([1 - a], [1, -a], amount) if nb > 9 else amount
+
+    centers = (np.arange(nb) + 0.5) * block
+    gain_db = duck_db * np.clip(amount, 0.0, 1.0)
+    return (10 ** (np.interp(np.arange(n), centers, gain_db) / 20)).astype(np.float32)
+
+def mux_mix_pcm_to_video(video_path: str, audio: np.ndarray, sr: int, out_path: str,
+                         bgm_gain_db: float = -3.0, duck_db: float = 0.0,
+                         info: Optional[MediaInfo] = None, chunk_seconds: float = 2.0) -> str:
+    """
+    BGM（メモリ上の float 配列）を元音声とプロセス内でミックスし、ffmpeg 1 回で mux する。
+    リサンプル・ゲイン・ダッキング・ミックスは NumPy でチャンクごとに行い、
+    float PCM を stdin に流す。中間 WAV も amix のフィルタグラフも使わない（映像は -c:v copy）。
+    長さは BGM・元音声・動画の一番長いもの（amix の duration=longest と同じく、BGM が短ければ後ろは元音声だけ）。
+    """
+    info = info or probe(video_path)
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+
+    bgm = resample(np.asarray(audio, dtype=np.float32), sr, MIX_RATE)
+    bgm_gain = np.float32(10 ** (bgm_gain_db / 20))
+    if bgm.ndim == 1:
+        bgm = bgm[:, None]
+        bgm_gain *= np.float32(np.sqrt(0.5))  # ffmpeg の mono→stereo と同じく各チャンネル -3dB
+    n = len(bgm)
+
+    orig = decode_audio(video_path) if info.has_audio else None
+    duck = duck_gain(orig, MIX_RATE, n, duck_db) if orig is not None and duck_db < 0 else None
+    total = max(n, 0 if orig is None else len(orig), int(round(max(0.0, info.duration) * MIX_RATE)))
+
+    cmd = [
+        ffmpeg_exe(), "-y", "-v", "error", "-nostdin",
+        "-i", video_path,
+        "-f", "f32le", "-ar", str(MIX_RATE), "-ac", str(MIX_CHANNELS), "-i", "pipe:0",
+        "-map", "0:v:0", "-map", "1:a:0",
+        "-c:v", "copy",
+        "-c:a", "aac", "-b:a", "192k", "-ar", str(MIX_RATE),
+        "-movflags", "+faststart",
+        "-shortest",
+        out_path,
+    ]
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+    step = max(1, int(chunk_seconds * MIX_RATE))
+    buf = np.empty((step, MIX_CHANNELS), dtype=np.float32)
+    try:
+        for start in range(0, total, step):
+            end = min(total, start + step)
+            out = buf[:end - start]
+            b = bgm[start:end]
+            g = bgm_gain if duck is None else (bgm_gain * duck[start:start + len(b)])[:, None]
+            np.multiply(b, g, out=out[:len(b)])  # モノラル BGM は両チャンネルへ
+            out[len(b):] = 0.0                   # BGM の終わりより後ろは無音
+            if orig is not None and start < len(orig):
+                o = orig[start:end]
+                out[:len(o)] += o
+            np.clip(out, -1.0, 1.0, out=out)
+            proc.stdin.write(out.tobytes())
+    except BrokenPipeError:
+        pass  # ffmpeg が先に落ちた。下の終了コードで報告する
+    finally:
+        try:
+            proc.stdin.close()
+        except BrokenPipeError:
+            pass
+    if proc.wait() != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+    return out_path
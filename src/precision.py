@@ -0,0 +1,53 @@
+import functools
+import os
+from typing import Iterable, Optional
+
+import torch
+
+# CPU 推論の精度。USE_CPU と同じく環境変数で選ぶ（GPU/MPS では無視して従来どおり）
+#   fp32 : 既定（従来どおり）
+#   bf16 : 対象モジュールの forward を bfloat16 autocast で回す（AVX512-BF16 / AMX で速い）
+#   int8 : 対象モジュールの nn.Linear を動的 int8 量子化（重みメモリ約 1/4、AVX2 以上で速い）
+CPU_PRECISIONS = ("fp32", "bf16", "int8")
+
+def cpu_precision(value: Optional[str] = None) -> str:
+    p = (value if value is not None else os.getenv("CPU_PRECISION", "fp32")).strip().lower()
+    if p not in CPU_PRECISIONS:
+        raise ValueError(f"CPU_PRECISION must be one of {CPU_PRECISIONS}, got {p!r}")
+    return p
+
+def _float_outputs(out):
+    """autocast 下の出力（logits など）を fp32 に戻す。サンプリングや後段の処理は従来の精度のまま"""
+    if isinstance(out, torch.Tensor):
+        return out.float() if out.dtype == torch.bfloat16 else out
+    if isinstance(out, dict):  # transformers の ModelOutput も dict
+        for k, v in list(out.items()):
+            if isinstance(v, torch.Tensor) and v.dtype == torch.bfloat16:
+                out[k] = v.float()
+    return out
+
+def _autocast_bf16(module: torch.nn.Module):
+    forward = module.forward
+
+    @functools.wraps(forward)
+    def wrapped(*args, **kwargs):
+        with torch.autocast("cpu", dtype=torch.bfloat16):
+            return _float_outputs(forward(*args, **kwargs))
+
+    module.forward = wrapped
+
+def apply_cpu_precision(model: torch.nn.Module, submodules: Iterable[str], precision: str,
+                        device: str) -> str:
+    """
+    model の submodules（属性名）だけを指定精度にする。EnCodec などそれ以外は fp32 のまま。
+    戻りは実際に適用した精度（CPU 以外では常に "fp32"）。
+    """
+    if device != "cpu" or precision == "fp32":
+        return "fp32"
+    for name in submodules:
+        sub = getattr(model, name)
+        if precision == "int8":
+            torch.ao.quantization.quantize_dynamic(sub, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+        elif precision == "bf16":
+            _autocast_bf16(sub)
+    return precision
@@ -0,0 +1,15 @@
+import os
+
+# 品質レベル（1=軽い … 5=重い）ごとの抽出フレーム数と生成パラメータ
+# analysis: "caption" = BLIP のキャプション / "embed" = 埋め込みモデルで固定語彙に当てる（src/scene_embed.py）
+QUALITY_PRESETS = {
+    1: {"max_frames": 6,  "tokens_per_sec": 32, "guidance": 1.8, "top_k": 120, "analysis": "caption"},
+    2: {"max_frames": 8,  "tokens_per_sec": 36, "guidance": 2.0, "top_k": 160, "analysis": "caption"},
+    3: {"max_frames": 10, "tokens_per_sec": 40, "guidance": 2.2, "top_k": 200, "analysis": "caption"},
+    4: {"max_frames": 12, "tokens_per_sec": 46, "guidance": 2.6, "top_k": 240, "analysis": "caption"},
+    5: {"max_frames": 16, "tokens_per_sec": 50, "guidance": 3.0, "top_k": 280, "analysis": "caption"},
+}
+# 例: BGMER_EMBED_LEVELS=1,2 で軽いレベルだけ埋め込み解析にする
+for _lv in filter(None, (v.strip() for v in os.getenv("BGMER_EMBED_LEVELS", "").split(","))):
+    QUALITY_PRESETS[int(_lv)]["analysis"] = "embed"
+SCENE_THRESH = 0.35
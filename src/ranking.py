@@ -0,0 +1,65 @@
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+FRAME = 2048
+# 各候補のピークからこれ以上小さいフレームは無音とみなす
+SILENCE_DB = -45.0
+# スペクトル平坦度がこれを超えるとノイズ・打楽器だけに近い（音程のある音は 0.1 前後以下）
+FLATNESS_LIMIT = 0.25
+# ピーク比のラウドネス（無音を除いた RMS）の目安。これから離れるほど薄い / 潰れている
+LOUDNESS_TARGET_DB = -14.0
+# 平坦度は FFT するので、長い音は等間隔にこのフレーム数だけ見る
+MAX_FFT_FRAMES = 256
+WEIGHTS = {"silence_ratio": 2.0, "flatness": 4.0, "clip_ratio": 50.0, "loudness_db": 0.05}
+
+def audio_metrics(audio: np.ndarray, sr: int) -> Dict[str, np.ndarray]:
+    """
+    (候補数, サンプル数) の音から候補毎の指標を一度に出す（値はすべて (候補数,)）。
+    silence_ratio: 無音フレームの割合 / flatness: 無音以外のフレームのスペクトル平坦度の平均 /
+    loudness_db: 無音以外の RMS（ピーク比 dB）/ clip_ratio: ピークの 99% 以上に張り付いたサンプルの割合。
+    sr は今は使わない（FRAME は 32kHz で約 64ms）。
+    """
+    x = np.atleast_2d(np.asarray(audio, dtype=np.float32))
+    if x.shape[1] < FRAME:
+        x = np.pad(x, ((0, 0), (0, FRAME - x.shape[1])))
+    n = x.shape[1] // FRAME
+    frames = x[:, :n * FRAME].reshape(len(x), n, FRAME)
+    peak = np.abs(x).max(axis=1) + 1e-9
+
+    power = np.mean(np.square(frames), axis=2) + 1e-12                  # (候補, フレーム)
+    voiced = 10 * np.log10(power / np.square(peak)[:, None]) > SILENCE_DB
+    count = np.maximum(voiced.sum(axis=1), 1)
+    silence_ratio = 1.0 - voiced.mean(axis=1)
+    loudness_db = 10 * np.log10(np.where(voiced, power, 0).sum(axis=1) / count + 1e-12) - 20 * np.log10(peak)
+
+    pick = np.unique(np.linspace(0, n - 1, min(n, MAX_FFT_FRAMES)).astype(np.int64))
+    spec = np.square(np.abs(np.fft.rfft(frames[:, pick] * np.hanning(FRAME).astype(np.float32), axis=2))) + 1e-12
+    flat = np.exp(np.mean(np.log(spec), axis=2)) / np.mean(spec, axis=2)
+    v = voiced[:, pick]
+    flatness = np.where(v, flat, 0).sum(axis=1) / np.maximum(v.sum(axis=1), 1)
+
+    clip_ratio = np.mean(np.abs(x) >= 0.99 * peak[:, None], axis=1)
+    return {"silence_ratio": silence_ratio, "flatness": flatness, "loudness_db": loudness_db,
+            "clip_ratio": clip_ratio}
+
+def score(m: Dict[str, np.ndarray]) -> np.ndarray:
+    """大きいほど良い。各指標の悪さを WEIGHTS で足して負にしたもの"""
+    return -(WEIGHTS["silence_ratio"] * m["silence_ratio"]
+             + WEIGHTS["flatness"] * np.maximum(0.0, m["flatness"] - FLATNESS_LIMIT)
+             + WEIGHTS["clip_ratio"] * m["clip_ratio"]
+             + WEIGHTS["loudness_db"] * np.abs(m["loudness_db"] - LOUDNESS_TARGET_DB))
+
+def rank_takes(audios: Sequence[np.ndarray], sr: int) -> Tuple[List[int], List[dict]]:
+    """
+    候補を良い順に並べた添字と、候補毎の指標（score 付き、元の順）。
+    長さが違う候補は一番短いものに揃えて比べる。
+    """
+    if not audios:
+        return [], []
+    n = min(len(a) for a in audios)
+    m = audio_metrics(np.stack([np.asarray(a, dtype=np.float32)[:n] for a in audios]), sr)
+    m["score"] = score(m)
+    order = sorted(range(len(audios)), key=lambda i: -m["score"][i])
+    metrics = [{k: float(v[i]) for k, v in m.items()} for i in range(len(audios))]
+    return order, metrics
@@ -0,0 +1,159 @@
+import gc
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+import torch
+
+# transformers の from_pretrained はモデル構築中に accelerate の init_empty_weights で
+# nn.Module.register_parameter をプロセス全体で差し替える。2 スレッドで同時に入ると差し替えが戻らず
+# 以後のモデルが meta テンソルになるので、重みの構築だけはこのロックで直列化する
+# （プロセッサの読み込みやデバイス転送はロックの外で並列に進む）。
+FROM_PRETRAINED_LOCK = threading.Lock()
+# サンプリングする generate は torch のグローバル乱数を使う。ジョブを並列に回すと seed を入れてから
+# 生成し終わるまでの間に他のスレッドが乱数を進めて再現できなくなるので、乱数を使う生成はこのロックで直列化する
+# （モデル毎のロックでは足りない: BLIP の sample デコードも同じ乱数を使う）。
+# ストリーミング中は別スレッドから再開されることがあるので RLock ではなく Lock
+SAMPLING_LOCK = threading.Lock()
+
+def process_rss() -> int:
+    """このプロセスの現在の常駐メモリ（バイト）"""
+    try:
+        import psutil
+        return int(psutil.Process().memory_info().rss)
+    except Exception:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+def peak_rss() -> int:
+    """このプロセスのピーク常駐メモリ（バイト）。resource の無い Windows では今の RSS で代用"""
+    try:
+        import resource
+    except ImportError:
+        return process_rss()
+    r = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return int(r if sys.platform == "darwin" else r * 1024)  # mac はバイト、Linux は KiB
+
+def _modules(obj) -> List[torch.nn.Module]:
+    return [v for v in vars(obj).values() if isinstance(v, torch.nn.Module)]
+
+def _module_bytes(obj) -> int:
+    total = 0
+    for m in _modules(obj):
+        for t in list(m.parameters()) + list(m.buffers()):
+            total += t.numel() * t.element_size()
+    return total
+
+def _release_device_memory():
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+    elif getattr(torch.backends, "mps", None) and torch.backends.mps.is_available():
+        torch.mps.empty_cache()
+
+@dataclass
+class _Entry:
+    factory: Callable[[], Any]
+    obj: Any = None
+    parked: bool = False      # CPU に退避中（device 属性は元のまま）
+    refs: int = 0
+    last_used: float = field(default_factory=time.monotonic)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+class ModelRegistry:
+    """
+    名前ごとにロックを持つモデル置き場。同じモデルを同時に要求されても読み込みは 1 回（single-flight）。
+    一定時間使われなかったモデルはデバイスメモリから外す（park_cpu=True なら CPU に退避して復帰を速く）。
+    モデルは `.device` と torch.nn.Module の属性（`.model` など）を持つオブジェクトを想定する。
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, _Entry] = {}
+
+    def register(self, name: str, factory: Callable[[], Any]):
+        self._entries[name] = _Entry(factory)
+
+    def get(self, name: str) -> Any:
+        e = self._entries[name]
+        with e.lock:
+            if e.obj is None:
+                t0 = time.perf_counter()
+                e.obj = e.factory()
+                print(f"[Models] loaded {name} in {time.perf_counter() - t0:.1f}s", flush=True)
+            elif e.parked:
+                for m in _modules(e.obj):
+                    m.to(e.obj.device)
+                e.parked = False
+            e.last_used = time.monotonic()
+            return e.obj
+
+    def peek(self, name: str) -> Optional[Any]:
+        """読み込み済みなら返す（読み込みはしない）"""
+        return self._entries[name].obj
+
+    @contextmanager
+    def use(self, name: str):
+        """使用中はアイドル解放の対象から外す"""
+        e = self._entries[name]
+        with e.lock:
+            e.refs += 1
+        try:
+            yield self.get(name)
+        finally:
+            with e.lock:
+                e.refs -= 1
+                e.last_used = time.monotonic()
+
+    def load(self, *names: str) -> List[Any]:
+        """複数モデルを並列に読み込む（既に載っているものはそのまま）"""
+        names = names or tuple(self._entries)
+        with ThreadPoolExecutor(max_workers=len(names), thread_name_prefix="model-load") as ex:
+            return list(ex.map(self.get, names))
+
+    def evict_idle(self, idle_sec: float, park_cpu: bool = False) -> List[str]:
+        """idle_sec 以上使われていないモデルを外す。CPU 上のモデルは退避しても意味がないので解放する"""
+        now = time.monotonic()
+        evicted = []
+        for name, e in self._entries.items():
+            with e.lock:
+                if e.obj is None or e.refs > 0 or e.parked or now - e.last_used < idle_sec:
+                    continue
+                if park_cpu and str(e.obj.device) != "cpu":
+                    for m in _modules(e.obj):
+                        m.to("cpu")
+                    e.parked = True
+                else:
+                    e.obj = None
+                evicted.append(name)
+        if evicted:
+            _release_device_memory()
+        return evicted
+
+    def resident(self) -> dict:
+        """読み込み状態とメモリ使用量のスナップショット"""
+        models = {}
+        for name, e in self._entries.items():
+            obj = e.obj
+            if obj is None:
+                models[name] = {"state": "unloaded"}
+                continue
+            models[name] = {
+                "state": "parked" if e.parked else "loaded",
+                "device": "cpu" if e.parked else str(obj.device),
+                "bytes": _module_bytes(obj),
+                "idle_sec": round(time.monotonic() - e.last_used, 1),
+                "in_use": e.refs,
+            }
+        out = {"rss_bytes": process_rss(), "models": models}
+        if torch.cuda.is_available():
+            out["cuda_allocated_bytes"] = int(torch.cuda.memory_allocated())
+        return out
@@ -0,0 +1,167 @@
+import hashlib
+import json
+import os
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+import torch
+from PIL import Image
+from transformers import AutoModel, AutoProcessor
+
+from src.precision import apply_cpu_precision, cpu_precision
+from src.registry import FROM_PRETRAINED_LOCK
+from src.telemetry import span
+from src.video2text import compose_prompt
+
+# ラベル → そのラベルを表す文。文毎の埋め込みを平均したものをラベルの埋め込みにする
+TEMPO_LABELS = {
+    "fast": ("people running", "people dancing", "a fast moving car", "a sports game", "an action scene",
+             "people jumping", "a busy crowded street"),
+    "mid-tempo": ("a calm landscape", "people talking", "a quiet room", "a person sitting still",
+                  "a slow walk in a park", "a still life"),
+}
+MOOD_LABELS = {
+    "dark": ("a dark night scene", "a storm with heavy rain", "dark shadows", "a dim underground tunnel",
+             "a gloomy alley"),
+    "bright": ("a sunny day", "a bright colorful scene", "a cheerful brightly lit room", "a clear blue sky"),
+}
+SCENE_LABELS = (
+    "a beach", "the ocean", "a city street", "a city at night", "a forest", "mountains", "a snowy landscape",
+    "a desert", "a park", "a garden", "a living room", "a kitchen", "an office", "a classroom", "a restaurant",
+    "a concert", "a stage performance", "a sports field", "a gym", "a road trip", "a car interior", "a train",
+    "an airplane", "a sunset", "a river", "a lake", "a wedding", "a party", "people dancing", "a dog", "a cat",
+    "food on a table", "a computer screen", "a video game", "a crowd of people", "a portrait of a person",
+    "children playing", "a shop", "a museum", "a construction site",
+)
+TEMPLATE = "a photo of {}"
+
+@dataclass
+class SceneEmbedder:
+    """
+    BLIP のキャプションの代わりに、画像・テキスト埋め込みモデル（CLIP / SigLIP）でフレームを
+    固定語彙（テンポ・ムード・場面）に当てる解析エンジン。
+    語彙の埋め込みは 1 回だけ計算して cache_dir に保存し、フレームは全部を batch_size 毎の forward で埋め込む。
+    自己回帰デコードが無いぶん速い。プロンプトは build_prompt_from_captions と同じ形（compose_prompt）。
+    """
+    model_id: str = os.getenv("EMBED_MODEL", "openai/clip-vit-base-patch32")
+    batch_size: int = int(os.getenv("EMBED_BATCH_SIZE", "32"))
+    # CPU 推論の精度（fp32 / bf16 / int8）。src/precision.py 参照
+    precision: str = os.getenv("CPU_PRECISION", "fp32")
+    cache_dir: Optional[str] = None
+
+    def __post_init__(self):
+        if torch.cuda.is_available():
+            self.device = "cuda"
+        elif hasattr(torch.backends, "mps") and torch.backends.mps.is_available():
+            self.device = "mps"
+        else:
+            self.device = "cpu"
+
+        self.processor = AutoProcessor.from_pretrained(self.model_id)
+        with FROM_PRETRAINED_LOCK:
+            model = AutoModel.from_pretrained(self.model_id)
+        self.model = model.to(self.device)
+        self.model.eval()
+        self.precision = apply_cpu_precision(self.model, ("vision_model", "text_model"),
+                                             cpu_precision(self.precision), self.device)
+        scale = getattr(self.model, "logit_scale", None)
+        self.logit_scale = float(scale.detach().exp()) if scale is not None else 100.0
+        self.vocab = self._load_vocab()
+
+    # ---- 語彙 ----
+    def _vocab_path(self) -> Optional[str]:
+        if not self.cache_dir:
+            return None
+        raw = json.dumps([self.model_id, self.precision, TEMPLATE, TEMPO_LABELS, MOOD_LABELS, SCENE_LABELS])
+        key = hashlib.blake2b(raw.encode("utf-8"), digest_size=12).hexdigest()
+        return os.path.join(self.cache_dir, f"vocab-{key}.npz")
+
+    def _load_vocab(self) -> Dict[str, np.ndarray]:
+        """{"tempo": (2, D), "mood": (2, D), "scene": (len(SCENE_LABELS), D)}（L2 正規化済み）"""
+        path = self._vocab_path()
+        if path and os.path.exists(path):
+            with np.load(path) as z:
+                return {k: z[k] for k in z.files}
+        vocab = {
+            "tempo": self._label_embeds(TEMPO_LABELS.values()),
+            "mood": self._label_embeds(MOOD_LABELS.values()),
+            "scene": self._label_embeds([(s,) for s in SCENE_LABELS]),
+        }
+        if path:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp = path + ".tmp.npz"
+            np.savez(tmp, **vocab)
+            os.replace(tmp, path)
+        return vocab
+
+    def _label_embeds(self, groups: Iterable[Tuple[str, ...]]) -> np.ndarray:
+        groups = [list(g) for g in groups]
+        flat = self._embed_text([TEMPLATE.format(t) for g in groups for t in g])
+        out, i = [], 0
+        for g in groups:
+            v = flat[i:i + len(g)].mean(axis=0)
+            out.append(v / (np.linalg.norm(v) + 1e-8))
+            i += len(g)
+        return np.stack(out).astype(np.float32)
+
+    def _embed_text(self, texts: List[str]) -> np.ndarray:
+        inputs = self.processor(text=texts, padding=True, return_tensors="pt").to(self.device)
+        with torch.inference_mode():
+            v = self.model.get_text_features(**inputs)
+        return _normalize(v)
+
+    # ---- フレーム ----
+    def embed_images(self, images: List[Union[Image.Image, np.ndarray]]) -> np.ndarray:
+        with span("embed_batch", frames=len(images), device=self.device):
+            pixel_values = self.processor(images=list(images), return_tensors="pt")["pixel_values"]
+            pixel_values = pixel_values.to(self.device, dtype=self.model.dtype)
+            with torch.inference_mode():
+                v = self.model.get_image_features(pixel_values=pixel_values)
+            return _normalize(v)
+
+    def analyze(self, images: List[Union[Image.Image, np.ndarray]]) -> Tuple[List[str], str]:
+        bs = max(1, int(self.batch_size))
+        return self.analyze_batches(images[i:i + bs] for i in range(0, len(images), bs))
+
+    def analyze_batches(self, batches: Iterable[List[Union[Image.Image, np.ndarray]]]) -> Tuple[List[str], str]:
+        """
+        (フレーム毎の場面ラベル, プロンプト)。FrameQueue.batches と組み合わせれば抽出と並行して埋め込める。
+        テンポ・ムードは全フレームの確率の平均で、場面は各フレームの 1 位ラベル（重複除去、出現順）。
+        """
+        embeds = [self.embed_images(b) for b in batches]
+        return self._describe(np.concatenate(embeds) if embeds else None)
+
+    def analyze_groups(self, groups: List[List[Union[Image.Image, np.ndarray]]]) -> List[Tuple[List[str], str]]:
+        """区間毎の (場面ラベル, プロンプト)。埋め込みは全グループを通して batch_size 毎にまとめて計算する"""
+        flat = [im for g in groups for im in g]
+        bs = max(1, int(self.batch_size))
+        img = np.concatenate([self.embed_images(flat[i:i + bs]) for i in range(0, len(flat), bs)]) if flat else None
+        out, i = [], 0
+        for g in groups:
+            out.append(self._describe(img[i:i + len(g)] if g else None))
+            i += len(g)
+        return out
+
+    def _describe(self, img: Optional[np.ndarray]) -> Tuple[List[str], str]:
+        if img is None or len(img) == 0:
+            return [], compose_prompt("mid-tempo", "bright", "")
+        p_tempo = _softmax(self.logit_scale * img @ self.vocab["tempo"].T).mean(axis=0)
+        p_mood = _softmax(self.logit_scale * img @ self.vocab["mood"].T).mean(axis=0)
+        labels = [SCENE_LABELS[i] for i in (img @ self.vocab["scene"].T).argmax(axis=1)]
+        uniq = list(dict.fromkeys(labels))
+        # キャプション版と同じく、場面が多い（6 種以上）動画も fast 扱い
+        is_fast = len(uniq) >= 6 or p_tempo[0] > 0.5
+        is_dark = p_mood[0] > 0.5
+        prompt = compose_prompt("fast" if is_fast else "mid-tempo", "dark" if is_dark else "bright",
+                                "; ".join(uniq[:8]))
+        return labels, prompt
+
+def _normalize(v: torch.Tensor) -> np.ndarray:
+    v = v.float().cpu().numpy()
+    return v / (np.linalg.norm(v, axis=-1, keepdims=True) + 1e-8)
+
+def _softmax(x: np.ndarray) -> np.ndarray:
+    x = x - x.max(axis=-1, keepdims=True)
+    e = np.exp(x)
+    return e / e.sum(axis=-1, keepdims=True)
@@ -0,0 +1,117 @@
+import dataclasses
+import queue
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, List, Tuple, Union
+
+import numpy as np
+
+from src.text2music import GenerateConfig, MusicGenerator
+
+@dataclass
+class _Pending:
+    prompt: str
+    cfg: GenerateConfig
+    future: Future = field(default_factory=Future)
+    enqueued: float = field(default_factory=time.monotonic)
+
+def _batch_key(cfg: GenerateConfig) -> tuple:
+    """同じ generate 呼び出しにまとめられる設定かどうか（seed 以外が一致すれば OK）"""
+    d = dataclasses.asdict(cfg)
+    d.pop("seed", None)
+    return tuple(sorted(d.items()))
+
+class BatchScheduler:
+    """
+    MusicGenerator の前段に置くバッチスケジューラ。
+    window_ms の間に届いた生成リクエストを設定ごとにまとめ、generate_batch 1 回で処理して
+    結果を各リクエストの Future に配る。キュー待ち時間・バッチサイズ・スループットを集計する。
+    generator には MusicGenerator か、それを返す関数（アイドル解放されるモデルを毎回取り直す用）を渡す。
+    """
+
+    def __init__(self, generator: Union[MusicGenerator, Callable[[], MusicGenerator]], window_ms: float = 50.0,
+                 max_batch: int = 4, history: int = 256):
+        self.generator = generator
+        self.window = max(0.0, float(window_ms)) / 1000.0
+        self.max_batch = max(1, int(max_batch))
+        self._queue: "queue.Queue[_Pending]" = queue.Queue()
+        self._batches: Deque[dict] = deque(maxlen=history)
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._loop, name="bgmer-batch", daemon=True)
+        self._thread.start()
+
+    def submit(self, prompt: str, cfg: GenerateConfig) -> Future:
+        item = _Pending(prompt, cfg)
+        self._queue.put(item)
+        return item.future
+
+    def generate(self, prompt: str, cfg: GenerateConfig) -> Tuple[int, np.ndarray]:
+        """MusicGenerator.generate と同じ形で使えるブロッキング版"""
+        return self.submit(prompt, cfg).result()
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def _collect(self) -> List[_Pending]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            groups: Dict[tuple, List[_Pending]] = defaultdict(list)
+            for item in self._collect():
+                groups[_batch_key(item.cfg)].append(item)
+            for items in groups.values():
+                self._run(items)
+
+    def _run(self, items: List[_Pending]):
+        start = time.monotonic()
+        waits = [start - it.enqueued for it in items]
+        try:
+            gen = self.generator() if callable(self.generator) else self.generator
+            results = gen.generate_batch([it.prompt for it in items], items[0].cfg)
+        except BaseException as e:
+            for it in items:
+                it.future.set_exception(e)
+            return
+        elapsed = time.monotonic() - start
+        audio_sec = sum(len(a) / sr for sr, a in results)
+        for it, res in zip(items, results):
+            it.future.set_result(res)
+
+        rec = {"size": len(items), "wait_max": max(waits), "wait_mean": sum(waits) / len(waits),
+               "seconds": elapsed, "audio_seconds": audio_sec}
+        with self._lock:
+            self._batches.append(rec)
+        print(f"[Batch] size={rec['size']} wait={rec['wait_mean'] * 1000:.0f}ms(max {rec['wait_max'] * 1000:.0f}ms) "
+              f"gen={elapsed:.1f}s throughput={audio_sec / max(elapsed, 1e-6):.2f} audio-s/s", flush=True)
+
+    def stats(self) -> dict:
+        """直近 history バッチの集計（window_ms / max_batch のチューニング用）"""
+        with self._lock:
+            recs = list(self._batches)
+        if not recs:
+            return {"batches": 0, "requests": 0, "queue_depth": self.queue_depth()}
+        waits = sorted(r["wait_max"] for r in recs)
+        busy = sum(r["seconds"] for r in recs)
+        return {
+            "batches": len(recs),
+            "requests": sum(r["size"] for r in recs),
+            "batch_size_mean": sum(r["size"] for r in recs) / len(recs),
+            "queue_wait_mean_ms": 1000 * sum(r["wait_mean"] * r["size"] for r in recs) / sum(r["size"] for r in recs),
+            "queue_wait_p95_ms": 1000 * waits[min(len(waits) - 1, int(0.95 * len(waits)))],
+            "throughput_audio_s_per_s": sum(r["audio_seconds"] for r in recs) / max(busy, 1e-6),
+            "queue_depth": self.queue_depth(),
+        }
@@ -0,0 +1,158 @@
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import replace
+from multiprocessing import get_context
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from src.audio_fit import fit_to_length, peak
+
+# 1 区間の長さ。上限は MusicGen の 1 窓（1500 トークン）に crossfade 分を足しても収まる長さ
+MIN_SEGMENT_SEC = float(os.getenv("BGMER_SEGMENT_MIN_SEC", "8"))
+MAX_SEGMENT_SEC = 28.0
+CROSSFADE_SEC = 1.0
+
+# (プロンプト列, GenerateConfig) → [(sr, audio), ...]。1 件が generate_batch 1 回
+Job = Tuple[List[str], object]
+
+def plan_segments(cuts: Sequence[float], duration: float, min_seconds: float = MIN_SEGMENT_SEC,
+                  max_seconds: float = MAX_SEGMENT_SEC) -> List[Tuple[float, float]]:
+    """
+    シーン変化の時刻で [0, duration] を区切る。min_seconds 未満になる切れ目は捨て（前の区間に含める）、
+    max_seconds を超える区間は等分する（シーン変化が無い長い動画もここで並列に回せる長さになる）。
+    """
+    if duration <= 0:
+        return []
+    bounds = [0.0]
+    for c in sorted(float(c) for c in cuts):
+        if c - bounds[-1] >= min_seconds and duration - c >= min_seconds:
+            bounds.append(c)
+    bounds.append(float(duration))
+    out: List[Tuple[float, float]] = []
+    for s, e in zip(bounds[:-1], bounds[1:]):
+        n = max(1, int(math.ceil((e - s) / max_seconds - 1e-9)))
+        out.extend((s + (e - s) * i / n, s + (e - s) * (i + 1) / n) for i in range(n))
+    return out
+
+def length_buckets(lengths: Sequence[float], max_batch: int = 8, max_ratio: float = 1.25) -> List[List[int]]:
+    """
+    長さの近い区間の添字をまとめる（1 回の generate_batch は一番長い区間に合わせて生成するので、
+    最長 / 最短 が max_ratio 以下の区間だけを最大 max_batch 件まで同じバッチにする）
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    buckets: List[List[int]] = []
+    for i in order:
+        b = buckets[-1] if buckets else None
+        if b and len(b) < max_batch and lengths[i] <= max_ratio * max(lengths[b[0]], 1e-9):
+            b.append(i)
+        else:
+            buckets.append([i])
+    return buckets
+
+def equal_power_join(parts: Sequence[np.ndarray], lengths: Sequence[int], fade: int,
+                     sr: Optional[int] = None) -> np.ndarray:
+    """
+    区間毎の音を sum(lengths) サンプルに並べる。最後以外の区間は lengths[i] + fade サンプル使い、
+    はみ出した fade 分を次の区間の頭と sin / cos（二乗和 1）でクロスフェードする。
+    足りない区間は繰り返して埋める（tokens_per_sec < フレームレートのプリセットは指定秒数より短く生成されるため）。
+    sr を渡せば fit_audio_exact_seconds と同じ拍に合わせたループ、無ければ単純な繰り返し。
+    """
+    total = int(sum(lengths))
+    out = np.zeros(total, dtype=np.float32)
+    if not parts:
+        return out
+    fade = max(0, min(int(fade), min(int(n) for n in lengths)))
+    t = (np.arange(fade, dtype=np.float32) + 0.5) / max(fade, 1)
+    fade_in, fade_out = np.sin(0.5 * np.pi * t), np.cos(0.5 * np.pi * t)
+    pos = 0
+    for i, (a, n) in enumerate(zip(parts, lengths)):
+        n = int(n)
+        last = i == len(parts) - 1
+        span = n if last else n + fade
+        a = np.asarray(a if a is not None else [], dtype=np.float32).reshape(-1)
+        if sr and 0 < a.size < span:
+            seg = fit_to_length(a, span, sr, edge_fade_sec=0.0)
+        else:
+            seg = np.resize(a, span) if a.size else np.zeros(span, dtype=np.float32)
+        if i > 0:
+            seg[:fade] *= fade_in
+        if not last:
+            seg[n:] *= fade_out
+        out[pos:pos + span] += seg
+        pos += n
+    return out
+
+def render_segments(prompts: Sequence[str], lengths: Sequence[float], cfg,
+                    run_jobs: Callable[[List[Job]], List[List[Tuple[int, np.ndarray]]]],
+                    max_batch: int = 8, fade_seconds: float = CROSSFADE_SEC) -> Tuple[int, np.ndarray]:
+    """
+    区間毎のプロンプトと長さ（秒）から 1 本の BGM を作る。長さの近い区間を generate_batch 1 回分（Job）に
+    まとめて run_jobs に渡し（同じモデルで順に回すか、SegmentPool で並列に回すかは呼び出し側）、
+    戻ってきた音を equal_power_join でつなぐ。seed は Job 毎にずらす。
+    """
+    jobs: List[Job] = []
+    buckets = length_buckets(lengths, max_batch=max_batch)
+    for j, idx in enumerate(buckets):
+        seconds = int(math.ceil(max(lengths[i] for i in idx) + fade_seconds))
+        seed = None if cfg.seed is None else cfg.seed + j
+        jobs.append(([prompts[i] for i in idx], replace(cfg, seconds=seconds, seed=seed)))
+    results = run_jobs(jobs)
+
+    sr = 32000
+    parts: List[Optional[np.ndarray]] = [None] * len(lengths)
+    for idx, res in zip(buckets, results):
+        for i, (sr, audio) in zip(idx, res):
+            parts[i] = audio
+    # 区間の境目をサンプル単位で丸めても合計が変わらないよう、累積時刻から長さを出す
+    edges = np.round(np.concatenate([[0.0], np.cumsum(lengths)]) * sr).astype(np.int64)
+    audio = equal_power_join(parts, np.diff(edges).tolist(), int(round(fade_seconds * sr)), sr=sr)
+    # 区間毎にピーク 1 に揃えてあるので、つなぎ目の重なりで 1 を超えた分だけ全体を縮める
+    audio /= max(1.0, float(peak(audio)) if audio.size else 1.0)
+    return sr, audio
+
+# ===== 多コア CPU 向け：区間をプロセスに振り分ける =====
+_WORKER_GEN = None
+
+def _init_worker(threads: int):
+    import torch
+    from src.text2music import MusicGenerator
+    global _WORKER_GEN
+    torch.set_num_threads(max(1, int(threads)))
+    _WORKER_GEN = MusicGenerator()
+
+def _worker_generate(job: Job):
+    prompts, cfg = job
+    return _WORKER_GEN.generate_batch(prompts, cfg)
+
+def _worker_ready() -> bool:
+    return _WORKER_GEN is not None
+
+class SegmentPool:
+    """
+    MusicGenerator を 1 つずつ持つワーカープロセス群（spawn）。各ワーカーの torch スレッド数は
+    コア数 / workers なので、区間が workers 個以上あれば全コアが別々の区間を生成する。
+    モデルはワーカー毎に読むので、メモリはおよそ workers 倍になる。
+    """
+
+    def __init__(self, workers: int, threads: Optional[int] = None):
+        self.workers = max(1, int(workers))
+        threads = threads or max(1, (os.cpu_count() or 1) // self.workers)
+        self._ex = ProcessPoolExecutor(self.workers, mp_context=get_context("spawn"),
+                                       initializer=_init_worker, initargs=(threads,))
+
+    def warmup(self):
+        """全ワーカーを起動してモデルを読み込ませる"""
+        for f in [self._ex.submit(_worker_ready) for _ in range(self.workers)]:
+            f.result()
+
+    def run_jobs(self, jobs: List[Job]) -> List[List[Tuple[int, np.ndarray]]]:
+        return list(self._ex.map(_worker_generate, jobs))
+
+    def max_batch(self, n_segments: int) -> int:
+        """全ワーカーに行き渡るよう、1 Job の件数を区間数 / workers に抑える"""
+        return max(1, int(math.ceil(n_segments / self.workers)))
+
+    def shutdown(self):
+        self._ex.shutdown(wait=False, cancel_futures=True)
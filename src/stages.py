@@ -0,0 +1,52 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+# 段毎に覚えておく件数（frames / audio は配列なので少なめ）。
+# last は直前の実行の入力（出力先を除く）だけを覚え、「何も変えずにもう一度」を見分ける
+DEFAULT_CAPACITY = {"frames": 2, "captions": 32, "segments": 32, "audio": 4, "mux": 8, "last": 1}
+
+def stage_key(*parts: Any) -> str:
+    """段の入力からキーを作る。上流の段のキーを parts に含めれば、上流が変わったときだけ変わる"""
+    raw = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+
+class StageMemo:
+    """
+    パイプライン（frames → captions → prompt → audio → mux）の段毎の結果をプロセス内で覚える LRU。
+    prompt は文字列を選ぶだけなので覚えない。区間モード（BGMER_SEGMENTS）では captions の代わりに segments。
+    各段は自分の入力だけから作ったキーを持つので、入力が変わった段とその下流だけが再実行される
+    （例: BGM gain だけ変えたら mux だけ）。
+    """
+
+    def __init__(self, capacity: Optional[Dict[str, int]] = None):
+        self.capacity = dict(DEFAULT_CAPACITY, **(capacity or {}))
+        self._data: Dict[str, "OrderedDict[str, Any]"] = {s: OrderedDict() for s in self.capacity}
+        self._lock = threading.Lock()
+        self.hits = {s: 0 for s in self.capacity}
+        self.misses = {s: 0 for s in self.capacity}
+
+    def get(self, stage: str, key: str) -> Optional[Any]:
+        with self._lock:
+            d = self._data[stage]
+            if key in d:
+                d.move_to_end(key)
+                self.hits[stage] += 1
+                return d[key]
+            self.misses[stage] += 1
+            return None
+
+    def put(self, stage: str, key: str, value: Any):
+        with self._lock:
+            d = self._data[stage]
+            d[key] = value
+            d.move_to_end(key)
+            while len(d) > max(0, self.capacity[stage]):
+                d.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {s: {"size": len(self._data[s]), "hits": self.hits[s], "misses": self.misses[s]}
+                    for s in self.capacity}
@@ -0,0 +1,180 @@
+import math
+import time
+from typing import List
+
+import torch
+import torch.nn.functional as F
+
+# shape を固定するための丸め単位。キャッシュ長・テキスト長がこの倍数に揃うので、
+# compile 済みのグラフを長さの違うリクエスト間で使い回せる
+CACHE_BUCKET = 256
+TEXT_BUCKET = 32
+
+def _round_up(n: int, m: int) -> int:
+    return int(math.ceil(n / m) * m)
+
+class StaticCacheDecoder:
+    """
+    MusicGen デコーダを静的 KV キャッシュで 1 トークンずつ回すサンプリングループ。
+    HF の generate と同じ delay pattern・CFG・temperature・top-k を再現する（テキスト条件のみ。
+    音声プロンプト付きの窓は呼び出し側が従来の generate に回す）。
+
+    HF の MusicGen はキャッシュを毎ステップ伸ばすので shape が変わり続け、torch.compile が効かない。
+    ここではキャッシュを max_new_tokens から決めた長さで確保し、マスクで未来側を隠すので
+    1 ステップの shape が固定になり、compile=True なら 1 ステップ分をまとめてコンパイルできる。
+    """
+
+    def __init__(self, model, compile: bool = False):
+        self.model = model
+        self.dec = model.decoder.model.decoder           # MusicgenDecoder
+        self.lm_heads = model.decoder.lm_heads
+        self.K = model.decoder.num_codebooks
+        attn = self.dec.layers[0].self_attn
+        self.H, self.hd, self.scaling = attn.num_heads, attn.head_dim, attn.scaling
+        self.compiled = bool(compile)
+        self._step = self._step_impl
+        if self.compiled:
+            mode = "reduce-overhead" if torch.cuda.is_available() else "default"
+            self._step = torch.compile(self._step_impl, dynamic=False, mode=mode)
+        self.step_times: List[float] = []
+
+    # ---- 1 ステップ（ここだけが compile 対象）----
+    def _step_impl(self, tok: torch.Tensor, pos: torch.Tensor, self_k: List[torch.Tensor],
+                   self_v: List[torch.Tensor], cross_k: List[torch.Tensor], cross_v: List[torch.Tensor],
+                   cross_mask: torch.Tensor) -> torch.Tensor:
+        """tok: (N, K) の 1 列分。戻りは (N, K, vocab) の logits"""
+        n = tok.shape[0]
+        h = sum(self.dec.embed_tokens[k](tok[:, k]) for k in range(self.K))
+        h = (h + self.dec.embed_positions.weights.index_select(0, pos)).unsqueeze(1)   # (N, 1, D)
+        L = self_k[0].shape[2]
+        min_val = torch.finfo(h.dtype).min
+        self_mask = torch.where(torch.arange(L, device=h.device) <= pos, 0.0, min_val).to(h.dtype)
+        self_mask = self_mask.view(1, 1, 1, L)
+
+        for i, layer in enumerate(self.dec.layers):
+            res = h
+            x = layer.self_attn_layer_norm(h)
+            a = layer.self_attn
+            q = a.q_proj(x).view(n, 1, self.H, self.hd).transpose(1, 2)
+            kv_dtype = self_k[i].dtype
+            self_k[i].index_copy_(2, pos, a.k_proj(x).view(n, 1, self.H, self.hd).transpose(1, 2).to(kv_dtype))
+            self_v[i].index_copy_(2, pos, a.v_proj(x).view(n, 1, self.H, self.hd).transpose(1, 2).to(kv_dtype))
+            o = F.scaled_dot_product_attention(q, self_k[i], self_v[i], attn_mask=self_mask, scale=self.scaling)
+            h = res + a.out_proj(o.transpose(1, 2).reshape(n, 1, -1))
+
+            res = h
+            x = layer.encoder_attn_layer_norm(h)
+            c = layer.encoder_attn
+            q = c.q_proj(x).view(n, 1, self.H, self.hd).transpose(1, 2)
+            o = F.scaled_dot_product_attention(q, cross_k[i], cross_v[i], attn_mask=cross_mask, scale=self.scaling)
+            h = res + c.out_proj(o.transpose(1, 2).reshape(n, 1, -1))
+
+            res = h
+            x = layer.final_layer_norm(h)
+            h = res + layer.fc2(layer.activation_fn(layer.fc1(x)))
+
+        h = self.dec.layer_norm(h)
+        return torch.stack([head(h[:, 0]) for head in self.lm_heads], dim=1)
+
+    # ---- 準備 ----
+    def _encode_text(self, input_ids, attention_mask, cfg_on: bool, encoder_hidden_states=None):
+        """
+        HF と同じ条件付け（CFG 時は無条件側にゼロ入力を連結）。テキスト長は TEXT_BUCKET に揃える。
+        encoder_hidden_states（T5 の出力、CFG 連結前）が渡されればエンコーダは回さない。
+        """
+        m = self.model
+        enc = encoder_hidden_states
+        if enc is None:
+            enc = m.text_encoder(input_ids=input_ids, attention_mask=attention_mask).last_hidden_state
+        mask = attention_mask
+        if cfg_on:
+            enc = torch.cat([enc, torch.zeros_like(enc)], dim=0)
+            mask = torch.cat([mask, torch.zeros_like(mask)], dim=0)
+        if m.text_encoder.config.hidden_size != m.decoder.config.hidden_size \
+                and m.decoder.config.cross_attention_hidden_size is None:
+            enc = m.enc_to_dec_proj(enc)
+        enc = enc * mask[..., None].to(enc.dtype)
+        S = _round_up(enc.shape[1], TEXT_BUCKET)
+        enc = F.pad(enc, (0, 0, 0, S - enc.shape[1]))
+        mask = F.pad(mask, (0, S - mask.shape[1]))
+        # 全部隠れる行（無条件側）は HF と同じく finfo.min で一様な注意になる
+        add_mask = (1.0 - mask[:, None, None, :].to(enc.dtype)) * torch.finfo(enc.dtype).min
+        return enc, add_mask
+
+    def _cross_kv(self, enc):
+        n, S, _ = enc.shape
+        ks, vs = [], []
+        for layer in self.dec.layers:
+            c = layer.encoder_attn
+            ks.append(c.k_proj(enc).view(n, S, self.H, self.hd).transpose(1, 2).contiguous())
+            vs.append(c.v_proj(enc).view(n, S, self.H, self.hd).transpose(1, 2).contiguous())
+        return ks, vs
+
+    # ---- サンプリングループ ----
+    @torch.no_grad()
+    def generate_ids(self, input_ids, attention_mask, max_new_tokens: int, guidance_scale: float,
+                     temperature: float, top_k: int, do_sample: bool = True, streamer=None,
+                     encoder_hidden_states=None) -> torch.Tensor:
+        """
+        delay pattern 適用済みのトークン列 (B*K, 1 + max_new_tokens) を返す（HF generate の中間結果と同じ形）。
+        """
+        gc = self.model.generation_config
+        start = int(gc.decoder_start_token_id)
+        device = input_ids.device
+        B, K = input_ids.shape[0], self.K
+        cfg_on = guidance_scale is not None and guidance_scale > 1
+        max_len = 1 + int(max_new_tokens)
+
+        bos = torch.full((B * K, 1), start, dtype=torch.long, device=device)
+        ids, delay = self.model.decoder.build_delay_pattern_mask(bos, pad_token_id=start, max_length=max_len)
+        out = torch.full((B * K, max_len), start, dtype=torch.long, device=device)
+        out[:, :1] = ids[:, :1]
+
+        enc, cross_mask = self._encode_text(input_ids, attention_mask, cfg_on, encoder_hidden_states)
+        cross_k, cross_v = self._cross_kv(enc)
+        N = enc.shape[0]
+        L = _round_up(max_len, CACHE_BUCKET)
+        if self.dec.embed_positions.weights.shape[0] < L:
+            self.dec.embed_positions.make_weights(L, self.dec.embed_positions.embedding_dim)
+        # bf16 autocast 下ならキャッシュも bf16 で持つ（メモリ半分）
+        dtype = torch.get_autocast_dtype(device.type) if torch.is_autocast_enabled(device.type) else enc.dtype
+        self_k = [torch.zeros((N, self.H, L, self.hd), dtype=dtype, device=device) for _ in self.dec.layers]
+        self_v = [torch.zeros_like(t) for t in self_k]
+
+        self.step_times = []
+        for col in range(max_len - 1):
+            t0 = time.perf_counter()
+            tok = out[:, col].view(B, K)
+            if cfg_on:
+                tok = torch.cat([tok, tok], dim=0)
+            pos = torch.tensor([col], device=device)
+            logits = self._step(tok, pos, self_k, self_v, cross_k, cross_v, cross_mask)
+            scores = logits.reshape(N * K, -1).float()
+            if cfg_on:
+                cond, uncond = scores.split(B * K, dim=0)
+                scores = uncond + (cond - uncond) * guidance_scale
+            if do_sample:
+                if temperature != 1.0:
+                    scores = scores / temperature
+                if top_k and top_k > 0:
+                    kth = torch.topk(scores, min(int(top_k), scores.shape[-1]))[0][..., -1, None]
+                    scores = scores.masked_fill(scores < kth, -float("inf"))
+                nxt = torch.multinomial(F.softmax(scores, dim=-1), num_samples=1).squeeze(1)
+            else:
+                nxt = scores.argmax(dim=-1)
+            if streamer is not None:
+                if col == 0:
+                    streamer.put(ids[:, :1].cpu())  # HF と同じく最初に BOS 列
+                streamer.put(nxt.cpu())
+            forced = delay[:, col + 1]
+            out[:, col + 1] = torch.where(forced == -1, nxt, forced)
+            self.step_times.append(time.perf_counter() - t0)
+        if streamer is not None:
+            streamer.end()
+        return out
+
+    def to_audio_codes(self, out: torch.Tensor, batch: int) -> torch.Tensor:
+        """generate_ids の結果から EnCodec に渡すコード (1, B, K, T) を取り出す（HF と同じ後処理）"""
+        pad = int(self.model.generation_config.pad_token_id)
+        codes = out[out != pad].reshape(batch, self.K, -1)
+        return codes[None, ...]
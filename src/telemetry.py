@@ -0,0 +1,278 @@
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from src.registry import process_rss
+
+# 1 で span の終了毎に JSON 1 行を stderr へ
+LOG_JSON = os.getenv("BGMER_LOG_JSON", "0") != "0"
+# 処理時間のヒストグラムの境界（秒）
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+_SAMPLE_SEC = 0.02
+
+_RUN: "contextvars.ContextVar[Optional[str]]" = contextvars.ContextVar("bgmer_run", default=None)
+_SPAN: "contextvars.ContextVar[Optional[str]]" = contextvars.ContextVar("bgmer_span", default=None)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+class Span:
+    """1 区間の計測。set() で終了前に属性（枚数・トークン数など）を足せる"""
+
+    def __init__(self, name: str, attrs: dict):
+        self.name = name
+        self.attrs = dict(attrs)
+        self.id = uuid.uuid4().hex[:8]
+        self.run = _RUN.get()
+        self.parent = _SPAN.get()
+        self.start = time.time()
+        self.duration = 0.0
+        self.peak_rss = process_rss()
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def to_dict(self) -> dict:
+        return {"event": "span", "name": self.name, "run": self.run, "span": self.id, "parent": self.parent,
+                "start": self.start, "duration_ms": self.duration * 1000, "thread": threading.current_thread().name,
+                "peak_rss_bytes": self.peak_rss, **self.attrs}
+
+class Telemetry:
+    """
+    パイプラインの段毎の span（時間・デバイス・ピーク RSS）を集める。
+    終わった span は 処理時間のヒストグラム（段毎）に入り、LOG_JSON なら JSON 1 行で出す。
+    prometheus() でテキスト形式のメトリクスにする。実行（run）の ID は contextvars で span に付く。
+    """
+
+    def __init__(self, log_json: bool = LOG_JSON, stream=None, keep: int = 256):
+        self.log_json = log_json
+        self.stream = stream
+        self._lock = threading.Lock()
+        self._hist: Dict[str, List[float]] = {}          # 段 → [各境界以下の件数..., 合計秒, 件数]
+        self._peak: Dict[str, float] = {}                # 段 → 観測した最大のピーク RSS
+        self._gauges: Dict[str, Dict[Labels, float]] = {}
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._help: Dict[str, str] = {}
+        self._open: Dict[str, Span] = {}
+        self._sampler: Optional[threading.Thread] = None
+        self._profiling = 0
+        self.recent: "deque[dict]" = deque(maxlen=keep)
+
+    # ---- span ----
+    @contextmanager
+    def span(self, name: str, **attrs) -> Iterator[Span]:
+        """with の間を 1 区間として測る。開いている間は RSS を _SAMPLE_SEC 毎に見てピークを残す"""
+        s = Span(name, attrs)
+        prev = _SPAN.get()
+        _SPAN.set(s.id)
+        with self._lock:
+            self._open[s.id] = s
+        self._ensure_sampler()
+        rf = self._record_function(name)
+        t0 = time.perf_counter()
+        try:
+            yield s
+        except BaseException as e:
+            s.set(error=type(e).__name__)
+            raise
+        finally:
+            s.duration = time.perf_counter() - t0
+            if rf is not None:
+                rf.__exit__(None, None, None)
+            _SPAN.set(prev)
+            with self._lock:
+                self._open.pop(s.id, None)
+            s.peak_rss = max(s.peak_rss, process_rss())
+            self._finish(s)
+
+    def record(self, name: str, seconds: float, **attrs):
+        """よそで測り終えた区間（MusicGen の生成など）を span として足す"""
+        s = Span(name, attrs)
+        s.start -= seconds
+        s.duration = seconds
+        self._finish(s)
+
+    def _finish(self, s: Span):
+        if s.attrs.get("device") == "cuda":
+            import torch
+            s.set(cuda_peak_bytes=int(torch.cuda.max_memory_allocated()))  # プロセス開始からの最大
+        with self._lock:
+            h = self._hist.setdefault(s.name, [0.0] * (len(BUCKETS) + 2))
+            for i, b in enumerate(BUCKETS):
+                if s.duration <= b:
+                    h[i] += 1
+            h[-2] += s.duration
+            h[-1] += 1
+            self._peak[s.name] = max(self._peak.get(s.name, 0.0), float(s.peak_rss))
+        rec = s.to_dict()
+        self.recent.append(rec)
+        if self.log_json:
+            print(json.dumps(rec, ensure_ascii=False, default=str), file=self.stream or sys.stderr, flush=True)
+
+    def _ensure_sampler(self):
+        if self._sampler is not None:
+            return
+        with self._lock:
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._sample, name="telemetry-rss", daemon=True)
+                self._sampler.start()
+
+    def _sample(self):
+        while True:
+            time.sleep(_SAMPLE_SEC)
+            with self._lock:
+                spans = list(self._open.values())
+            if spans:
+                rss = process_rss()
+                for s in spans:
+                    s.peak_rss = max(s.peak_rss, rss)
+
+    # ---- 実行単位 ----
+    def bind(self, gen, run_id: Optional[str] = None):
+        """
+        ジェネレータの各ステップを同じ Context で回し、中の span に run_id を付ける
+        （Gradio は next() 毎に別スレッド・別 Context で呼ぶことがあるので、ContextVar をその都度戻す）。
+        """
+        ctx = contextvars.copy_context()
+        ctx.run(_RUN.set, run_id or uuid.uuid4().hex[:12])
+        ctx.run(_SPAN.set, None)
+        try:
+            while True:
+                try:
+                    item = ctx.run(next, gen)
+                except StopIteration as e:
+                    return e.value
+                yield item
+        finally:
+            ctx.run(gen.close)
+
+    @staticmethod
+    def run_id() -> Optional[str]:
+        return _RUN.get()
+
+    @staticmethod
+    def wrap(fn: Callable) -> Callable:
+        """別スレッド（ThreadPoolExecutor など）で動かす関数に、今の run / 親 span を引き継がせる"""
+        ctx = contextvars.copy_context()
+        return lambda *a, **kw: ctx.copy().run(fn, *a, **kw)
+
+    # ---- torch.profiler ----
+    @contextmanager
+    def profile(self, path: str):
+        """with の間を torch.profiler で記録し、Chrome trace（chrome://tracing / Perfetto）を path に書く"""
+        import torch
+        from torch.profiler import ProfilerActivity
+        activities = [ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(ProfilerActivity.CUDA)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._lock:
+            self._profiling += 1
+        try:
+            with torch.profiler.profile(activities=activities, record_shapes=False) as prof:
+                yield prof
+        finally:
+            with self._lock:
+                self._profiling -= 1
+        prof.export_chrome_trace(path)
+        print(f"[telemetry] profiler trace -> {path}", flush=True)
+
+    def _record_function(self, name: str):
+        """プロファイル中だけ span をトレースにも区間として出す"""
+        if not self._profiling:
+            return None
+        import torch
+        rf = torch.profiler.record_function(name)
+        rf.__enter__()
+        return rf
+
+    # ---- メトリクス ----
+    def describe(self, name: str, help_text: str):
+        self._help[name] = help_text
+
+    def set_gauge(self, name: str, value: float, **labels):
+        with self._lock:
+            self._gauges.setdefault(name, {})[_labels(labels)] = float(value)
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        with self._lock:
+            d = self._counters.setdefault(name, {})
+            key = _labels(labels)
+            d[key] = d.get(key, 0.0) + float(value)
+
+    def prometheus(self) -> str:
+        """Prometheus のテキスト形式（段毎の処理時間のヒストグラム・ピーク RSS と、set_gauge / inc した値）"""
+        lines: List[str] = []
+        with self._lock:
+            hist = {k: list(v) for k, v in self._hist.items()}
+            peak = dict(self._peak)
+            all_gauges = {k: dict(v) for k, v in self._gauges.items()}
+            counters = {k: dict(v) for k, v in self._counters.items()}
+        all_gauges["bgmer_process_rss_bytes"] = {(): float(process_rss())}
+
+        lines += ["# HELP bgmer_stage_seconds Wall time of pipeline stages",
+                  "# TYPE bgmer_stage_seconds histogram"]
+        for stage in sorted(hist):
+            h = hist[stage]
+            for i, b in enumerate(BUCKETS):
+                lines.append(f'bgmer_stage_seconds_bucket{{stage="{stage}",le="{b:g}"}} {h[i]:g}')
+            lines.append(f'bgmer_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {h[-1]:g}')
+            lines.append(f'bgmer_stage_seconds_sum{{stage="{stage}"}} {h[-2]:.6f}')
+            lines.append(f'bgmer_stage_seconds_count{{stage="{stage}"}} {h[-1]:g}')
+        lines += ["# HELP bgmer_stage_peak_rss_bytes Largest process RSS seen while a stage was running",
+                  "# TYPE bgmer_stage_peak_rss_bytes gauge"]
+        lines += [f'bgmer_stage_peak_rss_bytes{{stage="{s}"}} {v:.0f}' for s, v in sorted(peak.items())]
+        for kind, metrics in (("gauge", all_gauges), ("counter", counters)):
+            for name in sorted(metrics):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, v in sorted(metrics[name].items()):
+                    lines.append(f"{name}{_format_labels(labels)} {v:g}")
+        return "\n".join(lines) + "\n"
+
+def _labels(labels: dict) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+def serve_metrics(port: int, render: Callable[[], str], host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """GET /metrics だけを返す小さな HTTP サーバを別スレッドで立てる（UI 起動時用）"""
+
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), _Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+TELEMETRY = Telemetry()
+TELEMETRY.describe("bgmer_decode_tokens_total", "MusicGen decode steps (tokens per codebook), summed over batch rows")
+TELEMETRY.describe("bgmer_decode_tokens_per_second", "Decode steps per second of the last generation")
+TELEMETRY.describe("bgmer_queue_depth", "Requests waiting in the Gradio queue / batch scheduler / job queue")
+TELEMETRY.describe("bgmer_queue_active", "Requests currently being processed")
+TELEMETRY.describe("bgmer_runs_total", "Pipeline runs by outcome")
+TELEMETRY.describe("bgmer_process_rss_bytes", "Resident memory of this process")
+span = TELEMETRY.span
@@ -1,12 +1,24 @@
 import os
-import shutil
+import queue
 import subprocess
+import threading
+import time
 import numpy as np
 import torch
 import wave
-from typing import Optional, Tuple
-from dataclasses import dataclass
+from collections import OrderedDict
+from contextlib import nullcontext
+from typing import Dict, Iterator, List, Optional, Tuple
+from dataclasses import dataclass, replace
 from transformers import AutoProcessor, MusicgenForConditionalGeneration
+from transformers.generation.streamers import BaseStreamer
+from transformers.modeling_outputs import BaseModelOutput
+from src.audio_fit import fit_audio, peak
+from src.media import MediaInfo, ffmpeg_exe, probe
+from src.precision import apply_cpu_precision, cpu_precision
+from src.registry import FROM_PRETRAINED_LOCK, SAMPLING_LOCK
+from src.static_decode import StaticCacheDecoder
+from src.telemetry import TELEMETRY, span
 
 SAMPLE_RATE = 32000
 
@@ -18,15 +30,16 @@ class GenerateConfig:
     top_k: int = 250
     seed: Optional[int] = 42
     tokens_per_sec: int = 50
-
-try:
-    import imageio_ffmpeg
-    IIO_FFMPEG = imageio_ffmpeg.get_ffmpeg_exe()
-except Exception:
-    IIO_FFMPEG = None
+    # 長尺モード：window_tokens を超える長さは、直前の音の末尾 context_seconds を条件に
+    # 重なりありで続きを生成し crossfade_seconds でつなぐ（メモリは窓サイズで頭打ち）
+    long_form: bool = True
+    window_tokens: int = 1500
+    context_seconds: float = 10.0
+    crossfade_seconds: float = 1.0
 
 class MusicGenerator:
-    def __init__(self, model_id: str = os.getenv("MODEL_ID", "facebook/musicgen-small")):
+    def __init__(self, model_id: str = os.getenv("MODEL_ID", "facebook/musicgen-small"),
+                 precision: Optional[str] = None, decode: Optional[str] = None):
         if os.getenv("USE_CPU") == "1":
             self.device, self.dtype = "cpu", torch.float32
         elif torch.cuda.is_available():
@@ -38,47 +51,405 @@ class MusicGenerator:
         print(f"[MusicGen] device={self.device}, dtype={self.dtype}")
 
         self.processor = AutoProcessor.from_pretrained(model_id)
-        self.model = MusicgenForConditionalGeneration.from_pretrained(
-            model_id, torch_dtype=self.dtype, low_cpu_mem_usage=True
-        ).to(self.device)
+        with FROM_PRETRAINED_LOCK:
+            model = MusicgenForConditionalGeneration.from_pretrained(
+                model_id, torch_dtype=self.dtype, low_cpu_mem_usage=True
+            )
+        self.model = model.to(self.device)
+        self.model.eval()
+        # CPU では CPU_PRECISION に応じて T5 エンコーダとデコーダだけ bf16 / int8 にする（EnCodec は fp32）
+        self.precision = apply_cpu_precision(self.model, ("text_encoder", "decoder"),
+                                             cpu_precision(precision), self.device)
+        if self.precision != "fp32":
+            print(f"[MusicGen] cpu precision={self.precision}")
+        self._audio_channels = int(getattr(self.model.config.audio_encoder, "audio_channels", 1))
+        self.last_stats = {}
+
+        # 生成ループ：eager = HF の generate / static = 静的 KV キャッシュ / compile = static を torch.compile
+        self.decode = (decode or os.getenv("MUSICGEN_DECODE", "eager")).strip().lower()
+        self._fast = None
+        if self.decode in ("static", "compile"):
+            self._fast = StaticCacheDecoder(self.model, compile=self.decode == "compile")
+            print(f"[MusicGen] decode={self.decode}")
+
+        # プロンプト → (input_ids, attention_mask, T5 出力) の LRU。同じプロンプトで seed / temperature を
+        # 変えて振り直すときは tokenize と T5 を飛ばしてデコードから始められる
+        self.text_cache_size = max(0, int(os.getenv("MUSICGEN_TEXT_CACHE", "64")))
+        self._text_cache: "OrderedDict[str, Tuple[torch.Tensor, torch.Tensor, torch.Tensor]]" = OrderedDict()
+        self._text_lock = threading.Lock()
+        self.text_cache_hits = 0
+        self.text_cache_misses = 0
 
     def _seconds_to_tokens(self, seconds: int, tokens_per_sec: int) -> int:
         return max(1, int(seconds * tokens_per_sec))  # ← 固定50を廃止
 
-    def generate(self, prompt: str, cfg: Optional[GenerateConfig] = None) -> Tuple[int, np.ndarray]:
-        if cfg is None:
-            cfg = GenerateConfig()
-        if cfg.seed is not None:
-            torch.manual_seed(int(cfg.seed)); np.random.seed(int(cfg.seed))
-        inputs = self.processor(text=[prompt], padding=True, return_tensors="pt").to(self.device)
+    def _frame_rate(self) -> int:
+        return int(getattr(self.model.config.audio_encoder, "frame_rate", 50))
+
+    def _max_new_tokens(self, cfg: GenerateConfig) -> int:
+        """1 窓で生成するトークン数。長尺モードで窓に収まらない場合は -1"""
         computed = self._seconds_to_tokens(cfg.seconds, cfg.tokens_per_sec)
-        max_new_tokens = max(64, min(2048, computed))
+        if cfg.long_form and computed > max(64, int(cfg.window_tokens)):
+            return -1
+        return max(64, min(2048, computed))
+
+    # ---- テキスト条件のキャッシュ ----
+    def _encode_prompt(self, prompt: str) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        with self._text_lock:
+            hit = self._text_cache.get(prompt)
+            if hit is not None:
+                self._text_cache.move_to_end(prompt)
+                self.text_cache_hits += 1
+                return hit
+            self.text_cache_misses += 1
+        with span("text_encode", device=self.device), torch.no_grad():
+            tok = self.processor(text=[prompt], padding=True, return_tensors="pt").to(self.device)
+            hidden = self.model.text_encoder(input_ids=tok["input_ids"],
+                                             attention_mask=tok["attention_mask"]).last_hidden_state
+        entry = (tok["input_ids"], tok["attention_mask"], hidden)
+        if self.text_cache_size > 0:
+            with self._text_lock:
+                self._text_cache[prompt] = entry
+                while len(self._text_cache) > self.text_cache_size:
+                    self._text_cache.popitem(last=False)
+        return entry
+
+    def _text_inputs(self, prompts: List[str]) -> Dict[str, torch.Tensor]:
+        """
+        processor(text=prompts, padding=True) と同じ input_ids / attention_mask に、
+        T5 の出力 encoder_hidden_states（CFG の無条件側はゼロなので連結は使う側で行う）を添えて返す。
+        T5 はパディングをマスクするので、プロンプト毎にエンコードして右詰めで揃えても結果は同じ。
+        """
+        entries = [self._encode_prompt(p) for p in prompts]
+        if len(entries) == 1:
+            ids, mask, hidden = entries[0]
+            return {"input_ids": ids, "attention_mask": mask, "encoder_hidden_states": hidden}
+        S = max(e[0].shape[1] for e in entries)
+        pad_id = self.processor.tokenizer.pad_token_id or 0
+        pad = lambda t, v: torch.nn.functional.pad(t, (0, S - t.shape[1]), value=v)
+        return {
+            "input_ids": torch.cat([pad(e[0], pad_id) for e in entries]),
+            "attention_mask": torch.cat([pad(e[1], 0) for e in entries]),
+            "encoder_hidden_states": torch.cat(
+                [torch.nn.functional.pad(e[2], (0, 0, 0, S - e[2].shape[1])) for e in entries]),
+        }
+
+    def text_cache_stats(self) -> dict:
+        with self._text_lock:
+            return {"size": len(self._text_cache), "capacity": self.text_cache_size,
+                    "hits": self.text_cache_hits, "misses": self.text_cache_misses}
+
+    def _generate_kwargs(self, inputs, cfg: GenerateConfig) -> dict:
+        """_text_inputs の結果を HF generate 用に変換（CFG 時は無条件側のゼロを連結して encoder_outputs に）"""
+        kwargs = dict(inputs)
+        hidden = kwargs.pop("encoder_hidden_states", None)
+        if hidden is not None:
+            mask = kwargs["attention_mask"]
+            if cfg.guidance_scale is not None and cfg.guidance_scale > 1:
+                hidden = torch.cat([hidden, torch.zeros_like(hidden)], dim=0)
+                mask = torch.cat([mask, torch.zeros_like(mask)], dim=0)
+            kwargs["attention_mask"] = mask
+            kwargs["encoder_outputs"] = BaseModelOutput(last_hidden_state=hidden)
+        return kwargs
+
+    def _static_generate(self, inputs, cfg: GenerateConfig, max_new_tokens: int, streamer=None) -> torch.Tensor:
+        """静的 KV キャッシュ版の generate。戻りは model.generate と同じ (batch, channels, samples)"""
+        batch = inputs["input_ids"].shape[0]
+        amp = torch.autocast("cpu", dtype=torch.bfloat16) if self.precision == "bf16" else nullcontext()
         with torch.no_grad():
-            audio_values = self.model.generate(
-                **inputs,
-                do_sample=True,
-                guidance_scale=float(cfg.guidance_scale),
-                temperature=float(cfg.temperature),
-                top_k=int(cfg.top_k),
-                max_new_tokens=int(max_new_tokens),
-            )
-        audio = audio_values[0].detach().cpu().numpy()
+            with amp:
+                out = self._fast.generate_ids(
+                    inputs["input_ids"], inputs["attention_mask"], int(max_new_tokens),
+                    guidance_scale=float(cfg.guidance_scale), temperature=float(cfg.temperature),
+                    top_k=int(cfg.top_k), streamer=streamer,
+                    encoder_hidden_states=inputs.get("encoder_hidden_states"),
+                )
+            codes = self._fast.to_audio_codes(out, batch)
+            return self.model.audio_encoder.decode(codes, [None] * batch).audio_values
+
+    def _run_batch(self, inputs, cfg: GenerateConfig, max_new_tokens: int, streamer=None) -> np.ndarray:
+        """generate 1 回分。戻りは (batch, samples) のモノラル float32（未正規化）"""
+        audio_values = None
+        if self._fast is not None and "input_values" not in inputs:  # 音声プロンプト付きの窓は従来経路
+            try:
+                audio_values = self._static_generate(inputs, cfg, max_new_tokens, streamer=streamer)
+            except Exception as e:
+                if streamer is not None and self._fast.step_times:
+                    raise  # もうトークンを流し始めているのでやり直せない
+                print(f"[MusicGen] {self.decode} decode failed, falling back to eager: {e}", flush=True)
+                self._fast, self.decode = None, "eager"
+        if audio_values is None:
+            with torch.no_grad():
+                audio_values = self.model.generate(
+                    **self._generate_kwargs(inputs, cfg),
+                    do_sample=True,
+                    guidance_scale=float(cfg.guidance_scale),
+                    temperature=float(cfg.temperature),
+                    top_k=int(cfg.top_k),
+                    max_new_tokens=int(max_new_tokens),
+                    streamer=streamer,
+                )
+        audio = audio_values.detach().float().cpu().numpy()
+        if audio.ndim == 3:
+            audio = audio.mean(axis=1)
+        return audio.astype(np.float32, copy=False)
+
+    def _run(self, inputs, cfg: GenerateConfig, max_new_tokens: int, streamer=None) -> np.ndarray:
+        """1 窓分の generate。戻りはモノラル float32（未正規化）"""
+        return self._run_batch(inputs, cfg, max_new_tokens, streamer=streamer)[0]
+
+    def _decode_frames(self, tokens: torch.Tensor, start: int, end: int,
+                       prompt_codes: Optional[torch.Tensor] = None, left_context: int = 25) -> np.ndarray:
+        """
+        delay pattern 付きのトークン列（列 0 = BOS、codebook k のフレーム f は列 f+k+1）から
+        フレーム [start, end) だけを EnCodec でデコードする。境界を滑らかにするため
+        left_context フレーム手前からデコードして、その分は捨てる。
+        """
+        K = self.model.decoder.num_codebooks
+        s0 = max(0, start - left_context)
+        idx = torch.arange(s0, end)
+        codes = torch.stack([tokens[k, idx + k + 1] for k in range(K)])
+        if prompt_codes is not None and s0 < prompt_codes.shape[-1]:
+            # 音声プロンプト部分は delay mask で強制された値が streamer に来ないので、エンコード結果で上書き
+            n = min(end, prompt_codes.shape[-1]) - s0
+            codes[:, :n] = prompt_codes[:, s0:s0 + n]
+        with torch.no_grad():
+            audio = self.model.audio_encoder.decode(codes[None, None].to(self.device), [None]).audio_values
+        audio = audio[0].float().cpu().numpy()
         if audio.ndim == 2:
             audio = audio.mean(axis=0)
-        audio = audio / (np.max(np.abs(audio)) + 1e-8)
+        hop = SAMPLE_RATE // self._frame_rate()
+        return audio[(start - s0) * hop:(end - s0) * hop].astype(np.float32, copy=False)
+
+    def _stream_run(self, inputs, cfg: GenerateConfig, max_new_tokens: int,
+                    chunk_frames: int) -> Iterator[np.ndarray]:
+        """generate を別スレッドで回し、揃ったフレームを chunk_frames 毎に逐次デコードして yield"""
+        K = self.model.decoder.num_codebooks
+        prompt_codes = None
+        if "input_values" in inputs:
+            with torch.no_grad():
+                enc = self.model.audio_encoder.encode(inputs["input_values"], inputs.get("padding_mask"))
+            prompt_codes = enc.audio_codes[0, 0].cpu()
+
+        streamer = _TokenStreamer()
+        errors = []
+
+        def _work():
+            try:
+                self._run(inputs, cfg, max_new_tokens, streamer=streamer)
+            except BaseException as e:  # 例外は呼び出し側スレッドで再送出
+                errors.append(e)
+                streamer.end()
+
+        th = threading.Thread(target=_work, daemon=True)
+        th.start()
+        tokens = torch.empty((K, 0), dtype=torch.long)
+        done = 0
+        while True:
+            item = streamer.queue.get()
+            if item is None:
+                break
+            tokens = torch.cat([tokens, item.reshape(item.shape[0], -1)[:K]], dim=1)
+            ready = tokens.shape[1] - K  # フレーム f は列 f+K が来た時点で全 codebook が揃う
+            if ready - done >= chunk_frames:
+                yield self._decode_frames(tokens, done, ready, prompt_codes)
+                done = ready
+        th.join()
+        if errors:
+            raise errors[0]
+        ready = tokens.shape[1] - K
+        if ready > done:
+            yield self._decode_frames(tokens, done, ready, prompt_codes)
+
+    def _window_audio(self, inputs, cfg: GenerateConfig, max_new_tokens: int,
+                      chunk_frames: Optional[int]) -> Iterator[np.ndarray]:
+        if chunk_frames is None or self._audio_channels > 1:
+            # 非ストリーミング（ステレオモデルは codebook が交互に並ぶので一括デコード）
+            yield self._run(inputs, cfg, max_new_tokens)
+        else:
+            yield from self._stream_run(inputs, cfg, max_new_tokens, chunk_frames)
+
+    def _iter_audio(self, prompt: str, cfg: GenerateConfig,
+                    chunk_frames: Optional[int] = None) -> Iterator[np.ndarray]:
+        """
+        確定したサンプルを順に yield する（未正規化）。
+        window_tokens を超える長さは窓単位で続きを生成する。2 窓目以降は直前の末尾 context を
+        音声プロンプトとして渡し、出力に含まれる context の再デコード部分と既存の末尾を
+        クロスフェードしてから新しい部分を足す。クロスフェードで書き換わる末尾は次の窓まで保留する。
+        """
+        computed = self._seconds_to_tokens(cfg.seconds, cfg.tokens_per_sec)
+        text_inputs = self._text_inputs([prompt])
+        window = max(64, int(cfg.window_tokens))
+        max_new_tokens = self._max_new_tokens(cfg)
+        if max_new_tokens > 0:
+            yield from self._window_audio(text_inputs, cfg, max_new_tokens, chunk_frames)
+            return
+
+        fr = self._frame_rate()
+        hop = SAMPLE_RATE // fr                      # 1 トークン = hop サンプル
+        ctx_tokens = max(1, min(int(cfg.context_seconds * fr), window // 2))
+        step_tokens = window - ctx_tokens
+        total = int(computed) * hop
+        xfade = int(cfg.crossfade_seconds * SAMPLE_RATE)
+        out = np.zeros(total, dtype=np.float32)
+        pos = sent = 0
+
+        for inc in self._window_audio(text_inputs, cfg, window, chunk_frames):
+            n = min(len(inc), total - pos)
+            out[pos:pos + n] = inc[:n]
+            pos += n
+            if pos - xfade > sent:
+                yield out[sent:pos - xfade]
+                sent = pos - xfade
+
+        while pos < total:
+            ctx = out[max(0, pos - ctx_tokens * hop):pos]
+            ctx = ctx[len(ctx) % hop:]               # codec の hop 境界に揃える
+            head = len(ctx)
+            audio_prompt = np.stack([ctx] * self._audio_channels) if self._audio_channels > 1 else ctx
+            inputs = self.processor(
+                audio=audio_prompt, sampling_rate=SAMPLE_RATE, return_tensors="pt"
+            ).to(self.device)
+            inputs = {**inputs, **text_inputs}
+            remaining = -(-(total - pos) // hop)
+            head_buf = np.empty(head, dtype=np.float32)
+            got = added = 0
+            # +8: delay pattern の取りこぼし分
+            for inc in self._window_audio(inputs, cfg, min(step_tokens, remaining + 8), chunk_frames):
+                if got < head:
+                    take = min(len(inc), head - got)
+                    head_buf[got:got + take] = inc[:take]
+                    got += take
+                    inc = inc[take:]
+                    if got < head:
+                        continue
+                    # 同じ音楽の再デコードなので相関が高い → 等振幅（線形）クロスフェード
+                    x = min(xfade, head, pos - sent)
+                    if x > 0:
+                        ramp = np.linspace(0.0, 1.0, x, dtype=np.float32)
+                        out[pos - x:pos] += ramp * (head_buf[head - x:] - out[pos - x:pos])
+                n = min(len(inc), total - pos)
+                out[pos:pos + n] = inc[:n]
+                pos += n
+                added += n
+                if pos - xfade > sent:
+                    yield out[sent:pos - xfade]
+                    sent = pos - xfade
+            if added == 0:
+                break
+        if pos > sent:
+            yield out[sent:pos]
+
+    def _seed(self, cfg: GenerateConfig):
+        """グローバル乱数に seed を入れる。生成し終わるまで SAMPLING_LOCK を持った中で呼ぶこと"""
+        if cfg.seed is not None:
+            torch.manual_seed(int(cfg.seed)); np.random.seed(int(cfg.seed))
+
+    def _record_stats(self, mode: str, audio_sec: float, wall: float, **extra):
+        # RTF = 処理時間 / 生成した音の長さ（1 未満ならリアルタイムより速い）
+        self.last_stats = {"mode": mode, "audio_seconds": audio_sec, "wall_seconds": wall,
+                           "rtf": wall / max(audio_sec, 1e-6), **extra}
+        print(f"[MusicGen] {mode}: {audio_sec:.1f}s audio in {wall:.1f}s (RTF {self.last_stats['rtf']:.2f})")
+        # デコードのステップ数（= 各コードブックのトークン数）。バッチなら全行の合計
+        tokens = int(round(audio_sec * self._frame_rate()))
+        TELEMETRY.record("decode", wall, mode=mode, device=self.device, audio_seconds=audio_sec, tokens=tokens,
+                         tokens_per_sec=tokens / max(wall, 1e-6), **extra)
+        TELEMETRY.inc("bgmer_decode_tokens_total", tokens, mode=mode)
+        TELEMETRY.set_gauge("bgmer_decode_tokens_per_second", tokens / max(wall, 1e-6), mode=mode)
+
+    def generate(self, prompt: str, cfg: Optional[GenerateConfig] = None) -> Tuple[int, np.ndarray]:
+        if cfg is None:
+            cfg = GenerateConfig()
+        with SAMPLING_LOCK:
+            self._seed(cfg)
+            t0 = time.perf_counter()
+            chunks = list(self._iter_audio(prompt, cfg))
+        audio = chunks[0] if len(chunks) == 1 else np.concatenate(chunks)
+        audio /= (peak(audio) + 1e-8)
+        self._record_stats("generate", len(audio) / SAMPLE_RATE, time.perf_counter() - t0)
         return SAMPLE_RATE, audio
 
+    def generate_batch(self, prompts: List[str], cfg: Optional[GenerateConfig] = None) -> List[Tuple[int, np.ndarray]]:
+        """
+        同じ設定の複数プロンプトを 1 回の generate でまとめてデコードする（padding + attention mask）。
+        seed はバッチ全体で cfg.seed を 1 回だけ使う。長尺（複数窓）になる設定は 1 件ずつ処理。
+        """
+        if cfg is None:
+            cfg = GenerateConfig()
+        max_new_tokens = self._max_new_tokens(cfg)
+        if len(prompts) <= 1 or max_new_tokens < 0:
+            return [self.generate(p, cfg) for p in prompts]
+        with SAMPLING_LOCK:
+            self._seed(cfg)
+            t0 = time.perf_counter()
+            inputs = self._text_inputs(list(prompts))
+            audio = self._run_batch(inputs, cfg, max_new_tokens)
+        audio /= (peak(audio, axis=1)[:, None] + 1e-8)
+        self._record_stats("batch", audio.shape[0] * audio.shape[1] / SAMPLE_RATE, time.perf_counter() - t0,
+                           batch_size=len(prompts))
+        return [(SAMPLE_RATE, a) for a in audio]
+
+    def generate_candidates(self, prompt: str, cfg: Optional[GenerateConfig] = None,
+                            n: int = 4) -> List[Tuple[int, np.ndarray]]:
+        """
+        1 つのプロンプトから n 通りを 1 回の generate でまとめてデコードする。T5 のエンコードは 1 回で、
+        その結果を n 行に複製する（サンプリングは行毎に独立なので、同じ seed でも行毎に別の曲になる）。
+        長尺（複数窓）になる設定は seed をずらして 1 件ずつ（テキストはキャッシュから）。
+        """
+        if cfg is None:
+            cfg = GenerateConfig()
+        n = max(1, int(n))
+        max_new_tokens = self._max_new_tokens(cfg)
+        if n == 1 or max_new_tokens < 0:
+            return [self.generate(prompt, cfg if cfg.seed is None else replace(cfg, seed=cfg.seed + i))
+                    for i in range(n)]
+        with SAMPLING_LOCK:
+            self._seed(cfg)
+            t0 = time.perf_counter()
+            inputs = {k: v.repeat(n, *([1] * (v.dim() - 1))) for k, v in self._text_inputs([prompt]).items()}
+            audio = self._run_batch(inputs, cfg, max_new_tokens)
+        audio /= (peak(audio, axis=1)[:, None] + 1e-8)
+        self._record_stats("candidates", audio.shape[0] * audio.shape[1] / SAMPLE_RATE, time.perf_counter() - t0,
+                           batch_size=n)
+        return [(SAMPLE_RATE, a) for a in audio]
+
+    def generate_stream(self, prompt: str, cfg: Optional[GenerateConfig] = None,
+                        chunk_seconds: float = 1.0) -> Iterator[Tuple[int, np.ndarray]]:
+        """
+        トークン生成と並行して、揃ったフレームを EnCodec で逐次デコードし (sr, chunk) を yield する。
+        全体のピークが分からないので正規化はせず [-1,1] にクリップするだけ（全体は呼び出し側で結合）。
+        """
+        if cfg is None:
+            cfg = GenerateConfig()
+        chunk_frames = max(1, int(chunk_seconds * self._frame_rate()))
+        with SAMPLING_LOCK:  # 最後のチャンクまで（途中でやめたら close で外れる）
+            self._seed(cfg)
+            t0 = time.perf_counter()
+            first = None
+            total = 0
+            for chunk in self._iter_audio(prompt, cfg, chunk_frames=chunk_frames):
+                if first is None:
+                    first = time.perf_counter() - t0
+                total += len(chunk)
+                yield SAMPLE_RATE, np.clip(chunk, -1.0, 1.0)
+        self._record_stats("stream", total / SAMPLE_RATE, time.perf_counter() - t0,
+                           time_to_first_audio=first)
+
+class _TokenStreamer(BaseStreamer):
+    """MusicGen.generate の streamer。各ステップのトークン（bsz*K 行）をキューへ流す"""
+
+    def __init__(self):
+        self.queue: "queue.Queue[Optional[torch.Tensor]]" = queue.Queue()
+
+    def put(self, value):
+        self.queue.put(value)
+
+    def end(self):
+        self.queue.put(None)
+
 def fit_audio_exact_seconds(audio: np.ndarray, sr: int, target_seconds: float) -> np.ndarray:
-    target_len = int(round(target_seconds * sr))
-    if len(audio) < target_len:
-        reps = int(np.ceil(target_len / len(audio)))
-        audio = np.tile(audio, reps)
-    audio = audio[:target_len]
-    fade = int(0.03 * sr)
-    if fade > 0 and len(audio) > 2 * fade:
-        audio[:fade] *= np.linspace(0, 1, fade)
-        audio[-fade:] *= np.linspace(1, 0, fade)
-    return audio
+    """target_seconds ちょうどの float32 にする（短ければ拍に合わせたループで埋める。src/audio_fit.py）"""
+    return fit_audio(audio, sr, target_seconds)
 
 def save_wav(path: str, rate: int, audio: np.ndarray) -> str:
     os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
@@ -91,27 +462,12 @@ def save_wav(path: str, rate: int, audio: np.ndarray) -> str:
         wf.writeframes(pcm16.tobytes())
     return path
 
-def _has_audio_stream(video_path: str, ffbin: str) -> bool:
-    # ffprobeで音声ストリームの有無を確認
-    ffprobe = ffbin.replace("ffmpeg", "ffprobe")  # imageio-ffmpeg なら同じフォルダにある
-    if not shutil.which(ffprobe):
-        # ffprobe が無い場合は保守的に True 扱い（後段で失敗しないように）
-        return True
-    p = subprocess.run(
-        [ffprobe, "-v", "error", "-select_streams", "a",
-         "-show_entries", "stream=index", "-of", "csv=p=0", video_path],
-        capture_output=True, text=True
-    )
-    return bool(p.stdout.strip())
-
 def mux_mix_audio_to_video(video_path: str, wav_path: str, out_path: str,
-                           bgm_gain_db: float = -3.0) -> str:
-    ffbin = shutil.which("ffmpeg") or IIO_FFMPEG
-    if not ffbin:
-        raise RuntimeError("ffmpeg が見つかりません。")
+                           bgm_gain_db: float = -3.0, info: Optional[MediaInfo] = None) -> str:
+    ffbin = ffmpeg_exe()
     os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
 
-    if _has_audio_stream(video_path, ffbin):
+    if (info or probe(video_path)).has_audio:
         # ① 元音声あり → amix で合成
         fc = (
             f"[0:a:0]aformat=sample_fmts=fltp:sample_rates=48000:channel_layouts=stereo[a0];"
@@ -1,16 +1,47 @@
 import os
+import queue
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from dataclasses import dataclass
-from typing import List
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
+import numpy as np
 from PIL import Image
 from tqdm import tqdm
 from transformers import BlipForConditionalGeneration, BlipProcessor
 import imageio.v2 as imageio
 import torch
-import subprocess, tempfile, glob, os
+import subprocess
+from src.frame_dedup import FrameDeduper, backfill_times
+from src.media import MediaInfo, ffmpeg_exe, probe
+from src.precision import apply_cpu_precision, cpu_precision
+from src.registry import FROM_PRETRAINED_LOCK, SAMPLING_LOCK
+from src.telemetry import TELEMETRY, span
 
+# キャプション前に近似重複フレームを落とす（0 で従来どおり全フレーム）
+FRAME_DEDUP = os.getenv("FRAME_DEDUP", "1") != "0"
 
-def sample_frames(video_path: str, every_seconds: float = 0.5, max_frames: int = 16) -> List[Image.Image]:
-    """FFmpeg backend via imageioでフレーム間引き取得（moviepy依存なし）"""
+def _grab_frame_at(video_path: str, t: float, width: int = 640) -> Optional[np.ndarray]:
+    """
+    -ss を -i の前に置く入力シーク（直前のキーフレームへ飛んでから t までだけデコード）で 1 枚取得。
+    出力は rgb24 の raw。幅固定なので高さはバイト数から逆算できる（回転メタデータにも追従）。
+    """
+    cmd = [
+        ffmpeg_exe(), "-v", "error", "-nostdin",
+        "-ss", f"{max(0.0, t):.3f}", "-i", video_path,
+        "-frames:v", "1", "-vf", f"scale={width}:-2",
+        "-f", "rawvideo", "-pix_fmt", "rgb24", "pipe:1",
+    ]
+    res = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    row = width * 3
+    if res.returncode != 0 or len(res.stdout) < row:
+        return None
+    h = len(res.stdout) // row
+    return np.frombuffer(res.stdout, dtype=np.uint8, count=h * row).reshape(h, width, 3)
+
+def _sample_frames_sequential(video_path: str, every_seconds: float, max_frames: int) -> List[Image.Image]:
+    """長さが取れない動画用：imageio で先頭から順にデコードして間引く（旧実装）"""
     reader = imageio.get_reader(video_path, format="ffmpeg")
     meta = reader.get_meta_data()
     fps = float(meta.get("fps", 30.0))
@@ -24,9 +55,46 @@ def sample_frames(video_path: str, every_seconds: float = 0.5, max_frames: int =
     reader.close()
     return frames
 
+def _grab_frames_at(video_path: str, times: List[float]) -> List[Tuple[float, np.ndarray]]:
+    """_grab_frame_at を並列に。取れた分だけ (時刻, 配列) で返す"""
+    if not times:
+        return []
+    with ThreadPoolExecutor(max_workers=min(4, len(times))) as ex:
+        arrays = list(ex.map(lambda t: _grab_frame_at(video_path, t), times))
+    return [(t, a) for t, a in zip(times, arrays) if a is not None]
+
+def sample_frame_arrays(video_path: str, every_seconds: float = 0.5, max_frames: int = 16,
+                        info: Optional[MediaInfo] = None, times: Optional[List[float]] = None) -> List[np.ndarray]:
+    """
+    動画全体に均等に散らした時刻だけを ffmpeg にシークさせて取得する（HxWx3 uint8）。
+    デコード量は動画の長さではなく取り出す枚数に比例する。times を渡すと各フレームの時刻を追記する。
+    """
+    duration = (info or probe(video_path)).duration
+    if duration <= 0:
+        return [np.asarray(f) for f in _sample_frames_sequential(video_path, every_seconds, max_frames)]
+
+    n = max(1, min(int(max_frames), int(duration // max(every_seconds, 1e-3)) or 1))
+    grabbed = _grab_frames_at(video_path, [(i + 0.5) * duration / n for i in range(n)])  # 各区間の中央
+    if not grabbed:
+        return [np.asarray(f) for f in _sample_frames_sequential(video_path, every_seconds, max_frames)]
+    if times is not None:
+        times.extend(t for t, _ in grabbed)
+    return [a for _, a in grabbed]
+
+def sample_frames(video_path: str, every_seconds: float = 0.5, max_frames: int = 16) -> List[Image.Image]:
+    """sample_frame_arrays の PIL 版"""
+    return [Image.fromarray(a) for a in sample_frame_arrays(video_path, every_seconds, max_frames)]
+
 @dataclass
 class Captioner:
     model_id: str = os.getenv("CAPTION_MODEL", "Salesforce/blip-image-captioning-base")
+    # 1 回の generate でまとめてデコードするフレーム数（1 なら従来のフレーム毎と同等）
+    batch_size: int = int(os.getenv("CAPTION_BATCH_SIZE", "8"))
+    # "sample"（従来どおり）/ "greedy" / "beam"。greedy/beam はバッチでも再現性あり
+    decoding: str = os.getenv("CAPTION_DECODING", "sample")
+    num_beams: int = 3
+    # CPU 推論の精度（fp32 / bf16 / int8）。src/precision.py 参照
+    precision: str = os.getenv("CPU_PRECISION", "fp32")
 
     def __post_init__(self):
         if torch.cuda.is_available():
@@ -37,30 +105,121 @@ class Captioner:
             self.device = "cpu"
 
         self.processor = BlipProcessor.from_pretrained(self.model_id)
-        self.model = BlipForConditionalGeneration.from_pretrained(self.model_id).to(self.device)
-
-    def caption_images(self, images: List[Image.Image]) -> List[str]:
-        caps = []
-        for img in tqdm(images, desc="Captioning"):
-            inputs = self.processor(images=img, return_tensors="pt")
-            inputs = {k: v.to(self.device) for k, v in inputs.items()}
-            out = self.model.generate(
-                **inputs,
-                max_new_tokens=30,
-                do_sample=True,
-                top_p=0.9,
-                temperature=0.9,
-                repetition_penalty=1.1
-            )
-            text = self.processor.decode(out[0], skip_special_tokens=True)
-            caps.append(text)
+        with FROM_PRETRAINED_LOCK:
+            model = BlipForConditionalGeneration.from_pretrained(self.model_id)
+        self.model = model.to(self.device)
+        self.model.eval()
+        self.precision = apply_cpu_precision(self.model, ("vision_model", "text_decoder"),
+                                             cpu_precision(self.precision), self.device)
+
+    def _generate_kwargs(self, decoding: str) -> dict:
+        kw = dict(max_new_tokens=30, repetition_penalty=1.1)
+        if decoding == "sample":
+            kw.update(do_sample=True, top_p=0.9, temperature=0.9)
+        elif decoding == "greedy":
+            kw.update(do_sample=False, num_beams=1)
+        elif decoding == "beam":
+            kw.update(do_sample=False, num_beams=max(2, int(self.num_beams)), early_stopping=True)
+        else:
+            raise ValueError(f"unknown caption decoding: {decoding!r}")
+        return kw
+
+    def caption_images(self, images: List[Union[Image.Image, np.ndarray]], batch_size: Optional[int] = None,
+                       decoding: Optional[str] = None) -> List[str]:
+        """
+        全フレーム（PIL / HxWx3 uint8 配列）を 1 つの pixel テンソルに前処理し、batch_size 毎にまとめて generate する。
+        BLIP の generate は行ごとに BOS + attention mask を作り、早く終わった行は pad で埋めるので
+        バッチ化しても各行のキャプションは独立に得られる。
+        """
+        if not images:
+            return []
+        bs = max(1, int(batch_size or self.batch_size))
+        gen_kwargs = self._generate_kwargs(decoding or self.decoding)
+
+        pixel_values = self._pixel_values(images)
+        caps: List[str] = []
+        for i in tqdm(range(0, len(images), bs), desc="Captioning"):
+            with span("caption_batch", frames=len(pixel_values[i:i + bs]), device=self.device):
+                caps.extend(self._caption_pixels(pixel_values[i:i + bs], gen_kwargs))
         return caps
-    
+
+    def caption_batches(self, batches: Iterable[List[Union[Image.Image, np.ndarray]]],
+                        decoding: Optional[str] = None) -> List[str]:
+        """
+        届いた順にバッチをキャプションする（FrameQueue.batches と組み合わせ、抽出中のフレームから始める）。
+        バッチの切れ目が違っても各行は独立なので、greedy / beam なら caption_images と同じ結果。
+        """
+        gen_kwargs = self._generate_kwargs(decoding or self.decoding)
+        caps: List[str] = []
+        for batch in batches:
+            with span("caption_batch", frames=len(batch), device=self.device):
+                caps.extend(self._caption_pixels(self._pixel_values(batch), gen_kwargs))
+        return caps
+
+    def _pixel_values(self, images) -> torch.Tensor:
+        pixel_values = self.processor(images=list(images), return_tensors="pt")["pixel_values"]
+        return pixel_values.to(self.device, dtype=self.model.dtype)
+
+    def _caption_pixels(self, pixel_values: torch.Tensor, gen_kwargs: dict) -> List[str]:
+        # sample はグローバル乱数を進めるので、seed 付きの BGM 生成と同時に走らせない
+        with SAMPLING_LOCK if gen_kwargs.get("do_sample") else nullcontext(), torch.inference_mode():
+            out = self.model.generate(pixel_values=pixel_values, **gen_kwargs)
+        return [t.strip() for t in self.processor.batch_decode(out, skip_special_tokens=True)]
+
+class FrameQueue:
+    """
+    フレームのイテレータ（iter_scene_change_frames など）を作った時点から別スレッドで回し、
+    届いたフレームを batches() で受け渡す。抽出とモデル読み込み・キャプションを重ねるため。
+    受け取ったフレームは frames に残る。
+    """
+    _END = object()
+
+    def __init__(self, frames: Iterable[np.ndarray]):
+        self.frames: List[np.ndarray] = []
+        self._q: "queue.Queue" = queue.Queue()
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=TELEMETRY.wrap(self._produce), args=(frames,), daemon=True,
+                                        name="frame-producer")
+        self._thread.start()
+
+    def _produce(self, frames):
+        try:
+            with span("frames") as s:
+                n = 0
+                for f in frames:
+                    self._q.put(f)
+                    n += 1
+                s.set(frames=n)
+        except BaseException as e:  # 例外は受け取り側で再送出
+            self._error = e
+        finally:
+            self._q.put(self._END)
+
+    def batches(self, max_size: int) -> Iterator[List[np.ndarray]]:
+        """1 枚目が来るまで待ち、その時点で溜まっている分（最大 max_size）をまとめて返す"""
+        done = False
+        while not done:
+            item = self._q.get()
+            if item is self._END:
+                break
+            batch = [item]
+            while len(batch) < max(1, int(max_size)):
+                try:
+                    item = self._q.get_nowait()
+                except queue.Empty:
+                    break
+                if item is self._END:
+                    done = True
+                    break
+                batch.append(item)
+            self.frames.extend(batch)
+            yield batch
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
 def get_video_duration(video_path: str) -> float:
-    reader = imageio.get_reader(video_path, format="ffmpeg")
-    meta = reader.get_meta_data()
-    reader.close()
-    return float(meta.get("duration", 0.0))
+    return probe(video_path).duration
 
 def build_prompt_from_captions(captions: List[str]) -> str:
     if not captions:
@@ -82,42 +241,190 @@ def build_prompt_from_captions(captions: List[str]) -> str:
 
     tempo = "fast" if is_fast else "mid-tempo"
     mood  = "dark" if is_dark else "bright"
+    return compose_prompt(tempo, mood, scene)
 
+def compose_prompt(tempo: str, mood: str, scene: str) -> str:
+    """テンポ・ムード・場面からプロンプトを組む（キャプションでも埋め込み解析でも同じ形にする）"""
     # ドラム一色を避ける文言を明示
     instr = "catchy lead melody, evolving chord progression, warm pads, arpeggios, bassline, light percussion"
     return (f"{tempo}, {mood} modern track with {instr}, short hook and variation; "
             f"scene: {scene}; stereo, not drum-only")
 
-def sample_scene_change_frames(video_path: str, scene_thresh: float = 0.35, max_frames: int = 12):
+def _scaled_size(info: MediaInfo, width: int = 640) -> Optional[Tuple[int, int]]:
+    """scale=width:-2 相当の出力サイズを事前に決める（raw パイプはヘッダが無いので必須）"""
+    w, h = info.size
+    if w <= 0 or h <= 0:
+        return None
+    return width, max(2, int(round(h * width / w / 2)) * 2)
+
+def sample_scene_change_frames(video_path: str, scene_thresh: float = 0.35, max_frames: int = 12,
+                               info: Optional[MediaInfo] = None, dedup: Optional[bool] = None) -> List[np.ndarray]:
+    """
+    大きなシーン変化でフレーム抽出（似たフレームの連発を避ける）。dedup（既定は FRAME_DEDUP）なら
+    iter_distinct_frames、そうでなければ iter_scene_change_frames の一括版。
+    """
+    frames = iter_distinct_frames if (FRAME_DEDUP if dedup is None else dedup) else iter_scene_change_frames
+    return list(frames(video_path, scene_thresh, max_frames, info))
+
+def iter_distinct_frames(video_path: str, scene_thresh: float = 0.35, max_frames: int = 12,
+                         info: Optional[MediaInfo] = None) -> Iterator[np.ndarray]:
+    """
+    iter_scene_change_frames に近似重複の除去（src/frame_dedup.py）を挟んだもの。
+    落とした分とシーン変化が max_frames に満たなかった分は、残したフレームが無い時間帯から
+    シークで取り直して埋める（それも重複なら足さない）。キャプションする枚数は max_frames 以下のまま、
+    似たフレームの代わりに別の場面に回る。
+    """
+    info = info or probe(video_path)
+    dedup = FrameDeduper()
+    times: List[float] = []
+    kept: List[int] = []
+    for i, frame in enumerate(iter_scene_change_frames(video_path, scene_thresh, max_frames, info, times=times)):
+        if dedup.filter([frame]):
+            kept.append(i)
+            yield frame
+    # 短い動画は均等サンプリングと同じく 0.6 秒に 1 枚まで
+    budget = min(int(max_frames), max(1, int(info.duration / 0.6))) - len(kept)
+    if budget <= 0:
+        return
+    want = backfill_times([times[i] for i in kept if i < len(times)], info.duration, budget)
+    grabbed = _grab_frames_at(video_path, want)
+    frames = [a for _, a in grabbed]
+    for i in dedup.filter(frames):
+        yield frames[i]
+
+_PTS_TIME = re.compile(rb"pts_time:\s*([-\d.]+)")
+
+def _collect_pts_times(stream, times: List[float]):
+    """showinfo のログから各フレームの時刻を拾う（stderr を読み切るので ffmpeg も詰まらない）"""
+    try:
+        for line in stream:
+            m = _PTS_TIME.search(line)
+            if m:
+                times.append(float(m.group(1)))
+    except (OSError, ValueError):  # 途中で打ち切られてパイプが閉じた
+        pass
+
+def _read_raw_frames(stream, buf: np.ndarray) -> Iterator[np.ndarray]:
     """
-    大きなシーン変化でフレーム抽出（似たフレームの連発を避ける）。
+    rgb24 の raw ストリームを buf（(枚数, H, W, 3) uint8）へ 1 枚ずつ直接読み込んで yield する。
+    buf の枚数で打ち切り、最後の 1 枚が欠けていたら（途中で終わった）捨てる。
+    """
+    frame_bytes = buf[0].nbytes if len(buf) else 0
+    for n in range(len(buf)):
+        view = memoryview(buf[n]).cast("B")
+        got = 0
+        while got < frame_bytes:
+            r = stream.readinto(view[got:])
+            if not r:
+                return
+            got += r
+        yield buf[n]
+
+def iter_scene_change_frames(video_path: str, scene_thresh: float = 0.35, max_frames: int = 12,
+                             info: Optional[MediaInfo] = None, times: Optional[List[float]] = None
+                             ) -> Iterator[np.ndarray]:
+    """
+    ffmpeg から縮小済みの rgb24 を raw でパイプ受けし、1 つの NumPy バッファに直接読み込みながら
+    1 枚揃う毎に yield する（動画の最後まで待たずに後段を始められる）。
+    枚数は ffmpeg 側で -frames:v により打ち切るので、ディスク書き出しも JPEG 往復も無い。
+    times を渡すと各フレームの時刻（秒）を追記する（最後まで回した時点で揃う）。
     ffmpegコマンドの引数は subprocess にリストで渡すので、クォートは入れない！
     """
-    tmpdir = tempfile.mkdtemp(prefix="scenes_")
-    out_pattern = os.path.join(tmpdir, "f_%04d.jpg")
+    info = info or probe(video_path)
+    size = _scaled_size(info)
+    if size is None or max_frames <= 0:
+        yield from sample_frame_arrays(video_path, every_seconds=0.6, max_frames=max_frames, info=info, times=times)
+        return
+    w, h = size
 
-    # フィルタ式は素の文字列でOK（シングルクォート不要）
-    vf = f"select=gt(scene,{scene_thresh}),scale=640:-2"
+    # フィルタ式は素の文字列でOK（シングルクォート不要）。式の中のカンマはフィルタの区切りと
+    # 解釈されるのでエスケープする（しないと filtergraph のエラーで毎回フォールバックになる）。
+    # シーン判定は縮小した後の隣り合うフレーム同士（fps で間引くと速いパンもカット並みの値になるので間引かない）。
+    # format=yuv420p で判定を YUV のまま行い、rgb24 への変換は選ばれたフレームだけにする
+    # （無いと -pix_fmt rgb24 が scale まで伝わり、全フレームを RGB にしてから判定するので数倍遅い）
+    vf = f"scale={w}:{h},format=yuv420p,select=gt(scene\\,{scene_thresh})"
+    if times is not None:
+        vf += ",showinfo"
 
     cmd = [
-        "ffmpeg", "-y",
+        ffmpeg_exe(), "-v", "error" if times is None else "info", "-nostdin", "-hide_banner", "-nostats",
         "-analyzeduration", "5M", "-probesize", "10M",
         "-i", video_path,
         "-vf", vf,
         "-vsync", "vfr",
-        out_pattern
+        "-frames:v", str(int(max_frames)),
+        "-f", "rawvideo", "-pix_fmt", "rgb24", "pipe:1",
     ]
 
-    # 失敗時は通常サンプリングにフォールバック
+    buf = np.empty((int(max_frames), h, w, 3), dtype=np.uint8)
+    n = 0
+    found: List[float] = []
     try:
-        res = subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    except subprocess.CalledProcessError:
-        # フォールバック（毎秒サンプリング）
-        return sample_frames(video_path, every_seconds=0.6, max_frames=max_frames)
-
-    files = sorted(glob.glob(out_pattern))[:max_frames]
-    frames = [Image.open(f).convert("RGB") for f in files]
-    if not frames:
-        # シーン変化が少なすぎた場合もフォールバック
-        return sample_frames(video_path, every_seconds=0.6, max_frames=max_frames)
-    return frames[:max_frames]
\ No newline at end of file
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL if times is None else subprocess.PIPE)
+    except OSError:
+        proc = None
+    if proc is not None:
+        reader = None
+        if times is not None:
+            reader = threading.Thread(target=_collect_pts_times, args=(proc.stderr, found), daemon=True)
+            reader.start()
+        with proc:
+            try:
+                for frame in _read_raw_frames(proc.stdout, buf):
+                    n += 1
+                    yield frame
+            except GeneratorExit:
+                proc.kill()  # 受け取り側が途中でやめた
+                raise
+            proc.stdout.close()
+            rc = proc.wait()
+            if reader is not None:
+                reader.join()
+        if rc != 0 and n == 0:
+            proc = None
+        elif times is not None:
+            times.extend(found[:n])
+
+    # 失敗時・シーン変化が少なすぎた場合は通常サンプリングにフォールバック
+    if proc is None or n == 0:
+        yield from sample_frame_arrays(video_path, every_seconds=0.6, max_frames=max_frames, info=info, times=times)
+
+def detect_scene_cuts(video_path: str, scene_thresh: float = 0.35, info: Optional[MediaInfo] = None) -> List[float]:
+    """
+    動画全体のシーン変化の時刻（秒）。iter_scene_change_frames と同じ判定だが、フレームは受け取らず
+    showinfo の時刻だけを拾う（-frames:v で打ち切らないので最後まで見る。判定用に 160 幅まで粗く縮小）。
+    失敗したら空リスト。
+    """
+    info = info or probe(video_path)
+    if info.duration <= 0:
+        return []
+    vf = f"scale=160:-2:flags=fast_bilinear,select=gt(scene\\,{scene_thresh}),showinfo"
+    cmd = [
+        ffmpeg_exe(), "-v", "info", "-nostdin", "-hide_banner", "-nostats",
+        "-analyzeduration", "5M", "-probesize", "10M",
+        "-i", video_path, "-an", "-vf", vf, "-vsync", "vfr", "-f", "null", "-",
+    ]
+    cuts: List[float] = []
+    with span("scene_cuts", duration=info.duration) as s:
+        try:
+            proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        except OSError:
+            return []
+        with proc:
+            _collect_pts_times(proc.stderr, cuts)
+            rc = proc.wait()
+        s.set(cuts=len(cuts), ok=rc == 0)
+    return sorted(cuts) if rc == 0 else []
+
+def sample_segment_frames(video_path: str, segments: List[Tuple[float, float]],
+                          per_segment: int = 2) -> List[List[np.ndarray]]:
+    """区間毎に per_segment 枚を、区間を等分した各中央の時刻からシークで取る（取れなかった分は欠ける）"""
+    n = max(1, int(per_segment))
+    want = [(i, s + (e - s) * (k + 0.5) / n) for i, (s, e) in enumerate(segments) for k in range(n)]
+    grabbed = dict(_grab_frames_at(video_path, [t for _, t in want]))
+    out: List[List[np.ndarray]] = [[] for _ in segments]
+    for i, t in want:
+        if t in grabbed:
+            out[i].append(grabbed[t])
+    return out
@@ -0,0 +1,80 @@
+"""
+テスト・ベンチマーク用の合成データ（lavfi の動画と、ランダム初期化の小さな BLIP / MusicGen）。
+モデルはダウンロード無しで読める形で保存するので、MusicGenerator / Captioner をそのまま通せる。
+"""
+import os
+import subprocess
+
+import numpy as np
+import torch
+from tokenizers import Tokenizer, models, pre_tokenizers
+from transformers import (BertTokenizerFast, BlipConfig, BlipForConditionalGeneration, BlipImageProcessor,
+                          BlipProcessor, EncodecConfig, EncodecFeatureExtractor, MusicgenConfig,
+                          MusicgenDecoderConfig, MusicgenForConditionalGeneration, MusicgenProcessor, T5Config,
+                          T5TokenizerFast)
+
+from src.media import ffmpeg_exe
+
+# シーン変化が起きるよう lavfi のテストパターンを切り替えながら並べる
+_SOURCES = ("testsrc", "smptebars", "testsrc2", "rgbtestsrc")
+
+# ===== 合成メディア =====
+def make_video(path: str, seconds: float, size: str, fps: int, audio: bool, cut_every: float = 5.0) -> str:
+    """lavfi の testsrc 系を cut_every 秒毎に切り替えた動画（audio なら sine を付ける）を作る"""
+    n = max(1, int(np.ceil(seconds / cut_every)))
+    cmd = [ffmpeg_exe(), "-v", "error", "-nostdin", "-y"]
+    for i in range(n):
+        d = min(cut_every, seconds - i * cut_every)
+        cmd += ["-f", "lavfi", "-i", f"{_SOURCES[i % len(_SOURCES)]}=size={size}:rate={fps}:duration={d:g}"]
+    graph = "".join(f"[{i}:v]" for i in range(n)) + f"concat=n={n}:v=1:a=0[v]"
+    if audio:
+        cmd += ["-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=44100:duration={seconds:g}"]
+    cmd += ["-filter_complex", graph, "-map", "[v]"]
+    if audio:
+        cmd += ["-map", f"{n}:a", "-c:a", "aac", "-b:a", "96k"]
+    cmd += ["-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p", path]
+    subprocess.run(cmd, check=True)
+    return path
+
+def make_tiny_blip(path: str) -> str:
+    """ランダム初期化の小さな BLIP（語彙 100、隠れ層 32）を path に保存"""
+    os.makedirs(path, exist_ok=True)
+    vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", "[DEC]"] + [f"w{i}" for i in range(94)]
+    with open(os.path.join(path, "vocab.txt"), "w") as f:
+        f.write("\n".join(vocab))
+    tok = BertTokenizerFast(os.path.join(path, "vocab.txt"), bos_token="[DEC]")
+    proc = BlipProcessor(BlipImageProcessor(size={"height": 32, "width": 32}), tok)
+    cfg = BlipConfig(
+        text_config=dict(vocab_size=100, hidden_size=32, num_hidden_layers=2, num_attention_heads=2,
+                         intermediate_size=64, bos_token_id=5, pad_token_id=0, sep_token_id=3, eos_token_id=3),
+        vision_config=dict(hidden_size=32, num_hidden_layers=2, num_attention_heads=2, intermediate_size=64,
+                           image_size=32, patch_size=8),
+        projection_dim=32)
+    torch.manual_seed(0)
+    BlipForConditionalGeneration(cfg).save_pretrained(path)
+    proc.save_pretrained(path)
+    return path
+
+def make_tiny_musicgen(path: str) -> str:
+    """ランダム初期化の小さな MusicGen（T5 1 層・デコーダ 2 層・EnCodec 縮小、32kHz / 50 フレーム毎秒）を保存"""
+    os.makedirs(path, exist_ok=True)
+    vocab = {"<pad>": 0, "</s>": 1, "<unk>": 2}
+    for i, w in enumerate("a b c fast dark bright track with melody drums bass the of and".split()):
+        vocab[w] = i + 3
+    tk = Tokenizer(models.WordLevel(vocab, unk_token="<unk>"))
+    tk.pre_tokenizer = pre_tokenizers.Whitespace()
+    tok = T5TokenizerFast(tokenizer_object=tk, pad_token="<pad>", eos_token="</s>", unk_token="<unk>", extra_ids=0)
+    proc = MusicgenProcessor(EncodecFeatureExtractor(feature_size=1, sampling_rate=32000), tok)
+    t5 = T5Config(vocab_size=32, d_model=32, d_kv=8, d_ff=64, num_layers=1, num_heads=2)
+    enc = EncodecConfig(sampling_rate=32000, audio_channels=1, num_filters=4, hidden_size=16, codebook_size=64,
+                        upsampling_ratios=[8, 5, 4, 4], target_bandwidths=[1.2], codebook_dim=16, num_lstm_layers=1)
+    dec = MusicgenDecoderConfig(vocab_size=64, hidden_size=32, num_hidden_layers=2, num_attention_heads=2,
+                                ffn_dim=64, num_codebooks=4, pad_token_id=64, bos_token_id=64,
+                                decoder_start_token_id=64)
+    torch.manual_seed(0)
+    model = MusicgenForConditionalGeneration(MusicgenConfig.from_sub_models_config(t5, enc, dec)).eval()
+    for k in ("decoder_start_token_id", "pad_token_id", "bos_token_id"):
+        setattr(model.generation_config, k, 64)
+    model.save_pretrained(path)
+    proc.save_pretrained(path)
+    return path
@@ -0,0 +1,54 @@
+import numpy as np
+
+from src.audio_fit import find_loop_end, fit_audio, fit_to_length, loudness_lufs, normalize, peak
+
+SR = 32000
+
+def _clicks(seconds: float, beat: float = 0.5) -> np.ndarray:
+    """220Hz の持続音 + beat 秒毎のクリック"""
+    t = np.arange(int(seconds * SR)) / SR
+    a = 0.2 * np.sin(2 * np.pi * 220 * t)
+    k = np.arange(400)
+    for b in np.arange(0, seconds, beat):
+        i = int(b * SR)
+        n = min(400, len(a) - i)
+        a[i:i + n] += (np.exp(-k / 80) * np.sin(2 * np.pi * 2000 * k / SR))[:n]
+    return a.astype(np.float32)
+
+def test_loop_end_on_bar_and_seamless_fill():
+    a = _clicks(5.3)
+    end = find_loop_end(a, SR, int(0.25 * SR))
+    assert abs(end - 4.0 * SR) < 0.01 * SR  # 120BPM の 2 小節
+    out = fit_audio(a, SR, 20)
+    assert out.dtype == np.float32 and out.shape == (20 * SR,)
+    # 2 周目以降は end 周期で同じ並び（つなぎ目以外は元の音そのもの）
+    assert np.allclose(out[end + SR:2 * end], a[SR:end]) and np.allclose(out[2 * end:3 * end], out[end:2 * end])
+    # 先頭・末尾はフェード、つなぎ目は元の音がそのまま続いた場合とほぼ同じ
+    assert out[0] == 0 and out[-1] == 0
+    assert np.max(np.abs(out[end:end + SR // 4] - a[end:end + SR // 4])) < 0.05
+
+def test_fit_truncates_into_given_buffer():
+    a = np.ones(SR * 3, dtype=np.float64)
+    buf = np.zeros(SR * 4, dtype=np.float32)
+    out = fit_audio(a, SR, 2, out=buf)
+    assert out.base is buf and out.shape == (2 * SR,) and out[SR] == 1.0
+
+def test_fit_tiny_input():
+    # 4 サンプル未満はクロスフェード長が 0 になる（ループ長は 1 以上）
+    for n in (1, 2, 3):
+        out = fit_to_length(np.ones(n), 100, SR)
+        assert out.shape == (100,)
+        assert np.all(np.isfinite(out))
+        assert out[50] == 1.0
+
+def test_loudness_and_normalize():
+    s = np.sin(2 * np.pi * 997 * np.arange(SR * 5) / SR).astype(np.float32)
+    assert abs(loudness_lufs(s, SR) + 3.01) < 0.05  # BS.1770: 0dBFS の 997Hz 正弦波は -3.01 LUFS
+    x = 0.3 * s
+    normalize(x, SR, lufs=-23)
+    assert abs(loudness_lufs(x, SR) + 23) < 0.05
+    normalize(x, SR)
+    assert abs(peak(x) - 1.0) < 1e-6
+    y = 0.01 * s
+    normalize(y, SR, lufs=0)  # ピークが 1 を超える目標はピークで止める
+    assert abs(peak(y) - 1.0) < 1e-6
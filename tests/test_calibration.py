@@ -0,0 +1,26 @@
+from src.calibration import FLOOR_PRESET, HostProfile, budget_preset, load_profile, preset_at, save_profile
+from src.presets import QUALITY_PRESETS
+
+PROFILE = HostProfile(key="k", frames_sec_per_video_sec=0.1, caption_call_sec=0.5, caption_sec_per_frame=1.0,
+                      caption_batch=8, decode_fixed_sec=1.0, decode_steps_per_sec=50.0, mux_sec_per_video_sec=0.05)
+
+def test_predict_and_interpolate():
+    # 30 秒・レベル 1: 3 + (0.5 + 6) + (1 + 30*32/50) + 1.5
+    t = PROFILE.predict(30, QUALITY_PRESETS[1])
+    assert abs(t["total"] - 31.2) < 1e-6 and abs(t["generate"] - 20.2) < 1e-6
+    assert preset_at(0) == {**FLOOR_PRESET, "analysis": QUALITY_PRESETS[1]["analysis"]}
+    assert preset_at(2)["max_frames"] == QUALITY_PRESETS[2]["max_frames"]
+    assert preset_at(2.5)["tokens_per_sec"] == 38
+
+def test_budget_preset_fits():
+    assert budget_preset(PROFILE, 30, 1000)["tokens_per_sec"] == 50
+    low = budget_preset(PROFILE, 30, 1)
+    assert low["over_budget"] and low["max_frames"] == FLOOR_PRESET["max_frames"]
+    mid = budget_preset(PROFILE, 30, 35)
+    assert "over_budget" not in mid and mid["predicted_sec"] <= 35
+    assert 1 < mid["level"] < 3 and budget_preset(PROFILE, 60, 35)["level"] < mid["level"]
+
+def test_profile_roundtrip(tmp_path):
+    path = str(tmp_path / "calibration.json")
+    save_profile(path, PROFILE)
+    assert load_profile(path, "k") == PROFILE and load_profile(path, "other") is None
@@ -0,0 +1,24 @@
+from src.caption_cache import CaptionCache, file_fingerprint
+
+def test_roundtrip_and_lru(tmp_path):
+    video = tmp_path / "v.mp4"
+    video.write_bytes(b"\x00" * 1000)
+    cache = CaptionCache(str(tmp_path / "c.sqlite3"), max_bytes=300)
+
+    k1 = cache.make_key(str(video), "blip", 0.35, 8)
+    assert k1 != cache.make_key(str(video), "blip", 0.35, 12)
+    assert k1 == cache.key_for(file_fingerprint(str(video)), "blip", 0.35, 8)
+    assert cache.get(k1) is None
+    cache.put(k1, ["a dog", "a cat"], "mid-tempo, bright")
+    assert cache.get(k1) == (["a dog", "a cat"], "mid-tempo, bright")
+
+    # 容量を超えたら最終アクセスが古いものから消える
+    for i in range(5):
+        cache.put(f"k{i}", ["x" * 40], "p")
+    assert cache.get(k1) is None
+    assert cache.get("k4") is not None
+
+def test_fingerprint_depends_on_content(tmp_path):
+    a, b = tmp_path / "a", tmp_path / "b"
+    a.write_bytes(b"abc"); b.write_bytes(b"abd")
+    assert file_fingerprint(str(a)) != file_fingerprint(str(b))
@@ -0,0 +1,24 @@
+import numpy as np
+
+from src.frame_dedup import FrameDeduper, backfill_times, frame_signatures, signature_distances
+
+def _frames():
+    rng = np.random.default_rng(0)
+    base = rng.integers(0, 256, (4, 6, 3), dtype=np.uint8).repeat(30, 0).repeat(40, 1)   # 120x240 のブロック画像
+    noisy = np.clip(base.astype(int) + rng.integers(-6, 7, base.shape), 0, 255).astype(np.uint8)
+    other = rng.integers(0, 256, (4, 6, 3), dtype=np.uint8).repeat(30, 0).repeat(40, 1)
+    return base, noisy, other
+
+def test_near_duplicates_are_dropped():
+    base, noisy, other = _frames()
+    d = signature_distances(*[frame_signatures([base, noisy, other])] * 2)
+    assert d[0, 1] < 0.1  # ノイズを足しただけ
+    assert d[0, 2] > 0.3  # 別の画像
+    dedup = FrameDeduper()
+    assert dedup.filter([base, noisy, base, other]) == [0, 3]
+    assert dedup.filter([noisy]) == [] and dedup.dropped == 3
+
+def test_backfill_prefers_uncovered_ranges():
+    assert backfill_times([1.0, 2.0], duration=12.0, budget=2) == [7.5, 10.5]
+    assert backfill_times([], duration=10.0, budget=2) == [2.5, 7.5]
+    assert backfill_times([1.0], duration=10.0, budget=0) == []
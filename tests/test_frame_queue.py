@@ -0,0 +1,17 @@
+import pytest
+
+from src.video2text import FrameQueue
+
+def test_batches_preserve_order_and_collect_frames():
+    fq = FrameQueue(iter(range(10)))
+    out = [x for batch in fq.batches(4) for x in batch]
+    assert out == list(range(10))
+    assert fq.frames == list(range(10))
+    assert all(len(b) <= 4 for b in FrameQueue(iter(range(10))).batches(4))
+
+def test_producer_error_is_reraised():
+    def frames():
+        yield 1
+        raise RuntimeError("ffmpeg died")
+    with pytest.raises(RuntimeError, match="ffmpeg died"):
+        list(FrameQueue(frames()).batches(2))
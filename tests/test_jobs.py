@@ -0,0 +1,34 @@
+import io
+import time
+from pathlib import Path
+
+from src.jobs import JobManager
+
+def _wait(manager, job_id, timeout=5.0):
+    deadline = time.time() + timeout
+    while manager.get(job_id).status in ("queued", "running") and time.time() < deadline:
+        time.sleep(0.01)
+    return manager.get(job_id)
+
+def test_jobs_get_isolated_dirs(tmp_path):
+    def runner(job):
+        out = job.dir / "out.txt"
+        out.write_bytes(job.input.read_bytes())
+        return {"out": out}
+
+    m = JobManager(tmp_path, runner, workers=2)
+    a = m.submit({}, io.BytesIO(b"a"), "a.mp4")
+    b = m.submit({}, io.BytesIO(b"b"), "b.mov")
+    assert a.dir != b.dir and b.input.suffix == ".mov"
+    assert _wait(m, a.id).status == "done" and _wait(m, b.id).status == "done"
+    assert Path(m.get(b.id).outputs["out"]).read_bytes() == b"b"
+
+    assert m.delete(a.id) and m.get(a.id) is None and not a.dir.exists()
+
+def test_failed_job_reports_error(tmp_path):
+    def runner(job):
+        raise ValueError("boom")
+
+    m = JobManager(tmp_path, runner, workers=1)
+    job = _wait(m, m.submit({}, io.BytesIO(b""), "x.mp4").id)
+    assert job.status == "failed" and job.error == "boom"
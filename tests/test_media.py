@@ -0,0 +1,35 @@
+from src.media import parse_ffmpeg_banner, parse_ffprobe_json
+
+BANNER = """Input #0, mov,mp4,m4a,3gp,3g2,mj2, from 'v.mp4':
+  Duration: 00:01:02.50, start: 0.000000, bitrate: 151 kb/s
+  Stream #0:0[0x1](und): Video: h264 (High) (avc1 / 0x31637661), yuv420p(progressive), 320x240 [SAR 1:1 DAR 4:3], 150 kb/s, 29.97 fps, 29.97 tbr, 12800 tbn (default)
+      Side data:
+        displaymatrix: rotation of -90.00 degrees
+  Stream #0:1[0x2](und): Audio: aac (LC) (mp4a / 0x6134706D), 48000 Hz, 5.1, fltp, 317 kb/s (default)
+"""
+
+def test_banner():
+    info = parse_ffmpeg_banner("v.mp4", BANNER)
+    assert abs(info.duration - 62.5) < 1e-6
+    assert info.fps == 29.97 and info.video_codec == "h264"
+    assert info.size == (240, 320) and info.rotation == 90  # 回転後のサイズ
+    assert info.has_audio and info.audio_streams[0].channels == 6
+
+def test_banner_without_audio():
+    text = BANNER.split("  Stream #0:1")[0]
+    assert not parse_ffmpeg_banner("v.mp4", text).has_audio
+
+def test_ffprobe_json():
+    data = {
+        "format": {"duration": "8.000000"},
+        "streams": [
+            {"codec_type": "video", "codec_name": "mjpeg", "width": 600, "height": 600,
+             "disposition": {"attached_pic": 1}},
+            {"codec_type": "video", "codec_name": "hevc", "width": 1920, "height": 1080,
+             "avg_frame_rate": "30000/1001", "side_data_list": [{"rotation": -90}]},
+        ],
+    }
+    info = parse_ffprobe_json("v.mp4", data)
+    assert info.video_codec == "hevc" and info.size == (1080, 1920)
+    assert abs(info.fps - 29.97) < 0.01 and info.duration == 8.0
+    assert not info.has_audio
@@ -0,0 +1,36 @@
+import numpy as np
+
+from tests.synthetic import make_video
+from src.media import probe
+from src.mixer import MIX_RATE, decode_audio, duck_gain, mux_mix_pcm_to_video, resample
+
+def test_resample_length_and_level():
+    sr = 32000
+    x = np.sin(2 * np.pi * 440 * np.arange(sr) / sr).astype(np.float32)
+    y = resample(x, sr, 48000)
+    assert y.dtype == np.float32 and len(y) == 48000
+    assert abs(np.sqrt(np.mean(y[1000:-1000] ** 2)) - np.sqrt(0.5)) < 0.01
+
+def test_duck_only_where_voice_band_is_loud():
+    sr = 48000
+    t = np.arange(4 * sr) / sr
+    orig = np.zeros((len(t), 2), dtype=np.float32)
+    orig[sr:2 * sr] = 0.3 * np.sin(2 * np.pi * 1000 * t[sr:2 * sr])[:, None]  # 1〜2 秒だけ「声」
+    g = duck_gain(orig, sr, len(t), duck_db=-12.0)
+    assert len(g) == len(t)
+    assert g[int(1.5 * sr)] < 10 ** (-10 / 20)
+    assert g[int(3.5 * sr)] > 0.95 and g[int(0.2 * sr)] > 0.95
+    assert np.all(duck_gain(orig, sr, len(t), duck_db=0.0) == 1.0)
+
+def test_short_bgm_keeps_full_video(tmp_path):
+    video = make_video(str(tmp_path / "v.mp4"), 4, "160x120", 10, True)
+    bgm = np.full(32000 * 2, 0.5, dtype=np.float32)  # 2 秒の BGM に 4 秒の動画
+    out = mux_mix_pcm_to_video(video, bgm, 32000, str(tmp_path / "out.mp4"))
+    assert abs(probe(out).duration - 4.0) < 0.1
+    mixed = decode_audio(out)
+    sr = MIX_RATE
+    # BGM の後ろも元音声（440Hz の sine）が残る
+    assert np.sqrt(np.mean(mixed[int(2.5 * sr):int(3.5 * sr)] ** 2)) > 0.05
+    # 元音声が無くても動画の長さまで（BGM の後ろは無音）
+    silent = make_video(str(tmp_path / "s.mp4"), 4, "160x120", 10, False)
+    assert abs(probe(mux_mix_pcm_to_video(silent, bgm, 32000, str(tmp_path / "out2.mp4"))).duration - 4.0) < 0.1
@@ -0,0 +1,47 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+class FakeMusic:
+    def __init__(self):
+        self.seeds = []
+
+    def generate_stream(self, prompt, cfg):
+        self.seeds.append(cfg.seed)
+        yield 32000, np.full(32000, 0.1, dtype=np.float32)
+
+def _fake_mux(video, info, sr, audio, bgm_gain_db, run_dir, keep_wav, others=()):
+    run_dir.mkdir(parents=True, exist_ok=True)
+    out = run_dir / "video_with_bgm.mp4"
+    out.write_bytes(b"mp4")
+    return str(out)
+
+def test_same_inputs_reroll_with_per_run_dirs(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_DATA_HOME", str(tmp_path / "data"))
+    import app
+    from src.registry import ModelRegistry
+    from src.stages import StageMemo
+
+    music = FakeMusic()
+    models = ModelRegistry()
+    models.register("music", lambda: music)
+    monkeypatch.setattr(app, "CONCURRENCY", 2)  # 実行毎に run_<hex> へ出す
+    monkeypatch.setattr(app, "OUTPUT_DIR", tmp_path / "out")
+    monkeypatch.setattr(app, "STAGES", StageMemo())
+    monkeypatch.setattr(app, "_models", lambda: models)
+    monkeypatch.setattr(app, "_ensure_ffmpeg", lambda: None)
+    monkeypatch.setattr(app, "_probe", lambda video: SimpleNamespace(duration=6.0))
+    monkeypatch.setattr(app, "_stage_prompt", lambda *a: "calm piano")
+    monkeypatch.setattr(app, "_stage_mux", _fake_mux)
+    video = tmp_path / "v.mp4"
+    video.write_bytes(b"\x00" * 1000)
+
+    def run(gain):
+        return [out for _, out in app.pipeline(str(video), 1, 1.0, "", gain) if out][-1]
+
+    first, second = run(-4), run(-4)
+    assert first != second
+    assert len(music.seeds) == 2
+    assert music.seeds[0] != music.seeds[1]  # 何も変えずにもう一度 → 別の seed で作り直す
+    run(-8)
+    assert len(music.seeds) == 2  # gain だけ変えたら mux だけ
@@ -0,0 +1,27 @@
+import numpy as np
+
+from src.ranking import audio_metrics, rank_takes
+
+SR = 32000
+
+def _takes():
+    t = np.arange(SR * 6) / SR
+    tone = (0.5 * np.sin(2 * np.pi * 220 * t) + 0.3 * np.sin(2 * np.pi * 330 * t)) * (0.6 + 0.4 * np.sin(np.pi * t))
+    noise = np.random.default_rng(0).standard_normal(len(t)) * 0.3
+    half = tone.copy()
+    half[len(t) // 2:] = 0
+    return [noise, half, np.clip(tone * 8, -1, 1), tone]
+
+def test_metrics_flag_silence_noise_and_clipping():
+    m = audio_metrics(np.stack(_takes()), SR)
+    assert abs(m["silence_ratio"][1] - 0.5) < 0.02 and m["silence_ratio"][3] == 0
+    assert m["flatness"][0] > 0.4   # ノイズ
+    assert m["flatness"][3] < 0.05  # 音程のある音
+    assert m["clip_ratio"][2] > 0.1
+    assert m["clip_ratio"][3] < 0.01
+
+def test_rank_takes_prefers_clean_tone():
+    order, metrics = rank_takes(_takes(), SR)
+    assert order[0] == 3 and order[-1] == 2
+    assert len(metrics) == 4 and all("score" in m for m in metrics)
+    assert rank_takes([], SR) == ([], [])
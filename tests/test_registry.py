@@ -0,0 +1,38 @@
+import threading
+import time
+
+import torch
+
+from src.registry import ModelRegistry
+
+class _Dummy:
+    def __init__(self):
+        self.device = "cpu"
+        self.model = torch.nn.Linear(4, 4)
+
+def test_single_flight_and_idle_eviction():
+    calls = []
+
+    def factory():
+        calls.append(1)
+        time.sleep(0.05)
+        return _Dummy()
+
+    reg = ModelRegistry()
+    reg.register("m", factory)
+    got = []
+    threads = [threading.Thread(target=lambda: got.append(reg.get("m"))) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1 and all(g is got[0] for g in got)
+    assert reg.resident()["models"]["m"]["bytes"] == (16 + 4) * 4
+
+    with reg.use("m"):
+        assert reg.evict_idle(0) == []  # 使用中は外さない
+    assert reg.evict_idle(3600) == []
+    assert reg.evict_idle(0) == ["m"]
+    assert reg.peek("m") is None and reg.resident()["models"]["m"] == {"state": "unloaded"}
+    reg.get("m")
+    assert len(calls) == 2
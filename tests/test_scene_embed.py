@@ -0,0 +1,48 @@
+import json
+
+import numpy as np
+import torch
+from transformers import CLIPConfig, CLIPImageProcessor, CLIPModel, CLIPProcessor, CLIPTokenizer
+from transformers.models.clip.tokenization_clip import bytes_to_unicode
+
+from src.scene_embed import SCENE_LABELS, SceneEmbedder
+
+def _tiny_clip(path):
+    """バイト単位の語彙（merge 無し）の小さなランダム CLIP を path に保存"""
+    chars = list(bytes_to_unicode().values())
+    vocab = {t: i for i, t in enumerate(chars + [c + "</w>" for c in chars] + ["<|startoftext|>", "<|endoftext|>"])}
+    (path / "vocab.json").write_text(json.dumps(vocab))
+    (path / "merges.txt").write_text("#version: 0.2\n")
+    tok = CLIPTokenizer(str(path / "vocab.json"), str(path / "merges.txt"))
+    ip = CLIPImageProcessor(size={"shortest_edge": 32}, crop_size={"height": 32, "width": 32})
+    torch.manual_seed(0)
+    eos = vocab["<|endoftext|>"]
+    cfg = CLIPConfig(
+        text_config=dict(vocab_size=len(vocab), hidden_size=32, intermediate_size=64, num_hidden_layers=1,
+                         num_attention_heads=2, bos_token_id=eos - 1, eos_token_id=eos, pad_token_id=eos),
+        vision_config=dict(hidden_size=32, intermediate_size=64, num_hidden_layers=1, num_attention_heads=2,
+                           image_size=32, patch_size=8),
+        projection_dim=16)
+    CLIPModel(cfg).save_pretrained(str(path))
+    CLIPProcessor(image_processor=ip, tokenizer=tok).save_pretrained(str(path))
+    return str(path)
+
+def test_analyze_and_vocab_cache(tmp_path):
+    model_dir = tmp_path / "clip"
+    model_dir.mkdir()
+    emb = SceneEmbedder(model_id=_tiny_clip(model_dir), precision="fp32", cache_dir=str(tmp_path / "cache"))
+    assert emb.vocab["scene"].shape == (len(SCENE_LABELS), 16)
+    assert len(list((tmp_path / "cache").iterdir())) == 1
+
+    # 2 回目は保存した語彙を読むだけ（同じ値）
+    again = SceneEmbedder(model_id=emb.model_id, precision="fp32", cache_dir=str(tmp_path / "cache"))
+    assert np.allclose(again.vocab["tempo"], emb.vocab["tempo"])
+
+    frames = [np.random.default_rng(i).integers(0, 256, (36, 64, 3), dtype=np.uint8) for i in range(5)]
+    labels, prompt = emb.analyze(frames)
+    assert len(labels) == 5 and all(l in SCENE_LABELS for l in labels)
+    assert prompt.split(",")[0] in ("fast", "mid-tempo") and "scene: " + labels[0] in prompt
+    assert emb.analyze_batches([frames[:2], frames[2:]]) == (labels, prompt)
+    groups = emb.analyze_groups([frames[:2], [], frames[2:]])
+    assert [g[0] for g in groups] == [labels[:2], [], labels[2:]]
+    assert groups[0] == emb.analyze(frames[:2])
@@ -0,0 +1,44 @@
+import threading
+
+import numpy as np
+import pytest
+
+from src.scheduler import BatchScheduler
+from src.text2music import GenerateConfig
+
+class FakeMusic:
+    """プロンプト毎に中身の違う音を返し、generate_batch の呼び出しを記録する"""
+
+    def __init__(self):
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def generate_batch(self, prompts, cfg):
+        with self._lock:
+            self.calls.append((list(prompts), cfg.seconds))
+        if "boom" in prompts:
+            raise RuntimeError("boom")
+        return [(32000, np.full(cfg.seconds, len(p), dtype=np.float32)) for p in prompts]
+
+def test_groups_by_batch_key_and_routes_results():
+    gen = FakeMusic()
+    sched = BatchScheduler(gen, window_ms=300, max_batch=8)
+    futures = [sched.submit("a", GenerateConfig(seconds=4, seed=1)),
+               sched.submit("bb", GenerateConfig(seconds=4, seed=2)),   # seed だけ違う → 同じバッチ
+               sched.submit("ccc", GenerateConfig(seconds=6, seed=3))]  # 長さが違う → 別のバッチ
+    results = [f.result(timeout=10) for f in futures]
+    assert sorted(gen.calls) == [(["a", "bb"], 4), (["ccc"], 6)]
+    assert [(sr, a.shape, a[0]) for sr, a in results] == [(32000, (4,), 1), (32000, (4,), 2), (32000, (6,), 3)]
+    assert sched.stats()["requests"] == 3
+
+def test_batch_error_reaches_every_caller():
+    gen = FakeMusic()
+    sched = BatchScheduler(gen, window_ms=300, max_batch=8)
+    futures = [sched.submit("boom", GenerateConfig(seconds=4, seed=1)),
+               sched.submit("fine", GenerateConfig(seconds=4, seed=2))]
+    for f in futures:
+        with pytest.raises(RuntimeError, match="boom"):
+            f.result(timeout=10)
+    assert gen.calls == [(["boom", "fine"], 4)]
+    # 失敗の後も次のリクエストは処理される
+    assert sched.generate("ok", GenerateConfig(seconds=4))[1][0] == 2
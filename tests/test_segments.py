@@ -0,0 +1,35 @@
+import numpy as np
+
+from src.segments import equal_power_join, length_buckets, plan_segments, render_segments
+from src.text2music import GenerateConfig
+
+def test_plan_merges_short_and_splits_long():
+    # 3 秒・終わり 5 秒前の切れ目は短すぎるので捨て、28 秒を超える区間は等分
+    assert plan_segments([3.0, 20.0, 45.0], 60.0, min_seconds=8) == [(0.0, 20.0), (20.0, 45.0), (45.0, 60.0)]
+    assert plan_segments([55.0], 60.0, min_seconds=8) == [(0.0, 20.0), (20.0, 40.0), (40.0, 60.0)]
+    assert plan_segments([], 20.0) == [(0.0, 20.0)]
+    assert length_buckets([10.0, 30.0, 11.0, 29.0], max_batch=8) == [[0, 2], [3, 1]]
+    assert length_buckets([10.0, 10.0, 10.0], max_batch=2) == [[0, 1], [2]]
+
+def test_equal_power_join():
+    a, b = np.ones(14, np.float32), np.full(10, 2.0, np.float32)
+    out = equal_power_join([a, b], [10, 10], fade=4)
+    assert out.shape == (20,)
+    assert np.allclose(out[:10], 1.0) and np.allclose(out[14:], 2.0)
+    # 短い区間は繰り返して埋める
+    assert np.allclose(equal_power_join([np.arange(3.0)], [7], fade=0), [0, 1, 2, 0, 1, 2, 0])
+    # 重なりの 4 サンプルは a・cos + b・sin（ゲインの二乗和は 1）
+    t = (np.arange(4) + 0.5) / 4
+    assert np.allclose(out[10:14], np.cos(0.5 * np.pi * t) + 2.0 * np.sin(0.5 * np.pi * t))
+
+def test_render_segments_batches_by_length():
+    calls = []
+
+    def run_jobs(jobs):
+        calls.extend((list(ps), c.seconds, c.seed) for ps, c in jobs)
+        return [[(100, np.full(c.seconds * 100, len(p) / 4, np.float32)) for p in ps] for ps, c in jobs]
+
+    sr, audio = render_segments(["aa", "b", "ccc"], [10.0, 4.5, 10.5], GenerateConfig(seed=7), run_jobs)
+    assert sr == 100 and audio.shape == (2500,)
+    assert calls == [(["b"], 6, 7), (["aa", "ccc"], 12, 8)]
+    assert np.allclose(audio[:1000], 0.5) and np.allclose(audio[1100:1450], 0.25) and np.allclose(audio[1550:], 0.75)
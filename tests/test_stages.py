@@ -0,0 +1,15 @@
+from src.stages import StageMemo, stage_key
+
+def test_memo_per_stage():
+    memo = StageMemo({"audio": 1})
+    k1, k2 = stage_key("prompt a", 10, 1.0), stage_key("prompt b", 10, 1.0)
+    assert k1 == stage_key("prompt a", 10, 1.0) and k1 != k2
+    assert memo.get("audio", k1) is None
+    memo.put("audio", k1, "A")
+    assert memo.get("audio", k1) == "A"
+    # 容量 1 なので k2 を入れると k1 は消える。他の段には影響しない
+    memo.put("audio", k2, "B")
+    memo.put("mux", k1, "out.mp4")
+    assert memo.get("audio", k1) is None
+    assert memo.get("mux", k1) == "out.mp4"
+    assert memo.stats()["audio"] == {"size": 1, "hits": 1, "misses": 2}
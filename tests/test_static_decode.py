@@ -0,0 +1,47 @@
+import torch
+from transformers import EncodecConfig, MusicgenConfig, MusicgenDecoderConfig, MusicgenForConditionalGeneration, T5Config
+
+from src.static_decode import StaticCacheDecoder
+
+def _tiny_musicgen():
+    torch.manual_seed(0)
+    t5 = T5Config(vocab_size=32, d_model=24, d_kv=8, d_ff=48, num_layers=1, num_heads=2)  # 24 != 32 で射影も通す
+    enc = EncodecConfig(sampling_rate=32000, audio_channels=1, num_filters=4, hidden_size=16, codebook_size=64,
+                        upsampling_ratios=[8, 5, 4, 4], target_bandwidths=[1.2], codebook_dim=16, num_lstm_layers=1)
+    dec = MusicgenDecoderConfig(vocab_size=64, hidden_size=32, num_hidden_layers=2, num_attention_heads=2, ffn_dim=64,
+                                num_codebooks=4, pad_token_id=64, bos_token_id=64, decoder_start_token_id=64)
+    m = MusicgenForConditionalGeneration(MusicgenConfig.from_sub_models_config(t5, enc, dec)).eval()
+    for k in ("decoder_start_token_id", "pad_token_id", "bos_token_id"):
+        setattr(m.generation_config, k, 64)
+    return m
+
+def test_matches_hf_generate():
+    m = _tiny_musicgen()
+    input_ids = torch.tensor([[5, 6, 7, 1], [8, 9, 1, 0]])
+    attention_mask = (input_ids != 0).long()
+    fast = StaticCacheDecoder(m)
+    with torch.no_grad():
+        for do_sample in (False, True):
+            torch.manual_seed(1)
+            ref = m.generate(input_ids=input_ids, attention_mask=attention_mask, do_sample=do_sample,
+                             guidance_scale=3.0, temperature=0.9, top_k=20, max_new_tokens=40)
+            torch.manual_seed(1)
+            out = fast.generate_ids(input_ids, attention_mask, 40, guidance_scale=3.0, temperature=0.9,
+                                    top_k=20, do_sample=do_sample)
+            audio = m.audio_encoder.decode(fast.to_audio_codes(out, 2), [None, None]).audio_values
+            assert audio.shape == ref.shape
+            assert torch.allclose(audio, ref, atol=1e-5)
+
+def test_precomputed_encoder_states():
+    m = _tiny_musicgen()
+    input_ids = torch.tensor([[5, 6, 7, 1]])
+    attention_mask = torch.ones_like(input_ids)
+    fast = StaticCacheDecoder(m)
+    with torch.no_grad():
+        hidden = m.text_encoder(input_ids=input_ids, attention_mask=attention_mask).last_hidden_state
+        torch.manual_seed(2)
+        ref = fast.generate_ids(input_ids, attention_mask, 20, guidance_scale=3.0, temperature=1.0, top_k=20)
+        torch.manual_seed(2)
+        out = fast.generate_ids(input_ids, attention_mask, 20, guidance_scale=3.0, temperature=1.0, top_k=20,
+                                encoder_hidden_states=hidden)
+    assert torch.equal(out, ref)
@@ -0,0 +1,51 @@
+import io
+import json
+import threading
+
+from src.telemetry import Telemetry
+
+def test_spans_carry_run_and_parent_across_threads():
+    out = io.StringIO()
+    tel = Telemetry(log_json=True, stream=out)
+
+    def steps():
+        with tel.span("run", level=2):
+            yield 1
+            with tel.span("captions") as s:
+                s.set(frames=4)
+                box = []
+                t = threading.Thread(target=tel.wrap(lambda: box.append(tel.run_id())))
+                t.start(); t.join()
+            yield box[0]
+        return "done"
+
+    gen = tel.bind(steps(), "r1")
+    assert next(gen) == 1
+    # 次のステップは別スレッドから進めても同じ run に付く
+    res = []
+    t = threading.Thread(target=lambda: res.append(next(gen)))
+    t.start(); t.join()
+    assert res == ["r1"]
+    try:
+        next(gen)
+    except StopIteration as e:
+        assert e.value == "done"
+
+    recs = [json.loads(line) for line in out.getvalue().splitlines()]
+    by_name = {r["name"]: r for r in recs}
+    assert set(by_name) == {"run", "captions"}
+    assert all(r["run"] == "r1" for r in recs)
+    assert by_name["captions"]["parent"] == by_name["run"]["span"] and by_name["captions"]["frames"] == 4
+    assert by_name["run"]["level"] == 2 and by_name["run"]["peak_rss_bytes"] > 0
+
+def test_prometheus_text():
+    tel = Telemetry(log_json=False)
+    tel.record("decode", 0.3, tokens=100)
+    tel.record("decode", 7.0)
+    tel.inc("bgmer_runs_total", status="ok")
+    tel.set_gauge("bgmer_queue_depth", 2, queue="jobs")
+    text = tel.prometheus()
+    assert 'bgmer_stage_seconds_bucket{stage="decode",le="0.5"} 1' in text
+    assert 'bgmer_stage_seconds_bucket{stage="decode",le="+Inf"} 2' in text
+    assert 'bgmer_stage_seconds_count{stage="decode"} 2' in text
+    assert 'bgmer_runs_total{status="ok"} 1' in text and 'bgmer_queue_depth{queue="jobs"} 2' in text
@@ -0,0 +1,49 @@
+import io
+
+import numpy as np
+import pytest
+
+from tests.synthetic import make_video
+from src.media import probe
+from src.video2text import (_grab_frame_at, _read_raw_frames, _scaled_size, detect_scene_cuts,
+                             iter_scene_change_frames)
+
+H, W = 4, 6
+
+def _raw(frames: float) -> bytes:
+    """frames 枚分（端数は途中で切れた 1 枚）の rgb24。フレーム i は全画素が i"""
+    n = int(np.ceil(frames))
+    data = np.repeat(np.arange(n, dtype=np.uint8), H * W * 3).tobytes()
+    return data[:int(frames * H * W * 3)]
+
+def test_raw_reader_caps_and_drops_truncated_frame():
+    buf = np.empty((3, H, W, 3), dtype=np.uint8)
+    out = [f.copy() for f in _read_raw_frames(io.BytesIO(_raw(5)), buf)]
+    assert len(out) == 3  # buf の枚数で打ち切る
+    assert all(f.shape == (H, W, 3) for f in out)
+    assert [int(f[0, 0, 0]) for f in out] == [0, 1, 2]
+    # 最後の 1 枚が途中で切れていたら捨てる
+    assert len(list(_read_raw_frames(io.BytesIO(_raw(2.5)), buf))) == 2
+    assert list(_read_raw_frames(io.BytesIO(b""), buf)) == []
+
+@pytest.fixture(scope="module")
+def clip(tmp_path_factory):
+    """1 秒毎にテストパターンが切り替わる 3 秒の動画（カットは 1 秒と 2 秒）"""
+    return make_video(str(tmp_path_factory.mktemp("video") / "cuts.mp4"), 3, "320x240", 25, False, cut_every=1.0)
+
+def test_scene_change_frames_from_pipe(clip):
+    info = probe(clip)
+    w, h = _scaled_size(info)
+    times = []
+    frames = list(iter_scene_change_frames(clip, 0.35, 12, info, times=times))
+    assert len(frames) == 2 and all(f.shape == (h, w, 3) for f in frames)
+    assert np.allclose(times, [1.0, 2.0], atol=0.05)
+    assert np.allclose(detect_scene_cuts(clip, 0.35, info), [1.0, 2.0], atol=0.05)
+    assert len(list(iter_scene_change_frames(clip, 0.35, 1, info))) == 1  # -frames:v で打ち切り
+
+def test_grab_frame_at_seeks(clip):
+    a, b = _grab_frame_at(clip, 0.5), _grab_frame_at(clip, 1.5)
+    assert a.shape == b.shape == (480, 640, 3) and a.dtype == np.uint8
+    assert np.abs(a.astype(np.int16) - b).mean() > 20  # 別の場面のフレーム
+    assert _grab_frame_at(clip, 2.9, width=160).shape == (120, 160, 3)
+    assert _grab_frame_at(clip, 10.0) is None  # 終わりより後ろは None（例外にしない）